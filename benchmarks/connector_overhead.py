@@ -0,0 +1,209 @@
+"""
+Measure the connector's own overhead against a local stand-in Isabelle server
+(isabelle_connector.fake_server), so no Isabelle installation is needed.
+
+For every theory count it records the end-to-end use_theories throughput on
+a cold and a warm result store, the cost of cache misses and hits, the parse
+cost of extract_messages_from_responses and extract_ml_values_from_messages,
+and the peak memory of the parse. With --baseline, a previous result file is
+compared against and regressions beyond --tolerance are reported.
+
+Usage:
+    python benchmarks/connector_overhead.py --n-theories 10 100 1000 10000 50000
+    python benchmarks/connector_overhead.py --baseline connector_overhead.json
+"""
+
+from argparse import ArgumentParser
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from isabelle_client.socket_communication import IsabelleResponse
+from isabelle_connector.fake_server import FakeIsabelleServer
+from isabelle_connector.isabelle_connector import IsabelleConnector
+from isabelle_connector.parse import (
+    extract_messages_from_responses,
+    extract_ml_values_from_messages,
+)
+from isabelle_connector.store import ResultStore
+from isabelle_connector.utils import temp_theory
+
+# metrics where a larger value is a regression
+LOWER_IS_BETTER = (
+    "cold_seconds",
+    "warm_seconds",
+    "miss_seconds",
+    "hit_seconds",
+    "parse_seconds",
+    "parse_peak_mb",
+)
+
+
+def make_theories(n_theories: int, working_directory: str):
+    query = 'ML\\<open> let val res = "Hello, World!" in res end \\<close>'
+    return [
+        temp_theory(
+            working_directory=working_directory,
+            queries=[query],
+            imports=[],
+            name=f"Bench{i}",
+        )
+        for i in range(n_theories)
+    ]
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def measure_end_to_end(server, thys, batch_size, cache_path):
+    connector = IsabelleConnector(
+        name="bench",
+        server_info=server.server_info,
+        working_directory=thys[0].working_directory,
+        cache_path=cache_path,
+    )
+    (values, _), cold = timed(
+        connector.use_theories, thys, batch_size=batch_size, rm_if_temp=False
+    )
+    _, warm = timed(
+        connector.use_theories, thys, batch_size=batch_size, rm_if_temp=False
+    )
+    connector.sessions.shutdown()
+    return {
+        "successful": len([v for v in values.values() if v]),
+        "cold_seconds": cold,
+        "warm_seconds": warm,
+        "cold_theories_per_second": len(thys) / cold,
+        "warm_theories_per_second": len(thys) / warm,
+    }
+
+
+def measure_store(thys, messages, cache_path):
+    store = ResultStore(path=cache_path, isabelle_version="bench")
+    _, miss = timed(store.get_many, thys)
+    store.put_many(messages)
+    _, hit = timed(store.get_many, thys)
+    return {"miss_seconds": miss, "hit_seconds": hit}
+
+
+def measure_parse(server, thys):
+    # the body of a FINISHED response as the server would send it
+    server.sessions.add("bench")
+    arguments = {
+        "session_id": "bench",
+        "theories": [thy.name for thy in thys],
+        "master_dir": thys[0].working_directory,
+    }
+
+    class NoWriter:
+        def write(self, data):
+            pass
+
+    response_type, body = asyncio.run(
+        server.use_theories(NoWriter(), "bench", arguments)
+    )
+    responses = [IsabelleResponse(response_type, json.dumps(body))]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    messages = extract_messages_from_responses(thys, responses)
+    extract_ml_values_from_messages(messages)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return messages, {"parse_seconds": elapsed, "parse_peak_mb": peak / 2**20}
+
+
+def compare(results, baseline, tolerance):
+    previous = {result["theories"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get(result["theories"])
+        if before is None:
+            continue
+        for metric in LOWER_IS_BETTER:
+            if result[metric] > before[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{result['theories']} theories: {metric} "
+                    f"{before[metric]:.4g} -> {result[metric]:.4g}"
+                )
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--n-theories", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--messages-per-theory", type=int, default=1)
+    parser.add_argument("--message-size", type=int, default=0)
+    parser.add_argument("--imported-nodes", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--output", default="connector_overhead.json")
+    parser.add_argument("--baseline", help="previous output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    server = FakeIsabelleServer(
+        latency=args.latency,
+        messages_per_theory=args.messages_per_theory,
+        message_size=args.message_size,
+        imported_nodes=args.imported_nodes,
+        error_rate=args.error_rate,
+        failure_rate=args.failure_rate,
+    ).start()
+
+    results = []
+    for n_theories in args.n_theories:
+        working_directory = tempfile.mkdtemp()
+        thys = make_theories(n_theories, working_directory)
+        result = {"theories": n_theories}
+        result |= measure_end_to_end(
+            server,
+            thys,
+            args.batch_size,
+            os.path.join(working_directory, "end_to_end.sqlite"),
+        )
+        messages, parse_result = measure_parse(server, thys)
+        result |= parse_result
+        result |= measure_store(
+            thys, messages, os.path.join(working_directory, "store.sqlite")
+        )
+        result["max_rss_mb"] = (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+        )
+        print(result)
+        results.append(result)
+    server.stop()
+
+    output = {
+        "config": {
+            key: value for key, value in vars(args).items() if key != "baseline"
+        },
+        "python": sys.version,
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf8") as output_file:
+        json.dump(output, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf8") as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Compare decoding a FINISHED body with json.loads (the previous approach) and
+with the streaming decoder of isabelle_connector.parse, in decode time and
+peak RSS. Each decoder runs in a fresh process, so the peak RSS of one does
+not hide the other's.
+
+The body is either a recorded response (--response, the JSON body of a
+FINISHED use_theories response) or synthesized like the fake server's
+output, with --imported-nodes imported theories next to the requested ones.
+Nodes of Draft theories count as requested.
+
+Usage:
+    python benchmarks/decode_responses.py --n-theories 1000 --imported-nodes 500
+    python benchmarks/decode_responses.py --response finished_body.json
+"""
+
+from argparse import ArgumentParser
+import json
+from multiprocessing import get_context
+import os
+import re
+import resource
+import tempfile
+import time
+
+from isabelle_connector.parse import iter_finished_nodes
+
+
+def synthesize(n_theories, imported_nodes, messages_per_node, message_size):
+    def node(theory_name):
+        return {
+            "node_name": f"/{theory_name}.thy",
+            "theory_name": theory_name,
+            "status": {"ok": True},
+            "messages": [
+                {
+                    "kind": "writeln",
+                    "message": f'val filler_{i} = "{"x" * message_size}": string',
+                    "pos": {"line": i + 1, "offset": 1, "end_offset": 10},
+                }
+                for i in range(messages_per_node)
+            ],
+            "exports": [],
+        }
+
+    nodes = [node(f"HOL.Imported{i}") for i in range(imported_nodes)]
+    nodes += [node(f"Draft.Bench{i}") for i in range(n_theories)]
+    return json.dumps({"ok": True, "errors": [], "nodes": nodes})
+
+
+def decode_full(body, names):
+    decoded = {}
+    for node in json.loads(body)["nodes"]:
+        name = node["theory_name"].removeprefix("Draft.")
+        if name in names:
+            decoded[name] = node["messages"]
+    return decoded
+
+
+def decode_streaming(body, names):
+    return dict(iter_finished_nodes(body, names))
+
+
+DECODERS = {"json_loads": decode_full, "streaming": decode_streaming}
+
+
+def run(decoder, path, names):
+    with open(path, encoding="utf8") as body_file:
+        body = body_file.read()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    decoded = DECODERS[decoder](body, names)
+    elapsed = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "decoder": decoder,
+        "theories": len(decoded),
+        "decode_seconds": elapsed,
+        "peak_rss_mb": after / 2**10,
+        "decode_rss_mb": (after - before) / 2**10,
+    }
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--response", help="recorded FINISHED body")
+    parser.add_argument("--n-theories", type=int, default=1000)
+    parser.add_argument("--imported-nodes", type=int, default=500)
+    parser.add_argument("--messages-per-node", type=int, default=20)
+    parser.add_argument("--message-size", type=int, default=200)
+    parser.add_argument("--output", default="decode_responses.json")
+    args = parser.parse_args()
+
+    if args.response:
+        path = args.response
+    else:
+        body = synthesize(
+            args.n_theories,
+            args.imported_nodes,
+            args.messages_per_node,
+            args.message_size,
+        )
+        fd, path = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf8") as body_file:
+            body_file.write(body)
+        del body
+    with open(path, encoding="utf8") as body_file:
+        names = set(re.findall(r'"theory_name":\s*"Draft\.([^"]*)"', body_file.read()))
+    print(f"{os.path.getsize(path) / 2**20:.1f} MB body, {len(names)} requested nodes")
+
+    results = []
+    for decoder in DECODERS:
+        with get_context("spawn").Pool(1) as pool:
+            result = pool.apply(run, (decoder, path, names))
+        print(result)
+        results.append(result)
+    if not args.response:
+        os.remove(path)
+
+    with open(args.output, "w", encoding="utf8") as output_file:
+        json.dump({"config": vars(args), "results": results}, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Compare parsing pretty-printed ML values with decoding Json_Output values on
+synthetic outputs shaped like template_and_type_extraction_theory results.
+
+Usage:
+    python benchmarks/parse_values.py --rows 1000 10000 100000
+"""
+
+from argparse import ArgumentParser
+import json
+import time
+
+from isabelle_connector.parse import extract_ml_values_from_thy_messages
+
+
+def make_rows(n_rows: int) -> list[tuple]:
+    return [
+        (
+            "HOL/Library/Multiset",
+            f"Multiset.mset_le_thm_{i}",
+            f"?M \\<subseteq># ?N \\<Longrightarrow> size ?M \\<le> size ?N + {i}",
+            ["Multiset.subseteq_mset", "Multiset.size"],
+            [
+                "'a multiset \\<Rightarrow> 'a multiset \\<Rightarrow> bool",
+                "'a multiset \\<Rightarrow> nat",
+            ],
+            "?H1 x_1 x_2 \\<Longrightarrow> ?H2 x_1 \\<le> ?H2 x_2",
+        )
+        for i in range(n_rows)
+    ]
+
+
+def pretty_printed_message(rows: list[tuple]) -> dict:
+    # mimics the ML toplevel: a single line per value, ML booleans and quotes
+    body = ", ".join(
+        "(" + ", ".join(json.dumps(field) for field in row) + ")" for row in rows
+    )
+    return {
+        "kind": "writeln",
+        "message": f"val it =\n   [{body}]:\n   (string * string * thm * string list * typ list * string) list",
+    }
+
+
+def json_message(rows: list[tuple]) -> dict:
+    return {
+        "kind": "writeln",
+        "message": "json_value extraction "
+        + json.dumps(rows, separators=(",", ":"), ensure_ascii=False),
+    }
+
+
+def measure(message: dict) -> float:
+    start = time.perf_counter()
+    values, _ = extract_ml_values_from_thy_messages([message])
+    elapsed = time.perf_counter() - start
+    assert values, "failed to parse"
+    return elapsed
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--output", default="parse_values.json")
+    args = parser.parse_args()
+
+    results = []
+    for n_rows in args.rows:
+        rows = make_rows(n_rows)
+        ml_message, json_msg = pretty_printed_message(rows), json_message(rows)
+        result = {
+            "rows": n_rows,
+            "ml_bytes": len(ml_message["message"]),
+            "json_bytes": len(json_msg["message"]),
+            "ml_seconds": measure(ml_message),
+            "json_seconds": measure(json_msg),
+        }
+        result["speedup"] = result["ml_seconds"] / result["json_seconds"]
+        print(result)
+        results.append(result)
+
+    with open(args.output, "w", encoding="utf8") as output_file:
+        json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Compare the throughput of a single Isabelle server with a pool of servers.
+
+Usage:
+    python benchmarks/pool_throughput.py --n-theories 2000 --n-servers 4
+"""
+
+from argparse import ArgumentParser
+import json
+import os
+import tempfile
+import time
+
+from isabelle_connector.isabelle_connector import IsabelleConnector
+from isabelle_connector.pool import IsabelleConnectorPool
+from isabelle_connector.utils import temp_theory
+
+
+def make_theories(n_theories: int, working_directory: str):
+    query = 'ML\\<open> let val res = "Hello, World!" in res end \\<close>'
+    return [
+        temp_theory(working_directory=working_directory, queries=[query], imports=[])
+        for _ in range(n_theories)
+    ]
+
+
+def run(connector, n_theories, batch_size, working_directory):
+    thys = make_theories(n_theories, working_directory)
+    start = time.perf_counter()
+    values, _ = connector.use_theories(thys, batch_size=batch_size, use_cache=False)
+    elapsed = time.perf_counter() - start
+    return {
+        "theories": n_theories,
+        "successful": len([v for v in values.values() if v]),
+        "seconds": elapsed,
+        "theories_per_second": n_theories / elapsed,
+    }
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--n-theories", type=int, default=1000)
+    parser.add_argument("--n-servers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--output", default="pool_throughput.json")
+    args = parser.parse_args()
+
+    working_directory = tempfile.mkdtemp()
+    single = IsabelleConnector(name="bench_single")
+    pool = IsabelleConnectorPool(name="bench_pool", n_servers=args.n_servers)
+
+    results = {
+        "single": run(single, args.n_theories, args.batch_size, working_directory),
+        "pool": run(pool, args.n_theories, args.batch_size, working_directory),
+        "n_servers": args.n_servers,
+        "batch_size": args.batch_size,
+        "cpu_count": os.cpu_count(),
+    }
+    single.shutdown()
+    pool.shutdown()
+
+    print(json.dumps(results, indent=2))
+    with open(args.output, "w", encoding="utf8") as output_file:
+        json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
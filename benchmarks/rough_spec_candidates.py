@@ -0,0 +1,74 @@
+"""
+Compare candidate generation of RoughSpec.templateCandidatesPolySeq (typed
+backtracking) with the reference enumeration of every k-permutation
+(RoughSpec.templateCandidatesPolyEnum) on the same templates.
+
+The input is a JSON list of [template, [function, ...]] pairs, e.g. taken from
+template_and_type_extraction_theory results.
+
+Usage:
+    python benchmarks/rough_spec_candidates.py jobs.json --imports .../RoughSpec
+"""
+
+from argparse import ArgumentParser, Namespace
+import json
+import os
+import tempfile
+
+from isabelle_connector.data_extraction import template_candidates_theory
+from isabelle_connector.isabelle_connector import IsabelleConnector
+
+
+def run(connector, jobs, configs, function):
+    thy = template_candidates_theory(jobs, configs, function=function)
+    values, errs = connector.use_theories([thy], use_cache=False)
+    if errs[thy]:
+        print(f"{function}: {errs[thy]}")
+    (rows,) = values[thy]
+    return {template: (candidates, ms) for template, candidates, ms in rows}
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("jobs")
+    parser.add_argument("--imports", nargs="+", required=True)
+    parser.add_argument("--output", default="rough_spec_candidates.json")
+    args = parser.parse_args()
+
+    with open(args.jobs, encoding="utf8") as jobs_file:
+        jobs = [(template, funs) for template, funs in json.load(jobs_file)]
+    configs = Namespace(imports=args.imports, root_dir=tempfile.mkdtemp())
+    connector = IsabelleConnector(name="bench_rough_spec")
+
+    typed = run(connector, jobs, configs, "RoughSpec.templateCandidatesPolySeq")
+    enum = run(connector, jobs, configs, "RoughSpec.templateCandidatesPolyEnum")
+    connector.shutdown()
+
+    results = []
+    for template, funs in jobs:
+        typed_candidates, typed_ms = typed[template]
+        enum_candidates, enum_ms = enum[template]
+        results.append(
+            {
+                "template": template,
+                "functions": len(funs),
+                "candidates": len(typed_candidates),
+                "same_candidates": sorted(typed_candidates) == sorted(enum_candidates),
+                "typed_ms": typed_ms,
+                "enum_ms": enum_ms,
+                "typed_candidates_per_second": len(typed_candidates)
+                / max(typed_ms / 1000, 1e-3),
+                "enum_candidates_per_second": len(enum_candidates)
+                / max(enum_ms / 1000, 1e-3),
+            }
+        )
+        print(results[-1])
+
+    with open(args.output, "w", encoding="utf8") as output_file:
+        json.dump(
+            {"cpu_count": os.cpu_count(), "results": results}, output_file, indent=2
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Measure the memory and time cost of Theory objects, for the current
+isabelle_types and for the one at a git revision (the baseline), each in a
+fresh process: allocated memory per 10k theories after building them, and
+the time to build them, to fingerprint each of them four times (as a use of
+the result store does) and to write them to disk.
+
+The theories are shaped like extraction wrappers: the same imports, each
+from a list of its own, and one ML block per theory.
+
+Usage:
+    python benchmarks/theory_memory.py --n-theories 20000 --baseline-rev HEAD~1
+"""
+
+from argparse import ArgumentParser
+import importlib.util
+import json
+from multiprocessing import get_context
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+IMPORTS = [
+    "HOL-Library.Multiset",
+    "HOL-Library.FSet",
+    "/home/user/lemma-exploration/isabelle-thys/Extract",
+    "/home/user/lemma-exploration/isabelle-thys/ExtractLemmas",
+]
+
+
+def load_types(rev: str | None):
+    if rev is None:
+        from isabelle_connector import isabelle_types
+
+        return isabelle_types
+    source = subprocess.run(
+        ["git", "show", f"{rev}:isabelle_connector/isabelle_types.py"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    with tempfile.TemporaryDirectory() as source_dir:
+        source_path = os.path.join(source_dir, "baseline_isabelle_types.py")
+        with open(source_path, "w", encoding="utf8") as source_file:
+            source_file.write(source)
+        spec = importlib.util.spec_from_file_location(
+            "baseline_isabelle_types", source_path
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module
+
+
+def run(rev, n_theories, query_size):
+    Theory = load_types(rev).Theory
+    working_directory = tempfile.mkdtemp()
+    tracemalloc.start()
+    start = time.perf_counter()
+    thys = []
+    for i in range(n_theories):
+        thy = Theory(
+            name=f"Extract_Theory_{i}",
+            working_directory=working_directory,
+            imports=list(IMPORTS),
+            queries=[],
+        )
+        thy.add_ml_block(f'val _ = Extract.extract @{{context}} "{"x" * query_size}"')
+        thys.append(thy)
+    build_seconds = time.perf_counter() - start
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(4):
+        for thy in thys:
+            thy.content_hash()
+    hash_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for thy in thys:
+        thy.write_to_file()
+    write_seconds = time.perf_counter() - start
+    shutil.rmtree(working_directory)
+    return {
+        "theory_types": rev or "current",
+        "allocated_mb_per_10k": allocated / 2**20 * 10_000 / n_theories,
+        "build_seconds": build_seconds,
+        "fingerprint_seconds": hash_seconds,
+        "write_seconds": write_seconds,
+    }
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--n-theories", type=int, default=10_000)
+    parser.add_argument("--query-size", type=int, default=200)
+    parser.add_argument("--baseline-rev", default="HEAD~1")
+    parser.add_argument("--output", default="theory_memory.json")
+    args = parser.parse_args()
+
+    results = []
+    for rev in [args.baseline_rev, None]:
+        with get_context("spawn").Pool(1) as pool:
+            result = pool.apply(run, (rev, args.n_theories, args.query_size))
+        print(result)
+        results.append(result)
+
+    with open(args.output, "w", encoding="utf8") as output_file:
+        json.dump({"config": vars(args), "results": results}, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
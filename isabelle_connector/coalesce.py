@@ -0,0 +1,81 @@
+from collections.abc import Callable
+from concurrent.futures import Future
+from dataclasses import dataclass
+import os
+import threading
+
+from isabelle_connector.isabelle_types import IsabelleMessage, Theory
+
+type WorkKey = tuple[str, str, str]
+
+
+def work_key(thy: Theory) -> WorkKey:
+    """
+    Theories with the same key do the same work: theories with generated
+    names whatever those names, any other theory only with itself.
+    """
+    content = thy.body_hash() if thy.generated_name else thy.content_hash()
+    return (content, thy.session, os.path.abspath(thy.working_directory))
+
+
+@dataclass
+class Coalescer:
+    r"""
+    Shares the execution of theories that do the same work between the
+    theories of one call and between concurrent callers in this process.
+
+    Of every group of theories with the same :func:`work_key`, only the first
+    one is run, and only if no other caller is already running that work;
+    otherwise the caller waits for the other's result. The messages are
+    handed to every theory of the group under its own name, but as they are:
+    names and positions inside them (e.g. ``Draft.<name>``) still refer to
+    the theory that ran.
+    """
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: dict[WorkKey, Future] = {}
+
+    def run(
+        self,
+        thys: list[Theory],
+        run: Callable[[list[Theory]], dict[Theory, list[IsabelleMessage]]],
+    ) -> dict[Theory, list[IsabelleMessage]]:
+        """
+        Messages of ``thys``, running ``run`` on one theory per piece of work
+        that is not in flight yet. Theories whose work failed are left out,
+        as ``run`` leaves out its failed theories.
+        """
+        groups: dict[WorkKey, list[Theory]] = {}
+        for thy in thys:
+            groups.setdefault(work_key(thy), []).append(thy)
+        owned, waiting = {}, {}
+        with self._lock:
+            for key, group in groups.items():
+                if key in self._in_flight:
+                    waiting[key] = self._in_flight[key]
+                else:
+                    self._in_flight[key] = Future()
+                    owned[key] = group
+
+        results = {}
+        try:
+            if owned:
+                results = run([group[0] for group in owned.values()])
+        finally:
+            with self._lock:
+                for key, group in owned.items():
+                    self._in_flight.pop(key).set_result(results.get(group[0]))
+
+        messages = {}
+        outcomes = {key: results.get(group[0]) for key, group in owned.items()}
+        outcomes |= {key: future.result() for key, future in waiting.items()}
+        for key, thy_messages in outcomes.items():
+            if thy_messages is not None:
+                for thy in groups[key]:
+                    messages[thy] = thy_messages
+        return messages
+
+
+# shared by all connectors of the process
+SHARED_COALESCER = Coalescer()
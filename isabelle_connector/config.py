@@ -1,11 +1,6 @@
+from functools import cache
 from pathlib import Path
 
-from dotenv import load_dotenv
-from loguru import logger
-
-# Load environment variables from .env file if it exists
-load_dotenv()
-
 # Paths
 PROJ_ROOT = Path(__file__).resolve().parents[1]
 DATA_DIR = PROJ_ROOT / "data"
@@ -22,14 +17,34 @@ FIGURES_DIR = REPORTS_DIR / "figures"
 HOL_DIR = Path().home() / "Isabelle2024" / "src" / "HOL"
 # AFP_DIR = Path().home() / "lemma-exploration" / "data" /
 
-# If tqdm is installed, configure loguru with tqdm.write
-# https://github.com/Delgan/loguru/issues/135
-try:
-    from tqdm import tqdm
-
-    logger.remove(0)
-    logger.add(lambda msg: tqdm.write(msg, end=""), colorize=True)
-except ModuleNotFoundError:
-    pass
-except ValueError:
-    pass
+
+def load_environment() -> None:
+    """Load environment variables from the .env file, if it exists."""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+
+@cache
+def configure_logger():
+    from loguru import logger
+
+    # If tqdm is installed, configure loguru with tqdm.write
+    # https://github.com/Delgan/loguru/issues/135
+    try:
+        from tqdm import tqdm
+
+        logger.remove(0)
+        logger.add(lambda msg: tqdm.write(msg, end=""), colorize=True)
+    except ModuleNotFoundError:
+        pass
+    except ValueError:
+        pass
+    return logger
+
+
+def __getattr__(name: str):
+    # loguru and tqdm are only imported once the logger is used
+    if name == "logger":
+        return configure_logger()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,283 @@
+"""
+Long-lived Isabelle servers shared by connectors across processes.
+
+A registry file records, per server name, the server info line (address,
+port and password), the process ID of the server, the warm sessions handed
+back by detached connectors, the connectors currently attached (a token per
+connector, with the process ID it runs in) and the time of last use. A watcher process per server shuts it down once no process has
+been attached for ``idle_timeout`` seconds.
+
+Usage:
+    python -m isabelle_connector.daemon list
+    python -m isabelle_connector.daemon stop NAME
+"""
+
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from dataclasses import dataclass
+import fcntl
+import json
+import os
+import subprocess
+import sys
+import time
+
+DEFAULT_REGISTRY_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "isabelle-connector", "servers.json"
+)
+
+
+def pid_alive(pid: int | None) -> bool:
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def server_alive(server_info: str) -> bool:
+    """Whether the server answers an ``echo``."""
+    from isabelle_client.utils import get_isabelle_client
+
+    try:
+        get_isabelle_client(server_info).echo("")
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def new_entry(server_info: str, pid: int | None, idle_timeout: float) -> dict:
+    return {
+        "server_info": server_info,
+        "pid": pid,
+        "idle_timeout": idle_timeout,
+        "sessions": {},
+        "attached": {},
+        "last_used": time.time(),
+    }
+
+
+def drop_dead(entry: dict) -> None:
+    """Drop the attachments of connectors whose process has died."""
+    entry["attached"] = {
+        token: pid for token, pid in entry["attached"].items() if pid_alive(pid)
+    }
+
+
+def take_sessions(entry: dict, token: str) -> dict[str, list[str]]:
+    """Attach the connector ``token`` to ``entry`` and take its warm sessions."""
+    sessions, entry["sessions"] = entry["sessions"], {}
+    drop_dead(entry)
+    entry["attached"][token] = os.getpid()
+    entry["last_used"] = time.time()
+    return sessions
+
+
+@dataclass
+class ServerRegistry:
+    """
+    The registry file of shared servers. Every change holds an exclusive
+    lock on ``<path>.lock`` and replaces the file atomically.
+
+    :param path: location of the registry file.
+    """
+
+    path: str = DEFAULT_REGISTRY_PATH
+
+    @contextmanager
+    def locked(self):
+        """The registry entries, written back when the block exits normally."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(f"{self.path}.lock", "w", encoding="utf8") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            entries = self.entries()
+            yield entries
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf8") as tmp_file:
+                json.dump(entries, tmp_file, indent=2)
+            os.replace(tmp_path, self.path)
+
+    def entries(self) -> dict[str, dict]:
+        try:
+            with open(self.path, encoding="utf8") as registry_file:
+                return json.load(registry_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def get(self, name: str) -> dict | None:
+        return self.entries().get(name)
+
+    def register(
+        self, name: str, server_info: str, pid: int | None, idle_timeout: float
+    ) -> None:
+        with self.locked() as entries:
+            entries[name] = new_entry(server_info, pid, idle_timeout)
+
+    def attach(self, name: str, token: str) -> tuple[dict, dict[str, list[str]]] | None:
+        """
+        Attach the connector ``token`` to ``name`` and take its warm sessions,
+        so that no other connector uses them at the same time.
+        """
+        with self.locked() as entries:
+            entry = entries.get(name)
+            if entry is None:
+                return None
+            return entry, take_sessions(entry, token)
+
+    def detach(self, name: str, token: str, sessions: dict[str, list[str]]) -> None:
+        """Detach the connector ``token`` from ``name`` and hand back its sessions."""
+        with self.locked() as entries:
+            entry = entries.get(name)
+            if entry is None:
+                return
+            for session, session_ids in sessions.items():
+                entry["sessions"].setdefault(session, []).extend(session_ids)
+            entry["attached"].pop(token, None)
+            entry["last_used"] = time.time()
+
+    def remove(self, name: str) -> dict | None:
+        with self.locked() as entries:
+            return entries.pop(name, None)
+
+    def idle_since(self, name: str) -> float | None:
+        """
+        Time since which nobody is attached to ``name``, ``None`` while some
+        live process is; attachments of dead processes are dropped.
+        """
+        with self.locked() as entries:
+            entry = entries.get(name)
+            if entry is None:
+                return None
+            drop_dead(entry)
+            return None if entry["attached"] else entry["last_used"]
+
+
+def start_server(name: str, port: int | None = None, log_file: str | None = None):
+    """
+    Start ``isabelle server`` in a session of its own, so that it outlives
+    this process, and return its info line and process ID.
+    """
+    args = ["isabelle", "server", "-n", name]
+    if port is not None:
+        args += ["-p", str(port)]
+    if log_file is not None:
+        args += ["-L", log_file]
+    server = subprocess.Popen(args, stdout=subprocess.PIPE, start_new_session=True)
+    server_info = server.stdout.readline().decode("utf-8")
+    server.stdout.close()
+    return server_info, server.pid
+
+
+def spawn_watcher(name: str, registry: ServerRegistry, poll: float = 10.0) -> None:
+    subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "isabelle_connector.daemon",
+            "--registry",
+            registry.path,
+            "watch",
+            name,
+            "--poll",
+            str(poll),
+        ],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def attach_server(
+    name: str,
+    token: str,
+    registry: ServerRegistry | None = None,
+    idle_timeout: float = 600.0,
+    port: int | None = None,
+    log_file: str | None = None,
+) -> tuple[str, int | None, dict[str, list[str]]]:
+    """
+    Attach the connector ``token`` to the shared server ``name``, starting it
+    (and its watcher) if it is not running. Returns the server info line, the
+    server's process ID and the warm sessions taken over from earlier
+    connectors, by logic.
+
+    The registry stays locked until the connector is attached, so that of
+    several connectors attaching at once only one starts the server.
+    """
+    registry = registry or ServerRegistry()
+    with registry.locked() as entries:
+        entry = entries.get(name)
+        if entry is not None and server_alive(entry["server_info"]):
+            return entry["server_info"], entry["pid"], take_sessions(entry, token)
+        server_info, pid = start_server(name, port, log_file)
+        entries[name] = new_entry(server_info, pid, idle_timeout)
+        take_sessions(entries[name], token)
+    spawn_watcher(name, registry)
+    return server_info, pid, {}
+
+
+def stop_server(name: str, registry: ServerRegistry | None = None) -> bool:
+    """Shut down the shared server ``name`` and forget it."""
+    from isabelle_client.utils import get_isabelle_client
+
+    entry = (registry or ServerRegistry()).remove(name)
+    if entry is None:
+        return False
+    try:
+        get_isabelle_client(entry["server_info"]).shutdown()
+    except OSError:
+        pass
+    return True
+
+
+def watch(name: str, registry: ServerRegistry, poll: float = 10.0) -> None:
+    """Shut down ``name`` once it has been idle for its ``idle_timeout``."""
+    while True:
+        time.sleep(poll)
+        entry = registry.get(name)
+        if entry is None:
+            return
+        if not server_alive(entry["server_info"]):
+            registry.remove(name)
+            return
+        idle_since = registry.idle_since(name)
+        if idle_since is not None and time.time() - idle_since > entry["idle_timeout"]:
+            stop_server(name, registry)
+            return
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--registry", default=DEFAULT_REGISTRY_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list")
+    stop_parser = commands.add_parser("stop")
+    stop_parser.add_argument("name")
+    watch_parser = commands.add_parser("watch")
+    watch_parser.add_argument("name")
+    watch_parser.add_argument("--poll", type=float, default=10.0)
+    args = parser.parse_args()
+
+    registry = ServerRegistry(args.registry)
+    match args.command:
+        case "list":
+            for name, entry in registry.entries().items():
+                n_sessions = sum(len(ids) for ids in entry["sessions"].values())
+                print(
+                    f"{name}: {entry['server_info'].strip()}, "
+                    f"{len(entry['attached'])} attached, {n_sessions} warm sessions"
+                )
+        case "stop":
+            if not stop_server(args.name, registry):
+                sys.exit(f"No server {args.name!r}")
+        case "watch":
+            watch(args.name, registry, args.poll)
+
+
+if __name__ == "__main__":
+    main()
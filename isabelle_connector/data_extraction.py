@@ -1,9 +1,18 @@
 from argparse import Namespace
+from collections.abc import Callable, Iterator
+import hashlib
+import mmap
 import os
 
 from isabelle_connector.config import INTERIM_DATA_DIR
 from isabelle_connector.isabelle_types import Theory
-from isabelle_connector.utils import path_to_theory_name, temp_theory
+from isabelle_connector.session_index import SessionIndex, load_session_index
+from isabelle_connector.source_index import SourceIndex
+from isabelle_connector.utils import (
+    ml_string,
+    path_to_theory_name,
+    temp_theory,
+)
 
 
 def transitions_theory(thy: Theory, configs: Namespace) -> Theory:
@@ -15,6 +24,7 @@ def transitions_theory(thy: Theory, configs: Namespace) -> Theory:
     """
     new_thy_name = f"Transitions_{path_to_theory_name(thy.name)}"
     query = f"""
+            val _ = Json_Output.output "transitions" (
             let
                 val filename = "{thy.working_directory}/{thy.name}.thy"
                 val stream = TextIO.openIn filename
@@ -23,8 +33,11 @@ def transitions_theory(thy: Theory, configs: Namespace) -> Theory:
                 val transitions = Extract.parse_text theory content
                 val results = map (fn (trans, string) => (Toplevel.name_of trans, string)) transitions;
             in
-                ("{thy.name}", results)
-            end"""
+                Json_Output.tuple [
+                    Json_Output.string "{thy.name}",
+                    Json_Output.list (Json_Output.pair Json_Output.string Json_Output.string) results
+                ]
+            end)"""
 
     thy = temp_theory(
         name=new_thy_name,
@@ -37,51 +50,97 @@ def transitions_theory(thy: Theory, configs: Namespace) -> Theory:
     return thy
 
 
-def hol_session(hol_thy):
-    # return "HOL"
-    name = hol_thy.name
-    if "/" not in name:
-        return "HOL"
-
-    path, base_name = name.rsplit("/", 1)
-    if path.startswith("HOLCF/IOA"):
-        session = "-".join(path.split("/")[1:])
-    elif path.startswith("HOLCF"):
-        session = "-".join(path.split("/"))
-    elif path.startswith("MicroJava"):
-        session = "-".join(["HOL", "MicroJava"])
-    elif path.startswith("Decision_Procs"):
-        session = "HOL-Decision_Procs"
-    elif path.startswith("Corec_Examples"):
-        session = "HOL-Corec_Examples"
-    elif path.startswith("Types_To_Sets"):
-        session = "HOL-Types_To_Sets"
-    elif path.startswith("SPARK/Examples"):
-        session = "HOL-SPARK-Examples"
-    elif path.startswith("UNITY"):
-        session = "HOL-UNITY"
-    elif path.startswith("Imperative_HOL"):
-        session = "HOL-Imperative_HOL"
-    elif path.startswith("Datatype_Examples"):
-        session = "HOL-Datatype_Examples"
-    elif path.startswith("Auth"):
-        session = "HOL-Auth"
-    elif path.startswith("Matrix_LP"):
-        session = "HOL-Matrix_LP"
-    else:
-        session = "-".join(["HOL"] + path.split("/"))
-
-    return session
+def transition_spans_theory(thys: list[Theory], configs: Namespace) -> Theory:
+    """
+    Split the source files of several theories into transitions in a single
+    wrapper theory.
+
+    Unlike ``transitions_theory`` only the command name and the byte offsets
+    of every transition come back, as one ``transition_spans`` value
+    ``[[path, [[name, start, end], ...]], ...]``; the text is sliced from the
+    files with :func:`iter_transitions`.
+    """
+    paths = [f"{thy.working_directory}/{thy.name}.thy" for thy in thys]
+    ml_paths = ", ".join(ml_string(path) for path in paths)
+    query = f"""
+            val _ = Json_Output.output "transition_spans" (
+                Json_Output.list (fn (path, spans) => Json_Output.tuple [
+                    Json_Output.string path,
+                    Json_Output.list (fn (name, start, stop) => Json_Output.tuple [
+                        Json_Output.string name, Json_Output.int start, Json_Output.int stop
+                    ]) spans
+                ]) (Extract.parse_file_spans @{{theory}} [{ml_paths}]))"""
+    digest = hashlib.sha256(query.encode("utf8")).hexdigest()[:32]
+    thy = temp_theory(
+        name=f"Transition_Spans_{digest}",
+        imports=configs.imports,
+        working_directory=os.path.join(
+            INTERIM_DATA_DIR, os.path.basename(configs.root_dir)
+        ),
+    )
+    thy.add_ml_block(query)
+    return thy
+
+
+def iter_transitions(
+    path: str, spans: list[tuple[str, int, int]], use_mmap: bool = False
+) -> Iterator[tuple[str, str]]:
+    """
+    Yield ``(command name, text)`` for the spans of ``transition_spans_theory``,
+    reading only the slices of the file that are asked for.
+
+    :param use_mmap: map the file into memory instead of seeking, which pays
+        off for large files.
+    """
+    if not spans:
+        return
+    with open(path, "rb") as src:
+        if use_mmap:
+            with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for name, start, stop in spans:
+                    yield name, data[start:stop].decode("utf8")
+        else:
+            for name, start, stop in spans:
+                src.seek(start)
+                yield name, src.read(stop - start).decode("utf8")
+
+
+def session_index(configs: Namespace) -> SessionIndex:
+    """
+    The index of the ROOT files of ``configs.session_dirs`` (default:
+    ``configs.root_dir``).
+    """
+    session_dirs = getattr(configs, "session_dirs", None) or [str(configs.root_dir)]
+    return load_session_index(tuple(session_dirs))
+
+
+def theory_session(src_thy: Theory, configs: Namespace) -> str:
+    """The session of a source theory."""
+    return session_index(configs).resolve(src_thy)
+
+
+def theory_import(src_thy: Theory, session: str, configs: Namespace) -> str:
+    """
+    How a wrapper in ``session`` imports a source theory: by its qualified
+    name if a ROOT file lists it in ``session``, else by the path of its file,
+    since a session that merely covers its imports does not contain it.
+    """
+    path = os.path.abspath(os.path.join(src_thy.working_directory, src_thy.name))
+    listed_in = session_index(configs).session_of_file(path)
+    if listed_in == session:
+        return f"{session}.{os.path.basename(path)}"
+    return path
 
 
 def template_and_type_extraction_theory(src_thy: Theory, configs: Namespace) -> Theory:
     name = src_thy.name
-    path, base_name = name.rsplit("/", 1) if "/" in name else ("", name)
-    session = hol_session(src_thy)
-    import_name = f"{session}.{base_name}"
+    base_name = name.rsplit("/", 1)[-1]
+    session = theory_session(src_thy, configs)
+    import_name = theory_import(src_thy, session, configs)
 
     new_thy_name = f"Extract_{path_to_theory_name(name)}"
     query = f"""
+        val _ = Json_Output.output "extraction" (
         let
             fun type_of_const symbol =
               let 
@@ -100,18 +159,18 @@ def template_and_type_extraction_theory(src_thy: Theory, configs: Namespace) ->
                 val symbols = RoughSpec_Utils.const_names_of_term @{{context}} term
                 val typs = map (type_of_const) symbols
             in
-            (
-                "{name}",
-                name,
-                thm,
-                symbols,
-                typs,
-                template_str
-            )
+                Json_Output.tuple [
+                    Json_Output.string "{name}",
+                    Json_Output.string name,
+                    Json_Output.thm @{{context}} thm,
+                    Json_Output.list Json_Output.string symbols,
+                    Json_Output.list (Json_Output.typ @{{context}}) typs,
+                    Json_Output.string template_str
+                ]
             end) thms;
         in
-            results
-        end"""
+            Json_Output.tuple results
+        end)"""
     thy = temp_theory(
         name=new_thy_name,
         session=session,
@@ -122,3 +181,293 @@ def template_and_type_extraction_theory(src_thy: Theory, configs: Namespace) ->
     )
     thy.add_ml_block(query)
     return thy
+
+
+def session_extraction_theories(
+    src_thys: list[Theory], configs: Namespace, chunk_size: int = 16
+) -> list[Theory]:
+    """
+    Like ``template_and_type_extraction_theory``, but with one wrapper per
+    chunk of up to ``chunk_size`` source theories of the same session
+    instead of one per source theory.
+
+    Each wrapper imports the source theories of its chunk and collects their
+    theorems with ``Extract_Lemmas.get_thms_by_theory``, a single walk over
+    the fact table instead of one ``find_theorems`` search per theory. The
+    emitted ``extraction`` rows have the same shape as those of
+    ``template_and_type_extraction_theory``, for all theories of the chunk.
+    Chunking bounds the memory of a wrapper and the theories lost when one
+    of its imports fails; ``chunk_size=1`` gives one wrapper per theory.
+    """
+    by_session: dict[str, list[Theory]] = {}
+    for src_thy in src_thys:
+        by_session.setdefault(theory_session(src_thy, configs), []).append(src_thy)
+
+    thys = []
+    for session, session_thys in by_session.items():
+        for start in range(0, len(session_thys), chunk_size):
+            chunk = session_thys[start : start + chunk_size]
+            thys.append(session_extraction_theory(session, chunk, configs))
+    return thys
+
+
+def session_extraction_theory(
+    session: str, src_thys: list[Theory], configs: Namespace
+) -> Theory:
+    """One wrapper of :func:`session_extraction_theories`."""
+    names = [(thy.name, thy.name.rsplit("/", 1)[-1]) for thy in src_thys]
+    ml_names = ", ".join(
+        f"({ml_string(base_name)}, {ml_string(name)})" for name, base_name in names
+    )
+    query = f"""
+    val _ = Json_Output.output "extraction" (
+    let
+        fun type_of_const symbol = Term.type_of (Syntax.read_term @{{context}} symbol)
+        val names = [{ml_names}]
+        val thms_by_theory = Extract_Lemmas.get_thms_by_theory (map fst names) @{{context}}
+        fun row src_name (name, thm) =
+        let
+            val term = Thm.prop_of thm
+            val template = AbstractLemma.abstract_term_poly @{{context}} term
+            val template_str = Print_Mode.setmp [] (Syntax.string_of_term @{{context}}) template
+            val symbols = RoughSpec_Utils.const_names_of_term @{{context}} term
+            val typs = map (type_of_const) symbols
+        in
+            Json_Output.tuple [
+                Json_Output.string src_name,
+                Json_Output.string name,
+                Json_Output.thm @{{context}} thm,
+                Json_Output.list Json_Output.string symbols,
+                Json_Output.list (Json_Output.typ @{{context}}) typs,
+                Json_Output.string template_str
+            ]
+        end
+    in
+        Json_Output.tuple (maps (fn ((_, src_name), (_, thms)) =>
+            map (row src_name) thms) (names ~~ thms_by_theory))
+    end)"""
+    digest = hashlib.sha256(ml_names.encode("utf8")).hexdigest()[:16]
+    thy = temp_theory(
+        name=f"Extract_Session_{path_to_theory_name(session)}_{digest}",
+        session=session,
+        imports=configs.imports
+        + [theory_import(src_thy, session, configs) for src_thy in src_thys],
+        working_directory=os.path.join(
+            INTERIM_DATA_DIR, os.path.basename(configs.root_dir)
+        ),
+    )
+    thy.add_ml_block(query)
+    return thy
+
+
+def ml_template_jobs(jobs: list[tuple[str, list[str]]]) -> str:
+    """``(template, function names)`` pairs as the elements of an ML list."""
+    return ", ".join(
+        f"({ml_string(template)}, [{', '.join(ml_string(f) for f in funs)}])"
+        for template, funs in jobs
+    )
+
+
+def template_candidates_theory(
+    jobs: list[tuple[str, list[str]]],
+    configs: Namespace,
+    limit: int | None = None,
+    function: str = "RoughSpec.templateCandidatesPolySeq",
+) -> Theory:
+    """
+    Fill the holes of several templates with RoughSpec in one theory.
+
+    Emits one ``template_candidates`` value: for every job, the template, its
+    candidate conjectures and the milliseconds it took.
+
+    :param jobs: ``(template, function names)`` pairs.
+    :param limit: take at most this many candidates per template.
+    :param function: the candidate generator; ``templateCandidatesPolyEnum``
+        gives the reference enumeration.
+    """
+    take = "I" if limit is None else f"Seq.take {limit}"
+    if not function.endswith("Seq"):
+        take = f"{take} o Seq.of_list"
+    query = f"""
+        val _ = Json_Output.output "template_candidates" (
+        Json_Output.list (fn (template, funs) =>
+        let
+            val (timing, candidates) = Timing.timing (fn () =>
+              Seq.list_of (({take}) ({function} @{{context}} template funs))) ()
+        in
+            Json_Output.tuple [
+                Json_Output.string template,
+                Json_Output.list (Json_Output.term @{{context}}) candidates,
+                Json_Output.int (Time.toMilliseconds (#elapsed timing))
+            ]
+        end) [{ml_template_jobs(jobs)}])"""
+    # named by content, so a repeated chunk is served from the result store
+    digest = hashlib.sha256(query.encode("utf8")).hexdigest()[:32]
+    thy = temp_theory(
+        name=f"Candidates_{digest}",
+        imports=configs.imports,
+        working_directory=os.path.join(
+            INTERIM_DATA_DIR, os.path.basename(configs.root_dir)
+        ),
+    )
+    thy.add_ml_block(query)
+    return thy
+
+
+def template_candidates(
+    connector,
+    jobs: list[tuple[str, list[str]]],
+    configs: Namespace,
+    chunk_size: int = 50,
+    limit: int | None = None,
+    **kwargs,
+) -> dict[str, tuple[list[str], int]]:
+    """
+    Run ``RoughSpec.templateCandidatesPoly`` over many templates, ``chunk_size``
+    templates per theory, and return the candidates and milliseconds per
+    template. Extra arguments go to ``connector.use_theories``.
+    """
+    thys = [
+        template_candidates_theory(jobs[i : i + chunk_size], configs, limit)
+        for i in range(0, len(jobs), chunk_size)
+    ]
+    values, errs = connector.use_theories(thys, **kwargs)
+    results = {}
+    for thy in thys:
+        for value in values.get(thy, []):
+            for template, candidates, milliseconds in value:
+                results[template] = (candidates, milliseconds)
+        for err in errs.get(thy, []):
+            print(f"Error in {thy.name}: {err}")
+    return results
+
+
+def conjecture_check_theory(
+    jobs: list[tuple[str, list[str]]],
+    configs: Namespace,
+    testers: tuple[str, ...] = ("random", "exhaustive"),
+    timeout: float = 1.0,
+    budget: float = 60.0,
+) -> Theory:
+    """
+    Generate the candidates of several templates with RoughSpec and check them
+    for counterexamples with ``RoughSpec.check_conjectures``, all candidates of
+    the theory in parallel.
+
+    Emits one ``conjecture_checks`` value: for every job, the template and a
+    ``[candidate, verdict, milliseconds]`` row per candidate. The verdict is
+    ``survived``, ``refuted``, ``timeout``, ``error`` or ``budget`` (not
+    checked before the budget ran out).
+
+    :param jobs: ``(template, function names)`` pairs.
+    :param testers: Quickcheck testers, cheapest first; each one only runs on
+        the survivors of the previous ones.
+    :param timeout: seconds per candidate and tester.
+    :param budget: seconds after which no further check is started.
+    """
+    query = f"""
+        val jobs = [{ml_template_jobs(jobs)}]
+        val candidates = map (fn (template, funs) =>
+            Seq.list_of (RoughSpec.templateCandidatesPolySeq @{{context}} template funs)) jobs
+        val checked = RoughSpec.check_conjectures @{{context}}
+            [{", ".join(ml_string(tester) for tester in testers)}]
+            (seconds {float(timeout):.6f}) (seconds {float(budget):.6f}) (flat candidates)
+        val _ = Json_Output.output "conjecture_checks" (
+        Json_Output.list (fn ((template, _), rows) =>
+            Json_Output.tuple [
+                Json_Output.string template,
+                Json_Output.list (fn (candidate, verdict, ms) => Json_Output.tuple [
+                    Json_Output.term @{{context}} candidate,
+                    Json_Output.string verdict,
+                    Json_Output.int ms
+                ]) rows
+            ]) (jobs ~~ unflat candidates checked))"""
+    digest = hashlib.sha256(query.encode("utf8")).hexdigest()[:32]
+    thy = temp_theory(
+        name=f"Conjectures_{digest}",
+        imports=configs.imports,
+        working_directory=os.path.join(
+            INTERIM_DATA_DIR, os.path.basename(configs.root_dir)
+        ),
+    )
+    thy.add_ml_block(query)
+    return thy
+
+
+def check_conjectures(
+    connector,
+    jobs: list[tuple[str, list[str]]],
+    configs: Namespace,
+    chunk_size: int = 50,
+    **kwargs,
+) -> dict[str, list[tuple[str, str, int]]]:
+    """
+    Generate and check the candidates of many templates, ``chunk_size``
+    templates per theory, and return the ``(candidate, verdict, milliseconds)``
+    rows per template. ``testers``, ``timeout`` and ``budget`` go to
+    :func:`conjecture_check_theory`, the other arguments to
+    ``connector.use_theories``.
+    """
+    check_args = {
+        key: kwargs.pop(key)
+        for key in ("testers", "timeout", "budget")
+        if key in kwargs
+    }
+    thys = [
+        conjecture_check_theory(jobs[i : i + chunk_size], configs, **check_args)
+        for i in range(0, len(jobs), chunk_size)
+    ]
+    values, errs = connector.use_theories(thys, **kwargs)
+    results = {}
+    for thy in thys:
+        for value in values.get(thy, []):
+            for template, rows in value:
+                results[template] = [tuple(row) for row in rows]
+        for err in errs.get(thy, []):
+            print(f"Error in {thy.name}: {err}")
+    return results
+
+
+def incremental_extraction_theories(
+    src_thys: list[Theory],
+    configs: Namespace,
+    extraction: Callable[[Theory, Namespace], Theory] = (
+        template_and_type_extraction_theory
+    ),
+    index_path: str | None = None,
+) -> tuple[list[Theory], list[Theory]]:
+    """
+    Wrap source theories for extraction, keyed on the sources they read.
+
+    Every wrapper carries the fingerprint of its source theory and everything
+    the source transitively imports, so its cached result is reused exactly as
+    long as none of them changed. Passing all wrappers to ``use_theories``
+    therefore only schedules the dirty ones.
+
+    :param src_thys: source theories, e.g. from ``get_theory``.
+    :param extraction: wrapper to build, e.g. ``transitions_theory``.
+    :param index_path: where to persist the source index (defaults to the
+        extraction working directory).
+    :returns: all wrappers, and the wrappers whose sources changed since the
+        last run.
+    """
+    if index_path is None:
+        index_path = os.path.join(
+            INTERIM_DATA_DIR, os.path.basename(configs.root_dir), "source_index.json"
+        )
+    index = SourceIndex(index_path)
+    paths = [os.path.join(thy.working_directory, f"{thy.name}.thy") for thy in src_thys]
+    dirty_paths = index.update(paths)
+    index.save()
+
+    wrappers, dirty = [], []
+    for src_thy, path in zip(src_thys, paths):
+        wrapper = extraction(src_thy, configs)
+        wrapper.add_query(
+            f"(* source fingerprint: {index.fingerprint(path)} *)", index=0
+        )
+        wrappers.append(wrapper)
+        if os.path.normpath(os.path.abspath(path)) in dirty_paths:
+            dirty.append(wrapper)
+    print(f"{len(dirty)} / {len(src_thys)} source theories changed since the last run")
+    return wrappers, dirty
@@ -1,12 +0,0 @@
-import time
-
-
-def timing(f):
-    def wrap(*args, **kw):
-        ts = time.time()
-        result = f(*args, **kw)
-        te = time.time()
-        print(f"func:{f.__name__} took: {te - ts} sec")
-        return result
-
-    return wrap
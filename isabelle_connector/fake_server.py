@@ -0,0 +1,225 @@
+import asyncio
+from dataclasses import dataclass, field
+import json
+import random
+import threading
+from typing import Self
+from uuid import uuid4
+
+GREETING = 'OK {"isabelle_id":"fake","isabelle_name":"Isabelle2024"}'
+
+
+@dataclass
+class FakeIsabelleServer:
+    r"""
+    A local stand-in for the Isabelle server, speaking its socket protocol.
+
+    It supports the password handshake and the ``echo``, ``help``,
+    ``session_start``, ``session_stop``, ``use_theories``,
+    ``purge_theories``, ``cancel`` and ``shutdown`` commands. Asynchronous
+    commands answer with ``OK {"task": ...}``, some ``NOTE``\ s and a final
+    ``FINISHED`` or ``FAILED``, just like the real server. No theory is
+    actually checked: every theory ``T`` produces the ML value ``"T"``
+    followed by ``messages_per_theory - 1`` filler values.
+
+    :param latency: seconds of simulated prover time per theory.
+    :param session_start_latency: seconds to start a session.
+    :param messages_per_theory: number of ``writeln`` messages per theory;
+        with 0, theories finish without any output.
+    :param message_size: approximate size in characters of each message.
+    :param imported_nodes: number of imported theory nodes per response,
+        which the connector has to skip.
+    :param error_rate: probability that a theory reports an ML error.
+    :param failure_rate: probability that a whole ``use_theories`` FAILED.
+    :param failing_theories: theories that make every ``use_theories``
+        containing them FAILED.
+    :param seed: random seed for the injected errors and failures.
+    """
+
+    password: str = "fake_password"
+    latency: float = 0.0
+    session_start_latency: float = 0.0
+    messages_per_theory: int = 1
+    message_size: int = 0
+    imported_nodes: int = 0
+    error_rate: float = 0.0
+    failure_rate: float = 0.0
+    failing_theories: set[str] = field(default_factory=set)
+    seed: int = 0
+    sessions: set[str] = field(default_factory=set)
+    commands: list[str] = field(default_factory=list)
+
+    def __post_init__(self):
+        self._random = random.Random(self.seed)
+        self._writers: set[asyncio.StreamWriter] = set()
+
+    @property
+    def server_info(self) -> str:
+        """Info line in the format printed by ``isabelle server``."""
+        return f'server "fake" = 127.0.0.1:{self.port} (password "{self.password}")'
+
+    def start(self) -> Self:
+        """Start listening on a free port in a background thread."""
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self.handle, "127.0.0.1", 0, limit=2**26)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        async def close():
+            self._server.close()
+            # wait_closed also waits for the open client connections
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def __enter__(self) -> Self:
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    @staticmethod
+    def write(writer: asyncio.StreamWriter, response_type: str, body: str = ""):
+        message = f"{response_type} {body}".rstrip(" ")
+        if len(message) > 100 or "\n" in message:
+            # long messages are sent with their length on a line of their own
+            data = message.encode("utf-8")
+            writer.write(f"{len(data)}\n".encode() + data)
+        else:
+            writer.write(f"{message}\n".encode())
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._writers.add(writer)
+        try:
+            password = (await reader.readline()).decode("utf-8").strip()
+            if password != self.password:
+                return
+            self.write(writer, GREETING)
+            while line := (await reader.readline()).decode("utf-8").strip():
+                command, _, argument = line.partition(" ")
+                self.commands.append(command)
+                await self.execute(writer, command, argument)
+                await writer.drain()
+                if command == "shutdown":
+                    self._server.close()
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def execute(
+        self, writer: asyncio.StreamWriter, command: str, argument: str
+    ) -> None:
+        arguments = json.loads(argument) if argument else {}
+        match command:
+            case "echo":
+                self.write(writer, "OK", argument)
+            case "help":
+                self.write(writer, "OK", json.dumps(sorted(COMMANDS)))
+            case "shutdown" | "cancel" | "purge_theories":
+                self.write(writer, "OK")
+            case "session_start" | "session_stop" | "use_theories":
+                task = str(uuid4())
+                self.write(writer, "OK", json.dumps({"task": task}))
+                response_type, body = await getattr(self, command)(
+                    writer, task, arguments
+                )
+                self.write(writer, response_type, json.dumps({**body, "task": task}))
+            case _:
+                self.write(writer, "ERROR", json.dumps(f"Bad command {command!r}"))
+
+    async def session_start(
+        self, writer: asyncio.StreamWriter, task: str, arguments: dict
+    ) -> tuple[str, dict]:
+        await asyncio.sleep(self.session_start_latency)
+        session_id = str(uuid4())
+        self.sessions.add(session_id)
+        return "FINISHED", {"session_id": session_id, "tmp_dir": "/tmp"}
+
+    async def session_stop(
+        self, writer: asyncio.StreamWriter, task: str, arguments: dict
+    ) -> tuple[str, dict]:
+        if arguments.get("session_id") not in self.sessions:
+            return "FAILED", {"kind": "error", "message": "No session"}
+        self.sessions.remove(arguments["session_id"])
+        return "FINISHED", {"ok": True, "return_code": 0}
+
+    def theory_messages(self, name: str) -> list[dict]:
+        filler = "x" * self.message_size
+        messages = [{"kind": "writeln", "message": f'val it = "{name}": string'}]
+        messages = messages[: self.messages_per_theory]
+        messages += [
+            {"kind": "writeln", "message": f'val filler_{i} = "{filler}": string'}
+            for i in range(1, self.messages_per_theory)
+        ]
+        if self._random.random() < self.error_rate:
+            messages.append({"kind": "error", "message": f"Injected error in {name}"})
+        return messages
+
+    async def use_theories(
+        self, writer: asyncio.StreamWriter, task: str, arguments: dict
+    ) -> tuple[str, dict]:
+        if arguments.get("session_id") not in self.sessions:
+            return "FAILED", {"kind": "error", "message": "No session"}
+        theories = arguments["theories"]
+        for theory in theories:
+            await asyncio.sleep(self.latency)
+            note = {
+                "kind": "writeln",
+                "message": f"theory Draft.{theory} 100%",
+                "theory": f"Draft.{theory}",
+                "percentage": 100,
+                "task": task,
+            }
+            self.write(writer, "NOTE", json.dumps(note))
+        if self._random.random() < self.failure_rate or any(
+            theory in self.failing_theories for theory in theories
+        ):
+            return "FAILED", {"kind": "error", "message": "Injected failure"}
+        master_dir = arguments.get("master_dir", "")
+        nodes = [
+            {
+                "node_name": f"/imported/Imported{i}.thy",
+                "theory_name": f"HOL.Imported{i}",
+                "status": {"ok": True},
+                "messages": self.theory_messages(f"Imported{i}"),
+                "exports": [],
+            }
+            for i in range(self.imported_nodes)
+        ]
+        nodes += [
+            {
+                "node_name": f"{master_dir}/{theory}.thy",
+                "theory_name": f"Draft.{theory}",
+                "status": {"ok": True},
+                "messages": self.theory_messages(theory),
+                "exports": [],
+            }
+            for theory in theories
+        ]
+        return "FINISHED", {"ok": True, "errors": [], "nodes": nodes}
+
+
+COMMANDS = {
+    "cancel",
+    "echo",
+    "help",
+    "purge_theories",
+    "session_start",
+    "session_stop",
+    "shutdown",
+    "use_theories",
+}
@@ -0,0 +1,148 @@
+from dataclasses import dataclass, field
+import fcntl
+from functools import cached_property
+import glob
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+
+from isabelle_connector.isabelle_types import Theory
+
+TOOLS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "isabelle-thys")
+
+
+@dataclass
+class ToolSessions:
+    r"""
+    Sessions that add the project's Isabelle tooling (the theories and ML
+    files of ``isabelle-thys``) on top of a target session, so that the tools
+    are loaded from a prebuilt heap instead of being processed again by every
+    session that imports them.
+
+    For a target session ``S`` the derived session ``S_Tools`` is generated
+    in a directory of its own, named by a hash of the tool sources, and built
+    with ``isabelle build -b`` the first time it is needed. Theories that
+    import a tool theory by path are switched to the derived session and
+    import the tool theory by its session-qualified name instead.
+
+    :param tools_dir: directory of the tool theories and ML files.
+    :param theories: tool theories to include in the derived sessions.
+    :param build_dir: where to generate the derived sessions.
+    :param options: extra options of the derived sessions.
+    """
+
+    tools_dir: str = TOOLS_DIR
+    theories: list[str] = field(
+        default_factory=lambda: ["Extract", "ExtractLemmas", "RoughSpec"]
+    )
+    build_dir: str = os.path.join(
+        os.path.expanduser("~"), ".cache", "isabelle-connector", "heaps"
+    )
+    options: list[str] = field(default_factory=lambda: ["document = false"])
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._built: dict[str, str] = {}
+        self._tool_paths = {
+            os.path.normpath(os.path.join(os.path.abspath(self.tools_dir), name)): name
+            for name in self.theories
+        }
+
+    def sources(self) -> list[str]:
+        return sorted(
+            glob.glob(os.path.join(self.tools_dir, "*.thy"))
+            + glob.glob(os.path.join(self.tools_dir, "*.ML"))
+        )
+
+    @cached_property
+    def source_hash(self) -> str:
+        digest = hashlib.sha256()
+        for path in self.sources():
+            digest.update(os.path.basename(path).encode("utf8"))
+            with open(path, "rb") as source:
+                digest.update(source.read())
+        digest.update(repr((self.theories, self.options)).encode("utf8"))
+        return digest.hexdigest()[:16]
+
+    @staticmethod
+    def derived_name(session: str) -> str:
+        return f"{session}_Tools"
+
+    def session_dir(self, session: str) -> str:
+        return os.path.join(
+            self.build_dir, f"{self.derived_name(session)}-{self.source_hash}"
+        )
+
+    def root_entry(self, session: str) -> str:
+        theories = "\n".join(f"    {name}" for name in self.theories)
+        return (
+            f'session "{self.derived_name(session)}" = "{session}" +\n'
+            f"  options [{', '.join(self.options)}]\n"
+            f"  theories\n{theories}\n"
+        )
+
+    def generate(self, session: str) -> str:
+        """Write the derived session of ``session`` and return its directory."""
+        session_dir = self.session_dir(session)
+        os.makedirs(session_dir, exist_ok=True)
+        for path in self.sources():
+            shutil.copy2(path, session_dir)
+        with open(os.path.join(session_dir, "ROOT"), "w", encoding="utf8") as root:
+            root.write(self.root_entry(session))
+        return session_dir
+
+    def build(self, session: str, session_dirs: list[str]) -> str:
+        """
+        Build the heap of the derived session of ``session``, unless this
+        version of the tools has been built before, and return the directory
+        of the derived session. Concurrent builds of the same session, also
+        from other processes, wait for each other.
+        """
+        with self._lock:
+            if session in self._built:
+                return self._built[session]
+            session_dir = self.session_dir(session)
+            os.makedirs(session_dir, exist_ok=True)
+            stamp = os.path.join(session_dir, "built")
+            with open(os.path.join(session_dir, "lock"), "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                if not os.path.exists(stamp):
+                    self.generate(session)
+                    print(f"Building {self.derived_name(session)}")
+                    dirs = [arg for path in session_dirs for arg in ("-d", path)]
+                    subprocess.run(
+                        ["isabelle", "build", "-b", "-d", session_dir, *dirs]
+                        + [self.derived_name(session)],
+                        check=True,
+                    )
+                    with open(stamp, "w", encoding="utf8") as stamp_file:
+                        stamp_file.write(self.source_hash)
+            self._built[session] = session_dir
+            return session_dir
+
+    def tool_import(self, imprt: str, working_directory: str) -> str | None:
+        """Name of the tool theory imported by path ``imprt``, if it is one."""
+        path = os.path.abspath(os.path.join(working_directory, imprt))
+        return self._tool_paths.get(path.removesuffix(".thy"))
+
+    def prepare(self, thy: Theory, session_dirs: list[str]) -> str | None:
+        """
+        Switch ``thy`` to the derived session if it imports tool theories,
+        building it if needed. Returns the directory of the derived session,
+        which has to be among the session directories of ``session_start``.
+        """
+        tools = [
+            self.tool_import(imprt, thy.working_directory) for imprt in thy.imports
+        ]
+        if not any(tools):
+            return None
+        session_dir = self.build(thy.session, session_dirs)
+        derived = self.derived_name(thy.session)
+        thy.imports = [
+            f"{derived}.{tool}" if tool else imprt
+            for imprt, tool in zip(thy.imports, tools)
+        ]
+        thy.session = derived
+        return session_dir
@@ -1,11 +1,17 @@
-from dataclasses import dataclass, field
+import asyncio
+from collections import deque
+from collections.abc import AsyncIterator, Callable
+from dataclasses import dataclass, field, replace
 from functools import partial
+import json
 import logging
 import os
 from pprint import pprint
 import tempfile
-from typing import Any
+import time
+from typing import Any, Literal
 from uuid import uuid4
+import warnings
 
 from isabelle_client.isabelle__client import IsabelleClient
 from isabelle_client.socket_communication import IsabelleResponse
@@ -13,18 +19,35 @@ from isabelle_client.utils import (
     get_isabelle_client,
     start_isabelle_server,
 )
-from isabelle_connector.decorators import timing
+from isabelle_connector.coalesce import (
+    SHARED_COALESCER,
+    Coalescer,
+    WorkKey,
+    work_key,
+)
+from isabelle_connector.config import load_environment
+from isabelle_connector.daemon import ServerRegistry, attach_server
+from isabelle_connector.heaps import ToolSessions
 from isabelle_connector.isabelle_types import IsabelleMessage, Theory
+from isabelle_connector.metrics import Metrics
+from isabelle_connector.packing import pack_theories
 from isabelle_connector.parse import (
-    extract_messages_from_responses,
+    STORE_BATCH_NODES,
+    OnNode,
+    extract_finished_messages,
     extract_ml_values_from_messages,
 )
-from isabelle_connector.utils import flatten, temp_theory
-import nest_asyncio
-from parallelbar import progress_map
-
-# To allow nested event loops in Pytest and notebooks
-nest_asyncio.apply()
+from isabelle_connector.retry import RetryPolicy
+from isabelle_connector.scheduler import schedule_batches, take_batch
+from isabelle_connector.sessions import (
+    RecyclePolicy,
+    SessionManager,
+    process_tree_rss,
+)
+from isabelle_connector.sinks import ArrowSink, sink_thy_values, thy_values
+from isabelle_connector.store import ResultStore, chunks
+from isabelle_connector.tuning import AdaptiveController
+from isabelle_connector.utils import temp_theory
 
 
 @dataclass
@@ -42,33 +65,126 @@ class IsabelleConnector:
     :param session_name: Name of the Isabelle session to use.
     :param session_dirs: list of directories for the Isabelle session.
     :param working_directory: Working directory for temporary files.
+    :param port: Explicit port for the Isabelle server (default: any free port).
+    :param server_info: Info line of an already running server to connect to
+        instead of starting one, as printed by ``isabelle server``.
+    :param daemon: Whether to attach to the shared server called ``name``
+        (starting it if needed) and take over its warm sessions, instead of
+        starting a server of its own. See :mod:`isabelle_connector.daemon`.
+    :param idle_timeout: Seconds without attached connectors after which a
+        shared server started by this connector shuts down.
+    :param registry_path: Registry file of shared servers (default:
+        ``~/.cache/isabelle-connector/servers.json``).
+    :param recycle_policy: When to replace a session with a fresh one.
+    :param n_warm_sessions: Number of pre-started sessions to keep per logic.
+    :param tools: Prebuilt sessions with the project's tool theories; theories
+        importing them by path run in those sessions instead (``None``
+        disables).
+    :param retry_policy: Timeouts and retries of failed batches.
+    :param adaptive: Bounds and initial setting of ``batch_size="auto"``;
+        tuned settings of earlier runs take precedence over the initial one.
+    :param cache_path: Path of the result store shared by all connectors
+        (default: ``~/.cache/isabelle-connector/results.sqlite``).
+    :param max_cache_bytes: Size above which least recently used results are
+        evicted from the result store.
+    :param metrics: Where to record per-phase timings and counters
+        (disabled by default).
+    :param coalescer: Shares the execution of theories that do the same work
+        (see :func:`work_key`) between calls and connectors (by default, with
+        all connectors of the process; ``None`` disables).
     :param debug: Whether to enable debug logging.
     """
 
     name: str = "lemexp"
-    session_dict: dict[str, list[str]] = field(default_factory=dict)
-    session_counter: dict[str, int] = field(default_factory=dict)
     # session_name: str = "HOL"
     # session_id: str = ""
     session_dirs: list[str] = field(
         default_factory=lambda: ["$ISABELLE_HOME/src/HOL", "$AFP_BASE/thys"]
     )
     working_directory: str = ""
+    port: int | None = None
+    server_info: str = ""
+    daemon: bool = False
+    idle_timeout: float = 600.0
+    registry_path: str = ""
+    recycle_policy: RecyclePolicy = field(default_factory=RecyclePolicy)
+    n_warm_sessions: int = 1
+    tools: ToolSessions | None = None
+    retry_policy: RetryPolicy = field(default_factory=RetryPolicy)
+    adaptive: AdaptiveController = field(default_factory=AdaptiveController)
+    cache_path: str = ""
+    max_cache_bytes: int | None = None
+    metrics: Metrics = field(default_factory=Metrics)
+    coalescer: Coalescer | None = field(default_factory=lambda: SHARED_COALESCER)
     debug: bool = False
 
     def __post_init__(self):
         if not self.working_directory:
             self.working_directory = os.path.join(tempfile.mkdtemp(), str(uuid4()))
+        if not self.cache_path:
+            self.cache_path = os.path.join(
+                os.path.expanduser("~"),
+                ".cache",
+                "isabelle-connector",
+                "results.sqlite",
+            )
+        self.registry = (
+            ServerRegistry(self.registry_path)
+            if self.registry_path
+            else ServerRegistry()
+        )
+        # identifies this connector's attachment to a shared server
+        self.token = str(uuid4())
 
         self.start_connection()
 
     def start_connection(self):
-        # Start Isabelle server and client
-        server_info, self._server_process = start_isabelle_server(
-            log_file=os.path.join(self.working_directory, "isabelle-server.log"),
-            name=self.name,
-        )
+        import nest_asyncio
+
+        # To allow nested event loops in Pytest and notebooks
+        nest_asyncio.apply()
+        # the server expands variables like $AFP_BASE in session_dirs
+        load_environment()
+
+        # Start Isabelle server (unless one is given or shared) and client
+        log_file = os.path.join(self.working_directory, "isabelle-server.log")
+        warm_sessions: dict[str, list[str]] = {}
+        if self.server_info:
+            server_info, server_pid = self.server_info, None
+        elif self.daemon:
+            os.makedirs(self.working_directory, exist_ok=True)
+            server_info, server_pid, warm_sessions = attach_server(
+                self.name,
+                self.token,
+                registry=self.registry,
+                idle_timeout=self.idle_timeout,
+                port=self.port,
+                log_file=log_file,
+            )
+        else:
+            server_info, server_process = start_isabelle_server(
+                log_file=log_file,
+                name=self.name,
+                port=self.port,
+            )
+            server_pid = server_process.pid
         self._client = get_isabelle_client(server_info=server_info)
+        self.sessions = SessionManager(
+            client=self._client,
+            session_dirs=self.session_dirs,
+            policy=self.recycle_policy,
+            n_warm=self.n_warm_sessions,
+            server_pid=server_pid,
+            metrics=self.metrics,
+        )
+        self.sessions.adopt(warm_sessions)
+        # the greeting of every command carries the Isabelle version
+        greeting = self._client.echo("")[0].response_body
+        self.store = ResultStore(
+            path=self.cache_path,
+            isabelle_version=json.loads(greeting)["isabelle_id"],
+            max_bytes=self.max_cache_bytes,
+        )
         if self.debug:
             self._client.logger = logging.getLogger()
             self._client.logger.setLevel(logging.INFO)
@@ -80,28 +196,56 @@ class IsabelleConnector:
         assert all(thy.session for thy in thys), (
             "All theories must have a session specified"
         )
-        sessions = dict.fromkeys(
-            {thy.session for thy in thys if thy.session not in self.session_dict}, None
-        )
-        for i, session in enumerate(sessions.keys()):
-            print(f"Starting session {i + 1} / {len(sessions)}: {session}")
-            session_id = self._client.session_start(session, dirs=self.session_dirs)
-            self.session_dict[session] = [session_id]
-            self.session_counter[session] = 0
+        by_session: dict[str, list[Theory]] = {}
         for thy in thys:
-            if (
-                self.session_counter[thy.session]
-                and self.session_counter[thy.session] % 1000 == 0
-            ):
-                print(
-                    f"Adding new session for {thy.session} after {self.session_counter[thy.session]} theories"
-                )
-                session_id = self._client.session_start(
-                    thy.session, dirs=self.session_dirs
-                )
-                self.session_dict[thy.session].append(session_id)
-            thy.session_id = self.session_dict[thy.session][-1]
-            self.session_counter[thy.session] += 1
+            by_session.setdefault(thy.session, []).append(thy)
+        for session, session_thys in by_session.items():
+            with self.metrics.span("session_acquire", session=session):
+                session_id = self.sessions.acquire(session, len(session_thys))
+            for thy in session_thys:
+                thy.session_id = session_id
+
+    def schedule(self, thys: list[Theory], batch_size: int) -> list[list[Theory]]:
+        """
+        Batches of theories sharing session, working directory and imports,
+        balanced by the historical time per theory. Sessions are assigned
+        with :meth:`prepare_sessions` just before a batch runs, so that the
+        recycle policy sees the batches that ran before it.
+        """
+        with self.metrics.span("schedule", theories=len(thys)):
+            return schedule_batches(
+                thys,
+                batch_size,
+                self.store.get_timings(thy.name for thy in thys),
+                self.store.quarantined(thys),
+            )
+
+    def record_batch(
+        self,
+        thys: list[Theory],
+        messages: dict[Theory, list[IsabelleMessage]],
+        elapsed: float,
+    ) -> None:
+        """Report the cost of a finished batch to the session manager."""
+        by_session: dict[str, list[Theory]] = {}
+        for thy in thys:
+            by_session.setdefault(thy.session_id, []).append(thy)
+        for session_id, session_thys in by_session.items():
+            n_errors = sum(
+                1
+                for thy in session_thys
+                if thy not in messages
+                or any(message["kind"] == "error" for message in messages[thy])
+            )
+            self.sessions.record(session_id, len(session_thys), elapsed, n_errors)
+            self.metrics.count("theory_errors", n_errors)
+        if self.metrics.enabled:
+            self.metrics.observe("batch_seconds", elapsed)
+            for _ in thys:
+                self.metrics.observe("theory_seconds", elapsed / len(thys))
+            self.metrics.count("batches")
+            self.metrics.count("theories_processed", len(thys))
+        self.store.put_timings({thy.name: elapsed / len(thys) for thy in thys})
 
     @staticmethod
     def use_theories_helper(
@@ -116,50 +260,226 @@ class IsabelleConnector:
             **kwargs,
         )
 
-    @timing
+    @staticmethod
+    def use_theories_command(thys: list[Theory], **kwargs) -> str:
+        arguments = {
+            "session_id": thys[0].session_id,
+            "theories": [thy.name for thy in thys],
+            "master_dir": thys[0].working_directory,
+        }
+        arguments.update(kwargs)
+        return f"use_theories {json.dumps(arguments)}"
+
+    @staticmethod
+    def timed_use_theories_helper(
+        thys: list[Theory],
+        client: IsabelleClient,
+        retry_policy: RetryPolicy,
+        **kwargs,
+    ) -> tuple[list[IsabelleResponse], float]:
+        start = time.perf_counter()
+        command = IsabelleConnector.use_theories_command(
+            thys, **{**retry_policy.server_arguments(), **kwargs}
+        )
+        try:
+            responses = asyncio.run(
+                asyncio.wait_for(
+                    client.execute_command(command),
+                    retry_policy.deadline(len(thys)),
+                )
+            )
+        except TimeoutError:
+            warnings.warn(f"Batch of {len(thys)} theories timed out")
+            responses = []
+        return responses, time.perf_counter() - start
+
+    async def ause_theories_helper(
+        self,
+        thys: list[Theory],
+        **kwargs,
+    ) -> list[IsabelleResponse]:
+        command = self.use_theories_command(
+            thys, **{**self.retry_policy.server_arguments(), **kwargs}
+        )
+        try:
+            return await asyncio.wait_for(
+                self._client.execute_command(command),
+                self.retry_policy.deadline(len(thys)),
+            )
+        except TimeoutError:
+            warnings.warn(f"Batch of {len(thys)} theories timed out")
+            return []
+
+    def finish_batch(
+        self,
+        thys: list[Theory],
+        responses: list[IsabelleResponse],
+        elapsed: float,
+        on_node: OnNode | None = None,
+    ) -> dict[Theory, list[IsabelleMessage]]:
+        """
+        Decode and record a batch. Only theories that FINISHED are returned,
+        each also passed to ``on_node`` as soon as it is decoded.
+        """
+        with self.metrics.span("decode_responses", theories=len(thys)):
+            messages = extract_finished_messages(thys, responses, self.store, on_node)
+        if not responses:
+            # timed out or lost the connection, so the session may still be busy
+            for session_id in {thy.session_id for thy in thys}:
+                self.sessions.retire_id(session_id)
+        self.record_batch(thys, messages, elapsed)
+        return messages
+
+    async def aretry_failed(
+        self,
+        thys: list[Theory],
+        messages: dict[Theory, list[IsabelleMessage]],
+        attempt: int = 0,
+        *,
+        on_node: OnNode | None = None,
+        **kwargs,
+    ) -> dict[Theory, list[IsabelleMessage]]:
+        """
+        Resubmit the theories of ``thys`` missing from ``messages``, split in
+        halves until the failing theories are isolated. A single theory that
+        still fails after ``retry_policy.max_retries`` retries is quarantined
+        and gets no messages.
+        """
+        failed = [thy for thy in thys if thy not in messages]
+        if not failed:
+            return messages
+        if len(failed) > 1:
+            self.metrics.count("batch_bisections")
+            middle = len(failed) // 2
+            for half in (failed[:middle], failed[middle:]):
+                self.prepare_sessions(half)
+                messages.update(await self.arun_batch(half, on_node=on_node, **kwargs))
+        elif attempt < self.retry_policy.max_retries:
+            self.metrics.count("theory_retries")
+            self.prepare_sessions(failed)
+            messages.update(
+                await self.arun_batch(failed, attempt + 1, on_node=on_node, **kwargs)
+            )
+        else:
+            (thy,) = failed
+            warnings.warn(f"Quarantining {thy.name} after {attempt + 1} attempts")
+            self.metrics.count("theories_quarantined")
+            self.store.quarantine(thy, f"failed {attempt + 1} attempts")
+            messages[thy] = []
+        return messages
+
+    async def arun_batch(
+        self,
+        thys: list[Theory],
+        attempt: int = 0,
+        *,
+        on_node: OnNode | None = None,
+        **kwargs,
+    ) -> dict[Theory, list[IsabelleMessage]]:
+        start = time.perf_counter()
+        responses = await self.ause_theories_helper(thys, **kwargs)
+        messages = self.finish_batch(
+            thys, responses, time.perf_counter() - start, on_node
+        )
+        return await self.aretry_failed(
+            thys, messages, attempt, on_node=on_node, **kwargs
+        )
+
+    def shutdown(self) -> None:
+        """
+        Stop all sessions and shut down the Isabelle server. A connector in
+        daemon mode instead hands its sessions back to the shared server,
+        which keeps running until it is idle.
+        """
+        if self.daemon and not self.server_info:
+            self.registry.detach(self.name, self.token, self.sessions.detach())
+            return
+        self.sessions.shutdown()
+        self._client.shutdown()
+
+    def split_cached(
+        self, thys: list[Theory], use_cache: bool = True
+    ) -> tuple[list[Theory], list[Theory]]:
+        """
+        Write temp theories to disk and split them into those with cached
+        results and those that still need to be sent to the server.
+        """
+        if self.tools is not None:
+            with self.metrics.span("prepare_tools", theories=len(thys)):
+                for theory in thys:
+                    session_dir = self.tools.prepare(theory, self.session_dirs)
+                    if session_dir and session_dir not in self.session_dirs:
+                        self.session_dirs.append(session_dir)
+        with self.metrics.span("write_theories", theories=len(thys)):
+            for theory in thys:
+                if theory.is_temp:
+                    theory.write_to_file()
+        with self.metrics.span("cache_lookup", theories=len(thys)):
+            cached = self.store.contains_many(thys) if use_cache else set()
+        self.metrics.count("cache_hits", len(cached))
+        self.metrics.count("cache_misses", len(thys) - len(cached))
+        cached_thys = [theory for theory in thys if theory in cached]
+        unprocessed_thys = [theory for theory in thys if theory not in cached]
+        print(f"Using cached results for {len(cached_thys)} / {len(thys)} theories")
+        return cached_thys, unprocessed_thys
+
     def use_theories(
         self,
         thys: list[Theory],
-        batch_size=1,
+        batch_size: int | Literal["auto"] = 1,
         rm_if_temp: bool = True,
         use_cache: bool = True,
+        workload: str = "default",
+        sink: ArrowSink | None = None,
         **kwargs,
     ) -> dict[str, list[Any]]:
-        # Skip processing theories that have cached results
-        values = {thy.name: "" for thy in thys}
-        messages: dict[Theory, list[IsabelleMessage]] = {}
-        unprocessed_thys = []
-        for theory in thys:
-            if theory.is_temp:
-                theory.write_to_file()
-            if use_cache and theory.cache_exists():
-                messages[theory] = theory.read_cache()
-            else:
-                unprocessed_thys.append(theory)
-        print(
-            f"Using cached results for {len(thys) - len(unprocessed_thys)} / {len(thys)} theories"
-        )
-
-        if unprocessed_thys:
-            # Prepare sessions for theories that need processing
-            self.prepare_sessions(unprocessed_thys)
-
-            # Process theories in batches
-            in_batch_mode = batch_size > 1
-            n_cpu = os.cpu_count() if not in_batch_mode else 1
-            tasks = [batch for batch in batch_thys(unprocessed_thys, batch_size)]
-            func = partial(
-                IsabelleConnector.use_theories_helper, client=self._client, **kwargs
+        """
+        Values and errors of every theory. With a ``sink``, the values of kind
+        ``sink.kind`` are written to it as they are parsed instead of being
+        returned.
+        """
+        with self.metrics.span("use_theories", theories=len(thys)):
+            result = self._use_theories(
+                thys, batch_size, rm_if_temp, use_cache, workload, sink, **kwargs
             )
-            responses = flatten(
-                progress_map(
-                    func, tasks, n_cpu=n_cpu, chunk_size=1, need_serialize=False
-                )  # type: ignore
+        self.metrics.flush()
+        return result
+
+    def _use_theories(
+        self,
+        thys: list[Theory],
+        batch_size: int | Literal["auto"],
+        rm_if_temp: bool,
+        use_cache: bool,
+        workload: str,
+        sink: ArrowSink | None,
+        **kwargs,
+    ) -> dict[str, list[Any]]:
+        if sink is None:
+            messages = self.collect_messages(
+                thys, batch_size, use_cache, workload, **kwargs
             )
-            new_messages = extract_messages_from_responses(unprocessed_thys, responses)
-            messages.update(new_messages)
+            with self.metrics.span("parse_values", theories=len(messages)):
+                values, errs = extract_ml_values_from_messages(messages)
+        else:
+            values, errs = {}, {}
 
-        values, errs = extract_ml_values_from_messages(messages)
+            def write_node(thy: Theory, thy_messages: list[IsabelleMessage]) -> None:
+                values[thy], errs[thy], _ = sink_thy_values(thy, thy_messages, sink)
+
+            # the messages of every theory are dropped once its values are written
+            finished = self.collect_messages(
+                thys,
+                batch_size,
+                use_cache,
+                workload,
+                on_node=write_node,
+                keep_messages=False,
+                **kwargs,
+            )
+            for thy in finished:
+                values.setdefault(thy, [])
+                errs.setdefault(thy, [])
 
         print(
             f"Successful values from {len([v for v in values.values() if v])} / {len(thys)} theories"
@@ -175,6 +495,392 @@ class IsabelleConnector:
 
         return values, errs
 
+    def collect_messages(
+        self,
+        thys: list[Theory],
+        batch_size: int | Literal["auto"] = 1,
+        use_cache: bool = True,
+        workload: str = "default",
+        on_node: OnNode | None = None,
+        keep_messages: bool = True,
+        **kwargs,
+    ) -> dict[Theory, list[IsabelleMessage]]:
+        """
+        Messages of every theory, from the result store or the server.
+        Theories that do the same work are run once, also when another
+        caller is running the same work (see :class:`Coalescer`).
+
+        Every theory with messages is also passed to ``on_node``: cached
+        theories first, the others as soon as their node is decoded. Without
+        ``keep_messages``, ``on_node`` is the only consumer: the messages are
+        dropped once it returns and every theory maps to an empty list, so at
+        most one batch of messages is held at a time. Theories of such a call
+        are only coalesced with each other.
+        """
+        # Skip processing theories that have cached results
+        cached_thys, unprocessed_thys = self.split_cached(thys, use_cache)
+        messages: dict[Theory, list[IsabelleMessage]] = {}
+        with self.metrics.span("cache_read", theories=len(cached_thys)):
+            for chunk in chunks(cached_thys):
+                cached = self.store.get_many(chunk)
+                if on_node is not None:
+                    for thy, thy_messages in cached.items():
+                        on_node(thy, thy_messages)
+                if not keep_messages:
+                    cached = {thy: [] for thy in cached}
+                messages.update(cached)
+        if not unprocessed_thys:
+            return messages
+
+        run = partial(
+            self.run_uncached,
+            batch_size=batch_size,
+            workload=workload,
+            keep_messages=keep_messages,
+            **kwargs,
+        )
+        if not keep_messages:
+            messages.update(self.stream_uncached(unprocessed_thys, run, on_node))
+        elif self.coalescer is None:
+            messages.update(run(unprocessed_thys, on_node=on_node))
+        else:
+            n_keys = len({work_key(thy) for thy in unprocessed_thys})
+            self.metrics.count("theories_coalesced", len(unprocessed_thys) - n_keys)
+            ran: set[Theory] = set()
+
+            def run_owned(owned_thys: list[Theory]):
+                ran.update(owned_thys)
+                return run(owned_thys, on_node=on_node)
+
+            coalesced = self.coalescer.run(unprocessed_thys, run_owned)
+            # only the theories that ran were stored; the others share their
+            # results under keys of their own
+            shared = {
+                thy: thy_messages
+                for thy, thy_messages in coalesced.items()
+                if thy not in ran
+            }
+            if shared:
+                self.store.put_many(shared)
+            if on_node is not None:
+                for thy, thy_messages in shared.items():
+                    on_node(thy, thy_messages)
+            messages.update(coalesced)
+        return messages
+
+    def stream_uncached(
+        self,
+        thys: list[Theory],
+        run: Callable[..., dict[Theory, list[IsabelleMessage]]],
+        on_node: OnNode,
+    ) -> dict[Theory, list[IsabelleMessage]]:
+        """
+        Run one theory per :func:`work_key` with ``run``, handing the
+        messages of each finished node to ``on_node`` for the theory and the
+        theories sharing its work, which are also stored. Every theory with
+        a result maps to an empty list.
+        """
+        groups: dict[WorkKey, list[Theory]] = {}
+        for thy in thys:
+            groups.setdefault(work_key(thy), []).append(thy)
+        self.metrics.count("theories_coalesced", len(thys) - len(groups))
+        siblings = {group[0]: group[1:] for group in groups.values()}
+        shared: dict[Theory, list[IsabelleMessage]] = {}
+
+        def fan_out(thy: Theory, thy_messages: list[IsabelleMessage]) -> None:
+            on_node(thy, thy_messages)
+            for sibling in siblings.get(thy, ()):
+                on_node(sibling, thy_messages)
+                shared[sibling] = thy_messages
+            if len(shared) >= STORE_BATCH_NODES:
+                self.store.put_many(shared)
+                shared.clear()
+
+        results = run(list(siblings), on_node=fan_out)
+        if shared:
+            self.store.put_many(shared)
+        return {
+            thy: []
+            for representative in results
+            for thy in [representative, *siblings[representative]]
+        }
+
+    def run_uncached(
+        self,
+        unprocessed_thys: list[Theory],
+        batch_size: int | Literal["auto"] = 1,
+        workload: str = "default",
+        on_node: OnNode | None = None,
+        keep_messages: bool = True,
+        **kwargs,
+    ) -> dict[Theory, list[IsabelleMessage]]:
+        """
+        Run theories on the server, in batches, retrying failed ones. Every
+        finished theory is passed to ``on_node`` as soon as it is decoded;
+        without ``keep_messages`` its messages are dropped after each batch.
+        """
+        messages: dict[Theory, list[IsabelleMessage]] = {}
+
+        def keep(batch_messages: dict[Theory, list[IsabelleMessage]]) -> None:
+            if keep_messages:
+                messages.update(batch_messages)
+            else:
+                messages.update({thy: [] for thy in batch_messages})
+
+        if batch_size == "auto":
+
+            async def collect():
+                async for batch_messages in self.iter_adaptive_batches(
+                    unprocessed_thys, workload, on_node=on_node, **kwargs
+                ):
+                    keep(batch_messages)
+
+            asyncio.run(collect())
+        else:
+            # Group theories into batches
+            tasks = self.schedule(unprocessed_thys, batch_size)
+
+            # Process theories in waves of batches, assigning sessions to a
+            # wave only once the previous waves are recorded
+            in_batch_mode = batch_size > 1
+            n_cpu = os.cpu_count() if not in_batch_mode else 1
+            func = partial(
+                IsabelleConnector.timed_use_theories_helper,
+                client=self._client,
+                retry_policy=self.retry_policy,
+                **kwargs,
+            )
+            from parallelbar import progress_map
+            from tqdm import tqdm
+
+            with tqdm(total=len(tasks)) as progress:
+                for start in range(0, len(tasks), n_cpu):
+                    wave = tasks[start : start + n_cpu]
+                    for batch in wave:
+                        self.prepare_sessions(batch)
+                    results = progress_map(
+                        func,
+                        wave,
+                        n_cpu=n_cpu,
+                        chunk_size=1,
+                        disable=True,
+                        need_serialize=False,
+                    )  # type: ignore
+                    for batch, (responses, elapsed) in zip(wave, results):
+                        new_messages = self.finish_batch(
+                            batch, responses, elapsed, on_node
+                        )
+                        if len(new_messages) < len(batch):
+                            new_messages = asyncio.run(
+                                self.aretry_failed(
+                                    batch, new_messages, on_node=on_node, **kwargs
+                                )
+                            )
+                        keep(new_messages)
+                        progress.update()
+        return messages
+
+    def use_packed_theories(
+        self,
+        thys: list[Theory],
+        max_queries: int = 100,
+        batch_size: int | Literal["auto"] = 1,
+        use_cache: bool = True,
+        workload: str = "default",
+        **kwargs,
+    ) -> tuple[dict[Theory, list[Any]], dict[Theory, list[str]]]:
+        """
+        Like :meth:`use_theories`, but the queries of compatible theories are
+        packed into shared temp theories of about ``max_queries`` queries, so
+        thousands of small probes cost a few ``use_theories`` round trips.
+        ``thys`` are never written to disk; values and errors are returned
+        per original theory.
+        """
+        with self.metrics.span("pack", theories=len(thys)):
+            packs = pack_theories(thys, max_queries)
+        messages = self.collect_messages(
+            [packed.theory for packed in packs],
+            batch_size,
+            use_cache,
+            workload,
+            **kwargs,
+        )
+        with self.metrics.span("parse_values", theories=len(thys)):
+            values, errs = extract_ml_values_from_messages(
+                {
+                    thy: thy_messages
+                    for packed in packs
+                    for thy, thy_messages in packed.unpack(
+                        messages.get(packed.theory, [])
+                    ).items()
+                }
+            )
+        self.metrics.flush()
+        print(
+            f"Successful values from {len([v for v in values.values() if v])} / {len(thys)} theories"
+        )
+        return values, errs
+
+    async def iter_fixed_batches(
+        self,
+        thys: list[Theory],
+        batch_size: int,
+        max_in_flight: int | None,
+        on_node: OnNode | None = None,
+        **kwargs,
+    ) -> AsyncIterator[dict[Theory, list[IsabelleMessage]]]:
+        semaphore = asyncio.Semaphore(max_in_flight or os.cpu_count() or 1)
+
+        async def run_batch(batch: list[Theory]):
+            async with semaphore:
+                self.prepare_sessions(batch)
+                return await self.arun_batch(batch, on_node=on_node, **kwargs)
+
+        tasks = [
+            asyncio.ensure_future(run_batch(batch))
+            for batch in self.schedule(thys, batch_size)
+        ]
+        try:
+            for next_batch in asyncio.as_completed(tasks):
+                yield await next_batch
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def iter_adaptive_batches(
+        self,
+        thys: list[Theory],
+        workload: str = "default",
+        on_node: OnNode | None = None,
+        **kwargs,
+    ) -> AsyncIterator[dict[Theory, list[IsabelleMessage]]]:
+        """
+        Messages of ``thys`` batch by batch, with the batch size and the
+        number of in-flight batches chosen by an :class:`AdaptiveController`.
+        The controller starts from, and saves back, the tuned setting of
+        ``workload`` in the result store.
+        """
+        controller = replace(self.adaptive)
+        if tuned := self.store.get_tuning(workload):
+            controller.batch_size, controller.max_in_flight = tuned
+        isolated = self.store.quarantined(thys)
+        with self.metrics.span("schedule", theories=len(thys)):
+            timings = self.store.get_timings(thy.name for thy in thys)
+            queue = deque(
+                thy
+                for batch in schedule_batches(thys, 1, timings, isolated)
+                for thy in batch
+            )
+
+        async def run_batch(batch: list[Theory]):
+            start = time.perf_counter()
+            messages = await self.arun_batch(batch, on_node=on_node, **kwargs)
+            return batch, messages, time.perf_counter() - start
+
+        pending: set[asyncio.Future] = set()
+        try:
+            while queue or pending:
+                while queue and len(pending) < controller.max_in_flight:
+                    batch = take_batch(queue, controller.batch_size, isolated)
+                    self.prepare_sessions(batch)
+                    pending.add(asyncio.ensure_future(run_batch(batch)))
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    batch, messages, elapsed = task.result()
+                    rss = None
+                    if controller.max_rss_mb is not None and self.sessions.server_pid:
+                        rss = process_tree_rss(self.sessions.server_pid)
+                    n_failed = sum(1 for thy in batch if thy not in messages)
+                    controller.record(len(batch), elapsed, n_failed, rss)
+                    yield messages
+        finally:
+            for task in pending:
+                task.cancel()
+            self.store.put_tuning(workload, *controller.settings)
+            print(
+                f"Tuned {workload}: batch_size={controller.batch_size}, "
+                f"max_in_flight={controller.max_in_flight}"
+            )
+
+    async def iter_theories(
+        self,
+        thys: list[Theory],
+        batch_size: int | Literal["auto"] = 1,
+        max_in_flight: int | None = None,
+        use_cache: bool = True,
+        workload: str = "default",
+        sink: ArrowSink | None = None,
+        **kwargs,
+    ) -> AsyncIterator[tuple[Theory, list[Any], list[str]]]:
+        """
+        Asynchronous counterpart of :meth:`use_theories` that yields
+        ``(theory, values, errs)`` as soon as the batch containing the theory
+        is FINISHED on the server.
+
+        Up to ``max_in_flight`` ``use_theories`` commands are kept running on
+        the server at once (defaults to the number of CPUs). Cached results
+        are yielded first, one theory at a time.
+
+        :param thys: theories to process.
+        :param batch_size: number of theories per ``use_theories`` command,
+            or ``"auto"`` to tune it and the concurrency at runtime.
+        :param max_in_flight: maximum number of concurrent server commands
+            (ignored with ``batch_size="auto"``).
+        :param use_cache: whether to reuse cached results.
+        :param workload: name under which ``"auto"`` keeps its tuned setting,
+            e.g. ``"transitions"`` or ``"lemmas"``.
+        :param sink: where to write the values of kind ``sink.kind`` instead
+            of yielding them, one batch at a time.
+        """
+        cached_thys, unprocessed_thys = self.split_cached(thys, use_cache)
+        for theory in cached_thys:
+            yield theory, *thy_values(theory, self.store.get(theory) or [], sink)
+
+        if not unprocessed_thys:
+            self.metrics.flush()
+            return
+
+        if batch_size == "auto":
+            batches = self.iter_adaptive_batches(unprocessed_thys, workload, **kwargs)
+        else:
+            batches = self.iter_fixed_batches(
+                unprocessed_thys, batch_size, max_in_flight, **kwargs
+            )
+        try:
+            async for batch_messages in batches:
+                for theory, thy_messages in batch_messages.items():
+                    yield theory, *thy_values(theory, thy_messages, sink)
+        finally:
+            await batches.aclose()
+            self.metrics.flush()
+
+    async def ause_theories(
+        self,
+        thys: list[Theory],
+        batch_size: int | Literal["auto"] = 1,
+        max_in_flight: int | None = None,
+        use_cache: bool = True,
+        workload: str = "default",
+        sink: ArrowSink | None = None,
+        **kwargs,
+    ) -> tuple[dict[Theory, list[Any]], dict[Theory, list[str]]]:
+        """
+        Asynchronous counterpart of :meth:`use_theories` returning the same
+        ``values, errs`` dictionaries.
+        """
+        values, errs = {}, {}
+        async for theory, theory_values, theory_errs in self.iter_theories(
+            thys, batch_size, max_in_flight, use_cache, workload, sink, **kwargs
+        ):
+            values[theory], errs[theory] = theory_values, theory_errs
+
+        print(
+            f"Successful values from {len([v for v in values.values() if v])} / {len(thys)} theories"
+        )
+        return values, errs
+
 
 def batch_thys(theories, batch_size=100):
     for i in range(0, len(theories), batch_size):
@@ -1,43 +1,102 @@
+from collections.abc import Iterator
 from dataclasses import dataclass, field
+from functools import cache
 import hashlib
 import os
-import pickle
+import sys
 from typing import Any
 import warnings
 
 # Isabelle messages inside of IsabelleResponse
 type IsabelleMessage = dict[str, Any]
 
-@dataclass
+PREAMBLE = """
+            declare [[show_markup = false]]
+            declare [[show_consts = true]]
+            declare [[show_abbrevs = true]]
+            declare [[names_long = false]]
+            declare [[ML_print_depth=1000000]]
+            declare [[syntax_ambiguity_warning = false]]
+            """
+
+# fields that make up the rendered theory, and so its fingerprints
+CONTENT_FIELDS = frozenset({"name", "imports", "queries"})
+BODY_FIELDS = frozenset({"imports", "queries"})
+
+_interned_imports: dict[tuple[str, ...], tuple[str, ...]] = {}
+
+
+def intern_imports(imports) -> tuple[str, ...]:
+    """One shared tuple per distinct import list (of strings or paths)."""
+    key = tuple(sys.intern(str(imprt)) for imprt in imports)
+    return _interned_imports.setdefault(key, key)
+
+
+@cache
+def render_header(imports: tuple[str, ...]) -> str:
+    """Everything between the theory name and the first query."""
+    imports_str = " ".join(f'"{imprt}"' for imprt in imports)
+    return f"\n            imports Main {imports_str} begin{PREAMBLE}"
+
+
+@dataclass(slots=True)
 class Theory:
-    """A theory."""
+    """
+    A theory.
+
+    Imports are kept as interned tuples shared by all theories with the same
+    imports, queries as tuples; assigning a list converts it. The content
+    fingerprints are computed once and reset whenever the name, imports or
+    queries are assigned, so queries must be changed through
+    ``add_query``/``add_ml_block`` or by assigning ``queries``.
+
+    ``generated_name`` marks theories named by :func:`temp_theory`, whose
+    name carries no meaning, so that theories differing only in such a name
+    can share their execution.
+    """
 
     name: str
     working_directory: str
     session: str = "HOL"
     session_id: str = ""
-    imports: list[str] = field(default_factory=list)
-    queries: list[str] = field(default_factory=list)
+    imports: tuple[str, ...] = ()
+    queries: tuple[str, ...] = ()
     is_temp: bool = False
+    generated_name: bool = False
+    _fingerprint: str | None = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _body_fingerprint: str | None = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name == "imports":
+            value = intern_imports(value)
+        elif name == "queries":
+            value = tuple(value)
+        elif name in ("working_directory", "session"):
+            value = sys.intern(os.fspath(value))
+        if name in CONTENT_FIELDS:
+            object.__setattr__(self, "_fingerprint", None)
+        if name in BODY_FIELDS:
+            object.__setattr__(self, "_body_fingerprint", None)
+        object.__setattr__(self, name, value)
+
+    def render(self) -> Iterator[str]:
+        """The theory text in chunks, without building it as one string."""
+        yield f"theory {self.name}"
+        yield render_header(self.imports)
+        for i, query in enumerate(self.queries):
+            yield f"\n{query}" if i else query
+        yield "\n            end"
 
     def __repr__(self) -> str:
-        imports_str = " ".join(f'"{imprt}"' for imprt in self.imports)
-        body = "\n".join(self.queries)
-        content = f"""theory {self.name}
-            imports Main {imports_str} begin
-            declare [[show_markup = false]]
-            declare [[show_consts = true]]
-            declare [[show_abbrevs = true]]
-            declare [[names_long = false]]
-            declare [[ML_print_depth=1000000]]
-            declare [[syntax_ambiguity_warning = false]]
-            {body}
-            end"""
-        return content
-    
+        return "".join(self.render())
+
     def __hash__(self) -> int:
         return hash(self.name)
-    
+
     def __del__(self) -> None:
         if self.is_temp:
             try:
@@ -45,50 +104,50 @@ class Theory:
             except FileNotFoundError:
                 warnings.warn(f"Temp file {self.name}.thy not found for deletion.")
 
-    def add_ml_block(self, code: str) -> None:
-        self.queries.append(f"ML\\<open>\n{code}\n\\<close>\n")
+    def add_query(self, query: str, index: int | None = None) -> None:
+        """Append ``query``, or insert it before the query at ``index``."""
+        if index is None:
+            self.queries = (*self.queries, query)
+        else:
+            self.queries = (*self.queries[:index], query, *self.queries[index:])
+
+    def add_ml_block(self, code: str, index: int | None = None) -> None:
+        self.add_query(f"ML\\<open>\n{code}\n\\<close>\n", index)
 
     def write_to_file(
         self,
     ) -> None:
-        content = repr(self)
         os.makedirs(self.working_directory, exist_ok=True)
         with open(
             os.path.join(self.working_directory, f"{self.name}.thy"),
             "w",
             encoding="utf8",
         ) as theory_file:
-            theory_file.write(content)
-    
-    def cache_exists(self) -> bool:
-        cache_file_name = f"{self.working_directory}/{self.name}.thy.result"
-        if os.path.exists(cache_file_name):
-            content = repr(self)
-            content_hash = hashlib.sha256(content.encode("utf8")).hexdigest()
-            with open(cache_file_name, "rb") as cache_file:
-                cache_hash = pickle.load(cache_file).strip()
-                # the first line is the hash
-                # cache_hash = cache_file.readline().decode("utf8").strip()
-                return content_hash == cache_hash
-        return False
-    
-    def read_cache(self) -> list[IsabelleMessage]:
-        cache_file_name = f"{self.working_directory}/{self.name}.thy.result"
-        with open(cache_file_name, "rb") as cache_file:
-            # skip the first line (the hash)
-            _ = pickle.load(cache_file)
-            # return IsabelleResponse(**json.load(cache_file))
-            return pickle.load(cache_file)
-
-    def write_cache(self, response: list[IsabelleMessage]):
-        if self.cache_exists():
-            return
-
-        # Cache the output of using a theory file
-        cache_file_name = f"{self.working_directory}/{self.name}.thy.result"
-        with open(cache_file_name, "wb") as cache_file:
-            pickle.dump(hashlib.sha256(repr(self).encode("utf8")).hexdigest() + "\n", cache_file)
-            pickle.dump(response, cache_file)
+            theory_file.writelines(self.render())
+
+    def content_hash(self) -> str:
+        """SHA-256 of the rendered theory, used as the result cache key."""
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            for chunk in self.render():
+                digest.update(chunk.encode("utf8"))
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def body_hash(self) -> str:
+        """
+        SHA-256 of the rendered theory without its name, which theories that
+        do the same work under different generated names share.
+        """
+        if self._body_fingerprint is None:
+            digest = hashlib.sha256()
+            chunks = self.render()
+            next(chunks)
+            for chunk in chunks:
+                digest.update(chunk.encode("utf8"))
+            self._body_fingerprint = digest.hexdigest()
+        return self._body_fingerprint
+
 
 @dataclass
 class TheoryResult:
@@ -0,0 +1,306 @@
+"""
+A durable queue of theories for long sweeps, shared by worker processes.
+
+The manifest is a SQLite file with one row per theory, which is pending,
+running (claimed by a worker until its lease expires), done or failed.
+Workers claim batches of pending theories, run them through their own
+IsabelleConnector and mark them done once their results are committed to
+the shared result store; they renew the leases of their batch while it runs.
+Running theories whose worker died stay running until an explicit resume.
+
+Afterwards, ``use_theories`` with the same result store returns the results
+of all done theories without running them again.
+
+Usage:
+    python -m isabelle_connector.jobs worker jobs.sqlite --cache-path results.sqlite
+    python -m isabelle_connector.jobs status jobs.sqlite
+    python -m isabelle_connector.jobs resume jobs.sqlite --failed
+"""
+
+from argparse import ArgumentParser
+from collections.abc import Iterable
+from dataclasses import dataclass, fields
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from uuid import uuid4
+
+from isabelle_connector.isabelle_types import Theory
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    name TEXT PRIMARY KEY,
+    theory TEXT NOT NULL,
+    state TEXT NOT NULL,
+    owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+"""
+
+STATES = ("pending", "running", "done", "failed")
+
+
+def encode_theory(thy: Theory) -> str:
+    data = {field.name: getattr(thy, field.name) for field in fields(thy) if field.init}
+    return json.dumps(data | {"session_id": ""})
+
+
+def decode_theory(data: str) -> Theory:
+    return Theory(**json.loads(data))
+
+
+@dataclass
+class JobQueue:
+    r"""
+    The job manifest of a sweep.
+
+    Claims run in ``BEGIN IMMEDIATE`` transactions, so several worker
+    processes can share one manifest: a theory is only ever claimed by one
+    worker at a time.
+
+    :param path: path of the SQLite manifest.
+    :param timeout: seconds to wait for a lock held by another process.
+    """
+
+    path: str
+    timeout: float = 60.0
+
+    def __post_init__(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._local = threading.local()
+        with self.connection() as connection:
+            connection.executescript(SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def transaction(self):
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        return _Transaction(connection)
+
+    def submit(self, thys: Iterable[Theory]) -> int:
+        """Add theories as pending jobs; known theories are left alone."""
+        now = time.time()
+        with self.transaction() as connection:
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO jobs (name, theory, state, updated) "
+                "VALUES (?, ?, 'pending', ?)",
+                [(thy.name, encode_theory(thy), now) for thy in thys],
+            )
+            return connection.total_changes - before
+
+    def claim(self, owner: str, n: int, lease_seconds: float) -> list[Theory]:
+        """Claim up to ``n`` pending theories for ``lease_seconds``."""
+        now = time.time()
+        with self.transaction() as connection:
+            rows = connection.execute(
+                "SELECT name, theory FROM jobs WHERE state = 'pending' "
+                "ORDER BY attempts, rowid LIMIT ?",
+                (n,),
+            ).fetchall()
+            connection.executemany(
+                "UPDATE jobs SET state = 'running', owner = ?, lease_until = ?, "
+                "attempts = attempts + 1, updated = ? WHERE name = ?",
+                [(owner, now + lease_seconds, now, name) for name, _ in rows],
+            )
+        return [decode_theory(data) for _, data in rows]
+
+    def renew(self, owner: str, names: list[str], lease_seconds: float) -> None:
+        now = time.time()
+        with self.transaction() as connection:
+            connection.executemany(
+                "UPDATE jobs SET lease_until = ?, updated = ? "
+                "WHERE name = ? AND owner = ? AND state = 'running'",
+                [(now + lease_seconds, now, name, owner) for name in names],
+            )
+
+    def finish(
+        self, owner: str, done: list[str], failed: dict[str, str] | None = None
+    ) -> None:
+        """Mark claimed theories as done or failed (with the reason)."""
+        now = time.time()
+        failed = failed or {}
+        with self.transaction() as connection:
+            connection.executemany(
+                "UPDATE jobs SET state = 'done', error = NULL, updated = ? "
+                "WHERE name = ? AND owner = ? AND state = 'running'",
+                [(now, name, owner) for name in done],
+            )
+            connection.executemany(
+                "UPDATE jobs SET state = 'failed', error = ?, updated = ? "
+                "WHERE name = ? AND owner = ? AND state = 'running'",
+                [(error, now, name, owner) for name, error in failed.items()],
+            )
+
+    def resume(self, failed: bool = False, force: bool = False) -> int:
+        """
+        Make running theories with an expired lease (any running theory with
+        ``force``) and, with ``failed``, failed theories pending again.
+        Returns the number of theories that were reset.
+        """
+        states = ["running"] + (["failed"] if failed else [])
+        lease_until = float("inf") if force else time.time()
+        with self.transaction() as connection:
+            before = connection.total_changes
+            connection.execute(
+                "UPDATE jobs SET state = 'pending', owner = NULL, lease_until = NULL, "
+                f"updated = ? WHERE state IN ({', '.join('?' * len(states))}) "
+                "AND (state != 'running' OR lease_until < ?)",
+                (time.time(), *states, lease_until),
+            )
+            return connection.total_changes - before
+
+    def counts(self) -> dict[str, int]:
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(
+            self.connection()
+            .execute("SELECT state, COUNT(*) FROM jobs GROUP BY state")
+            .fetchall()
+        )
+        return counts
+
+    def failures(self) -> dict[str, str]:
+        return dict(
+            self.connection()
+            .execute("SELECT name, error FROM jobs WHERE state = 'failed'")
+            .fetchall()
+        )
+
+
+class _Transaction:
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        return self.connection
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def run_worker(
+    queue_path: str,
+    batch_size: int = 10,
+    lease_seconds: float = 600.0,
+    max_batches: int | None = None,
+    **connector_kwargs,
+) -> int:
+    """
+    Claim and run batches of theories until no pending theory is left (or
+    after ``max_batches``). Results go to the result store of the worker's
+    connector, created from ``connector_kwargs``. A server given by
+    ``server_info`` is left running for the other workers. Returns the number of
+    theories completed by this worker.
+    """
+    from isabelle_connector.config import logger
+    from isabelle_connector.isabelle_connector import IsabelleConnector
+
+    queue = JobQueue(queue_path)
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+    connector = IsabelleConnector(**connector_kwargs)
+    n_done = n_batches = 0
+
+    def renew(stop: threading.Event, names: list[str]) -> None:
+        while not stop.wait(lease_seconds / 3):
+            queue.renew(owner, names, lease_seconds)
+
+    try:
+        while max_batches is None or n_batches < max_batches:
+            thys = queue.claim(owner, batch_size, lease_seconds)
+            if not thys:
+                break
+            n_batches += 1
+            names = [thy.name for thy in thys]
+            stop_renewing = threading.Event()
+            renewer = threading.Thread(
+                target=renew, args=(stop_renewing, names), daemon=True
+            )
+            renewer.start()
+            try:
+                messages = connector.collect_messages(thys, batch_size=len(thys))
+            finally:
+                stop_renewing.set()
+                renewer.join()
+            done = [thy.name for thy in thys if thy in messages]
+            failed = {thy.name: "no result" for thy in thys if thy not in messages}
+            queue.finish(owner, done, failed)
+            n_done += len(done)
+            counts = queue.counts()
+            logger.info(
+                f"{owner}: {counts['done']} done, {counts['pending']} pending, "
+                f"{counts['failed']} failed"
+            )
+    finally:
+        if connector_kwargs.get("server_info"):
+            # a server given by its info line is shared with other workers
+            connector.sessions.shutdown()
+        else:
+            connector.shutdown()
+    return n_done
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    worker_parser = commands.add_parser("worker")
+    worker_parser.add_argument("queue")
+    worker_parser.add_argument("--batch-size", type=int, default=10)
+    worker_parser.add_argument("--lease-seconds", type=float, default=600.0)
+    worker_parser.add_argument("--name", default="lemexp")
+    worker_parser.add_argument("--server-info", default="")
+    worker_parser.add_argument("--daemon", action="store_true")
+    worker_parser.add_argument("--cache-path", default="")
+    worker_parser.add_argument("--working-directory", default="/tmp/lemexp")
+    worker_parser.add_argument("--session-dirs", nargs="*")
+    status_parser = commands.add_parser("status")
+    status_parser.add_argument("queue")
+    resume_parser = commands.add_parser("resume")
+    resume_parser.add_argument("queue")
+    resume_parser.add_argument("--failed", action="store_true")
+    resume_parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+
+    match args.command:
+        case "worker":
+            connector_kwargs = {
+                "name": args.name,
+                "server_info": args.server_info,
+                "daemon": args.daemon,
+                "cache_path": args.cache_path,
+                "working_directory": args.working_directory,
+            }
+            if args.session_dirs is not None:
+                connector_kwargs["session_dirs"] = args.session_dirs
+            run_worker(
+                args.queue, args.batch_size, args.lease_seconds, **connector_kwargs
+            )
+        case "status":
+            queue = JobQueue(args.queue)
+            print(queue.counts())
+            for name, error in queue.failures().items():
+                print(f"failed: {name}: {error}")
+        case "resume":
+            n_reset = JobQueue(args.queue).resume(args.failed, args.force)
+            print(f"{n_reset} theories pending again")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+import json
+import os
+import threading
+import time
+
+# upper bounds in seconds, from a cached lookup to a slow theory
+DEFAULT_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+    900.0,
+)
+
+_DISABLED_SPAN = nullcontext()
+
+
+@dataclass
+class Histogram:
+    """Counts of observed values per bucket, as in Prometheus histograms."""
+
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    counts: list[int] = field(default_factory=list)
+    total: float = 0.0
+    count: int = 0
+
+    def __post_init__(self):
+        if not self.counts:
+            # the last count is the +Inf bucket
+            self.counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        running, result = 0, []
+        for bound, count in zip(bounds, self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+
+@dataclass
+class Metrics:
+    r"""
+    Counters, latency histograms and timed spans of the connector's phases.
+
+    When ``enabled`` is false every method returns immediately and
+    :meth:`span` returns a shared no-op context manager, so instrumented code
+    pays a single attribute check. :meth:`flush` appends the recorded spans
+    and a snapshot of all metrics to ``jsonl_path`` and rewrites
+    ``prometheus_path`` in the Prometheus textfile format (e.g. for the node
+    exporter's textfile collector).
+
+    :param enabled: whether to record anything.
+    :param jsonl_path: JSON lines file to append spans and snapshots to.
+    :param prometheus_path: Prometheus textfile to write on flush.
+    :param prefix: prefix of the exported metric names.
+    """
+
+    enabled: bool = False
+    jsonl_path: str = ""
+    prometheus_path: str = ""
+    prefix: str = "isabelle_connector"
+    counters: dict[str, float] = field(default_factory=dict)
+    histograms: dict[str, Histogram] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._spans: list[dict] = []
+
+    def count(self, name: str, value: float = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.histograms.setdefault(name, Histogram()).observe(value)
+
+    def span(self, name: str, **labels):
+        """
+        Time the enclosed block into the ``<name>_seconds`` histogram and
+        record it, with ``labels``, as a span.
+        """
+        if not self.enabled:
+            return _DISABLED_SPAN
+        return self._span(name, labels)
+
+    @contextmanager
+    def _span(self, name: str, labels: dict):
+        start_time, start = time.time(), time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(f"{name}_seconds", elapsed)
+            with self._lock:
+                self._spans.append(
+                    {"span": name, "start": start_time, "seconds": elapsed, **labels}
+                )
+
+    def cache_hit_ratio(self) -> float | None:
+        hits = self.counters.get("cache_hits", 0)
+        lookups = hits + self.counters.get("cache_misses", 0)
+        return hits / lookups if lookups else None
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "time": time.time(),
+                "counters": dict(self.counters),
+                "cache_hit_ratio": self.cache_hit_ratio(),
+                "histograms": {
+                    name: {
+                        "buckets": dict(histogram.cumulative()),
+                        "sum": histogram.total,
+                        "count": histogram.count,
+                    }
+                    for name, histogram in self.histograms.items()
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                metric = f"{self.prefix}_{name}_total"
+                lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+            ratio = self.cache_hit_ratio()
+            if ratio is not None:
+                metric = f"{self.prefix}_cache_hit_ratio"
+                lines += [f"# TYPE {metric} gauge", f"{metric} {ratio}"]
+            for name, histogram in sorted(self.histograms.items()):
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                lines += [
+                    f'{metric}_bucket{{le="{bound}"}} {count}'
+                    for bound, count in histogram.cumulative()
+                ]
+                lines += [
+                    f"{metric}_sum {histogram.total}",
+                    f"{metric}_count {histogram.count}",
+                ]
+        return "\n".join(lines) + "\n"
+
+    def flush(self) -> None:
+        """Export the recorded metrics to the configured files."""
+        if not self.enabled:
+            return
+        if self.jsonl_path:
+            with self._lock:
+                spans, self._spans = self._spans, []
+            with open(self.jsonl_path, "a", encoding="utf8") as jsonl_file:
+                jsonl_file.writelines(
+                    json.dumps(record) + "\n"
+                    for record in spans + [{"snapshot": self.snapshot()}]
+                )
+        if self.prometheus_path:
+            # the textfile collector may read at any time, so replace atomically
+            tmp_path = f"{self.prometheus_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf8") as prometheus_file:
+                prometheus_file.write(self.to_prometheus())
+            os.replace(tmp_path, self.prometheus_path)
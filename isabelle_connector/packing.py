@@ -0,0 +1,113 @@
+from bisect import bisect_right
+from dataclasses import dataclass
+import hashlib
+import re
+
+from isabelle_connector.isabelle_types import IsabelleMessage, Theory
+from isabelle_connector.scheduler import BatchKey, batch_key
+from isabelle_connector.utils import temp_theory
+
+# Output of the marker command placed in front of every packed unit
+MARKER_PREFIX = "packed_query "
+MARKER_PATTERN = re.compile(rf'"{MARKER_PREFIX}(\d+)"')
+
+
+def marker_block(i: int) -> str:
+    return f'ML\\<open> writeln "{MARKER_PREFIX}{i}" \\<close>'
+
+
+def marker_index(message: IsabelleMessage) -> int | None:
+    if message["kind"] != "writeln" or not message["message"].startswith(MARKER_PREFIX):
+        return None
+    return int(message["message"].removeprefix(MARKER_PREFIX))
+
+
+@dataclass
+class PackedTheory:
+    """
+    A temp theory holding the queries of several theories, each preceded by a
+    marker command, together with what is needed to split its output.
+
+    :param theory: the theory sent to the server.
+    :param sources: the original theories, in the order of their queries.
+    :param first_lines: line of the marker of every source in ``theory``.
+    """
+
+    theory: Theory
+    sources: list[Theory]
+    first_lines: list[int]
+
+    def unpack(
+        self, messages: list[IsabelleMessage]
+    ) -> dict[Theory, list[IsabelleMessage]]:
+        """
+        Split the messages of the packed theory by source theory.
+
+        A message with a position belongs to the source whose queries span
+        its line. Messages without a position belong to the source of the
+        last marker before them, as node messages are in document order.
+        Markers themselves are dropped.
+        """
+        unpacked: dict[Theory, list[IsabelleMessage]] = {
+            source: [] for source in self.sources
+        }
+        current = None
+        for message in messages:
+            if (i := marker_index(message)) is not None:
+                current = i
+                continue
+            line = (message.get("pos") or {}).get("line")
+            if line is not None and line >= self.first_lines[0]:
+                current = bisect_right(self.first_lines, line) - 1
+            if current is not None:
+                unpacked[self.sources[current]].append(message)
+        return unpacked
+
+
+def pack_key(thys: list[Theory]) -> str:
+    # the packed theory runs with the session, directory and imports of the
+    # first theory, so they are part of its identity
+    digest = hashlib.sha256(repr(batch_key(thys[0])).encode("utf8"))
+    for thy in thys:
+        digest.update(repr((thy.name, list(thy.queries))).encode("utf8"))
+    # deterministic, so the packed theory hits the result store again
+    return "Packed" + digest.hexdigest()[:32]
+
+
+def pack(thys: list[Theory]) -> PackedTheory:
+    """Pack theories of the same batch key into a single temp theory."""
+    queries = []
+    for i, thy in enumerate(thys):
+        queries.append(marker_block(i))
+        queries.extend(thy.queries)
+    packed = temp_theory(
+        name=pack_key(thys),
+        working_directory=thys[0].working_directory,
+        session=thys[0].session,
+        imports=list(thys[0].imports),
+        queries=queries,
+    )
+    first_lines = [0] * len(thys)
+    for lineno, line in enumerate(repr(packed).splitlines(), 1):
+        if match := MARKER_PATTERN.search(line):
+            first_lines[int(match.group(1))] = lineno
+    return PackedTheory(packed, thys, first_lines)
+
+
+def pack_theories(thys: list[Theory], max_queries: int = 100) -> list[PackedTheory]:
+    """
+    Pack the queries of theories sharing session, working directory and
+    imports into temp theories of about ``max_queries`` queries. The queries
+    of one theory are never split across packed theories.
+
+    Queries must be complete commands: an ML error stays with its query, but
+    a query that does not parse can swallow the queries after it.
+    """
+    groups: dict[BatchKey, list[list[Theory]]] = {}
+    for thy in thys:
+        packs = groups.setdefault(batch_key(thy), [[]])
+        n_queries = sum(len(source.queries) for source in packs[-1])
+        if packs[-1] and n_queries + len(thy.queries) > max_queries:
+            packs.append([])
+        packs[-1].append(thy)
+    return [pack(sources) for packs in groups.values() for sources in packs]
@@ -1,9 +1,17 @@
 import ast
+from collections.abc import Callable, Container, Iterator
 import json
+import re
+from typing import TYPE_CHECKING, Any
 import warnings
 
-from isabelle_client.socket_communication import IsabelleResponse
 from isabelle_connector.isabelle_types import IsabelleMessage, Theory
+from isabelle_connector.store import ResultStore
+
+if TYPE_CHECKING:
+    # importing the client pulls in asyncio, which workers that only parse
+    # cached results do not need
+    from isabelle_client.socket_communication import IsabelleResponse
 
 
 def parse_ml_value(message):
@@ -25,42 +33,180 @@ def is_ml_value(message):
     return message.startswith("val ")
 
 
-def extract_messages_from_responses(
-    thys: list[Theory], responses: list[IsabelleResponse]
-) -> dict[Theory, list[IsabelleMessage]]:
-    messages = {thy: [] for thy in thys}
+# Prefix of values emitted by Json_Output.output (isabelle-thys/JsonOutput.ML)
+JSON_VALUE_PREFIX = "json_value "
+
+
+def is_json_value(message):
+    return message.startswith(JSON_VALUE_PREFIX)
+
+
+def parse_json_value(message):
+    """
+    Decode a ``json_value <name> <json>`` message into its name and value.
+    ML tuples arrive as lists.
+    """
+    _, name, payload = message.split(" ", 2)
+    try:
+        return (name, json.loads(payload)), True
+    except json.JSONDecodeError:
+        return (name, message), False
+
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def iter_finished_nodes(
+    body: str, names: Container[str]
+) -> Iterator[tuple[str, list[IsabelleMessage]]]:
+    """
+    Decode the ``nodes`` of a FINISHED body one node at a time and yield the
+    theory name (without ``Draft.``) and messages of those in ``names``.
+
+    Unlike ``json.loads`` of the whole body, at most one node is decoded at
+    any time, so the output of imported theories is dropped as soon as it is
+    read and results can be consumed before the rest of the body is decoded.
+    """
+
+    def skip(pos: int, expected: str = "") -> int:
+        pos = _WHITESPACE.match(body, pos).end()
+        if expected:
+            if body[pos : pos + 1] not in expected:
+                raise json.JSONDecodeError(f"Expecting one of {expected!r}", body, pos)
+            pos = _WHITESPACE.match(body, pos + 1).end()
+        return pos
+
+    pos = skip(0, "{")
+    while body[pos : pos + 1] == '"':
+        key, pos = _DECODER.raw_decode(body, pos)
+        pos = skip(pos, ":")
+        if key != "nodes":
+            _, pos = _DECODER.raw_decode(body, pos)
+        else:
+            pos = skip(pos, "[")
+            while body[pos : pos + 1] != "]":
+                node, pos = _DECODER.raw_decode(body, pos)
+                name = node["theory_name"].removeprefix("Draft.")
+                if name in names:
+                    yield name, node["messages"]
+                del node
+                pos = skip(pos)
+                if body[pos : pos + 1] == ",":
+                    pos = skip(pos + 1)
+            pos += 1
+        pos = skip(pos)
+        if body[pos : pos + 1] == ",":
+            pos = skip(pos + 1)
+
+
+def iter_finished_messages(
+    thys: list[Theory],
+    responses: list["IsabelleResponse"],
+) -> Iterator[tuple[Theory, list[IsabelleMessage]]]:
+    """
+    Messages of the theories that appear in a FINISHED response, one theory
+    at a time as they are decoded. Theories of a batch that ended in ERROR or
+    FAILED are not produced.
+    """
     thy_dict = {thy.name: thy for thy in thys}
     for response in responses:
         match response.response_type:
             case "FINISHED":
-                data = json.loads(response.response_body)
-                for node in data["nodes"]:
-                    name = node["theory_name"].removeprefix("Draft.")
-                    # Skip output of imported theories
-                    if name not in thy_dict:
-                        continue
-                    current_thy = thy_dict[name]
-                    current_messages = node["messages"]
-                    current_thy.write_cache(current_messages)
-                    messages[current_thy] = current_messages
+                for name, messages in iter_finished_nodes(
+                    response.response_body, thy_dict
+                ):
+                    yield thy_dict[name], messages
             case "ERROR" | "FAILED":
                 warnings.warn(f"Received ERROR response: {response.response_body}")
             case _:
                 continue
+
+
+# decoded nodes written to the result store per transaction
+STORE_BATCH_NODES = 64
+
+# called with the messages of a theory as soon as they are available
+type OnNode = Callable[[Theory, list[IsabelleMessage]], None]
+
+
+def extract_finished_messages(
+    thys: list[Theory],
+    responses: list["IsabelleResponse"],
+    store: ResultStore | None = None,
+    on_node: OnNode | None = None,
+    store_batch: int = STORE_BATCH_NODES,
+) -> dict[Theory, list[IsabelleMessage]]:
+    """
+    Messages of the theories that appear in a FINISHED response. Theories of
+    a batch that ended in ERROR or FAILED are missing from the result.
+
+    Every theory is passed to ``on_node`` as soon as its node is decoded.
+    Theories are written to ``store`` ``store_batch`` at a time, and the
+    rest once all responses are decoded.
+    """
+    finished, unstored = {}, {}
+    for thy, messages in iter_finished_messages(thys, responses):
+        finished[thy] = messages
+        if store is not None:
+            unstored[thy] = messages
+            if len(unstored) >= store_batch:
+                store.put_many(unstored, evict=False)
+                unstored = {}
+        if on_node is not None:
+            on_node(thy, messages)
+    if store is not None and unstored:
+        store.put_many(unstored, evict=False)
+    if store is not None and finished and store.max_bytes is not None:
+        store.evict(store.max_bytes)
+    return finished
+
+
+def extract_messages_from_responses(
+    thys: list[Theory],
+    responses: list["IsabelleResponse"],
+    store: ResultStore | None = None,
+) -> dict[Theory, list[IsabelleMessage]]:
+    messages = {thy: [] for thy in thys}
+    messages.update(extract_finished_messages(thys, responses, store))
     return messages
 
 
+def extract_named_values_from_thy_messages(
+    messages: list[IsabelleMessage],
+) -> tuple[list[tuple[str | None, Any]], list[str]]:
+    """
+    Values with the name given to ``Json_Output.output`` (``None`` for ML
+    values) and errors of the messages of one theory.
+    """
+    values, errs = [], []
+    for message in messages:
+        match message["kind"]:
+            case "writeln":
+                if is_json_value(message["message"]):
+                    named_val, success = parse_json_value(message["message"])
+                    if success:
+                        values.append(named_val)
+                    continue
+                clean_message = message["message"].replace("\n", " ")
+                if is_ml_value(clean_message):
+                    ml_val, success = parse_ml_value(clean_message)
+                    if success:
+                        values.append((None, ml_val))
+            case "error":
+                errs.append(message["message"])
+    return values, errs
+
+
+def extract_ml_values_from_thy_messages(
+    messages: list[IsabelleMessage],
+) -> tuple[list[Any], list[str]]:
+    named_values, errs = extract_named_values_from_thy_messages(messages)
+    return [value for _, value in named_values], errs
+
+
 def extract_ml_values_from_messages(messages: dict[Theory, list[IsabelleMessage]]):
-    values, errs = {thy: [] for thy in messages}, {thy: [] for thy in messages}
+    values, errs = {}, {}
     for thy in messages:
-        for message in messages[thy]:
-            match message["kind"]:
-                case "writeln":
-                    clean_message = message["message"].replace("\n", " ")
-                    if is_ml_value(clean_message):
-                        ml_val, success = parse_ml_value(clean_message)
-                        if success:
-                            values[thy].append(ml_val)
-                case "error":
-                    errs[thy].append(message["message"])
+        values[thy], errs[thy] = extract_ml_values_from_thy_messages(messages[thy])
     return values, errs
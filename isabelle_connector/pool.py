@@ -0,0 +1,205 @@
+import asyncio
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+import os
+import tempfile
+from typing import Any
+from uuid import uuid4
+
+from isabelle_connector.heaps import ToolSessions
+from isabelle_connector.isabelle_connector import IsabelleConnector
+from isabelle_connector.isabelle_types import Theory
+from isabelle_connector.metrics import Metrics
+from isabelle_connector.retry import RetryPolicy
+from isabelle_connector.scheduler import schedule_batches
+from isabelle_connector.sinks import ArrowSink, thy_values
+
+
+@dataclass
+class IsabelleConnectorPool:
+    r"""
+    A pool of Isabelle servers that shards theories across several server
+    processes.
+
+    Every server is wrapped in its own :class:`IsabelleConnector` with a
+    distinct name, port, log file and session table. Batches are dispatched to
+    the server with the least outstanding work (number of theories in flight)
+    among those with a free slot, and the results are merged back into the
+    same ``values, errs`` shape as :meth:`IsabelleConnector.use_theories`.
+
+    :param name: Prefix for the names of the Isabelle server instances.
+    :param n_servers: Number of Isabelle servers to start.
+    :param base_port: First port to use; server ``i`` listens on
+        ``base_port + i`` (default: any free port).
+    :param session_dirs: list of directories for the Isabelle sessions.
+    :param working_directory: Working directory for server logs.
+    :param retry_policy: Timeouts and retries of failed batches.
+    :param tools: Prebuilt tool sessions shared by all servers.
+    :param metrics: Where all servers record per-phase timings and counters.
+    :param debug: Whether to enable debug logging.
+    """
+
+    name: str = "lemexp"
+    n_servers: int = 2
+    base_port: int | None = None
+    session_dirs: list[str] = field(
+        default_factory=lambda: ["$ISABELLE_HOME/src/HOL", "$AFP_BASE/thys"]
+    )
+    working_directory: str = ""
+    retry_policy: RetryPolicy = field(default_factory=RetryPolicy)
+    tools: ToolSessions | None = None
+    metrics: Metrics = field(default_factory=Metrics)
+    debug: bool = False
+
+    def __post_init__(self):
+        if not self.working_directory:
+            self.working_directory = os.path.join(tempfile.mkdtemp(), str(uuid4()))
+
+        self.connectors = []
+        for i in range(self.n_servers):
+            print(f"Starting server {i + 1} / {self.n_servers}: {self.name}_{i}")
+            server_directory = os.path.join(self.working_directory, f"server_{i}")
+            os.makedirs(server_directory, exist_ok=True)
+            self.connectors.append(
+                IsabelleConnector(
+                    name=f"{self.name}_{i}",
+                    session_dirs=self.session_dirs,
+                    working_directory=server_directory,
+                    port=None if self.base_port is None else self.base_port + i,
+                    retry_policy=self.retry_policy,
+                    tools=self.tools,
+                    metrics=self.metrics,
+                    debug=self.debug,
+                )
+            )
+
+    def shutdown(self) -> None:
+        """Shut down all Isabelle servers of the pool."""
+        for connector in self.connectors:
+            connector.shutdown()
+
+    async def iter_theories(
+        self,
+        thys: list[Theory],
+        batch_size: int = 1,
+        max_in_flight: int | None = None,
+        use_cache: bool = True,
+        sink: ArrowSink | None = None,
+        **kwargs,
+    ) -> AsyncIterator[tuple[Theory, list[Any], list[str]]]:
+        """
+        Pooled counterpart of :meth:`IsabelleConnector.iter_theories`.
+
+        :param max_in_flight: maximum number of concurrent commands per server
+            (defaults to the number of CPUs divided by the number of servers).
+        """
+        cached_thys, unprocessed_thys = self.connectors[0].split_cached(thys, use_cache)
+        for theory in cached_thys:
+            yield (
+                theory,
+                *thy_values(theory, self.connectors[0].store.get(theory) or [], sink),
+            )
+
+        if not unprocessed_thys:
+            self.metrics.flush()
+            return
+
+        max_in_flight = max_in_flight or max(1, (os.cpu_count() or 1) // self.n_servers)
+        in_flight = [0] * self.n_servers
+        outstanding = [0] * self.n_servers
+        slot_freed = asyncio.Condition()
+
+        async def run_batch(i: int, batch: list[Theory]):
+            try:
+                return await self.connectors[i].arun_batch(batch, **kwargs)
+            finally:
+                async with slot_freed:
+                    in_flight[i] -= 1
+                    outstanding[i] -= len(batch)
+                    slot_freed.notify()
+
+        tasks: list[asyncio.Future] = []
+
+        async def dispatch(results: asyncio.Queue):
+            store = self.connectors[0].store
+            timings = store.get_timings(thy.name for thy in unprocessed_thys)
+            quarantined = store.quarantined(unprocessed_thys)
+            for batch in schedule_batches(
+                unprocessed_thys, batch_size, timings, quarantined
+            ):
+                async with slot_freed:
+                    await slot_freed.wait_for(lambda: min(in_flight) < max_in_flight)
+                    # least outstanding work among servers with a free slot
+                    i = min(
+                        (
+                            j
+                            for j in range(self.n_servers)
+                            if in_flight[j] < max_in_flight
+                        ),
+                        key=lambda j: outstanding[j],
+                    )
+                    in_flight[i] += 1
+                    outstanding[i] += len(batch)
+                # sessions are per server, so they are assigned at dispatch time
+                self.connectors[i].prepare_sessions(batch)
+                task = asyncio.ensure_future(run_batch(i, batch))
+                task.add_done_callback(results.put_nowait)
+                tasks.append(task)
+            return len(tasks)
+
+        results: asyncio.Queue = asyncio.Queue()
+        dispatcher = asyncio.ensure_future(dispatch(results))
+        n_done = 0
+        try:
+            while not dispatcher.done() or n_done < dispatcher.result():
+                getter = asyncio.ensure_future(results.get())
+                waiting = [getter] if dispatcher.done() else [getter, dispatcher]
+                await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    # the dispatcher finished (or failed) first; re-check
+                    getter.cancel()
+                    continue
+                n_done += 1
+                for theory, thy_messages in getter.result().result().items():
+                    yield theory, *thy_values(theory, thy_messages, sink)
+        finally:
+            dispatcher.cancel()
+            for task in tasks:
+                task.cancel()
+            self.metrics.flush()
+
+    async def ause_theories(
+        self,
+        thys: list[Theory],
+        batch_size: int = 1,
+        max_in_flight: int | None = None,
+        use_cache: bool = True,
+        sink: ArrowSink | None = None,
+        **kwargs,
+    ) -> tuple[dict[Theory, list[Any]], dict[Theory, list[str]]]:
+        values, errs = {}, {}
+        async for theory, theory_values, theory_errs in self.iter_theories(
+            thys, batch_size, max_in_flight, use_cache, sink, **kwargs
+        ):
+            values[theory], errs[theory] = theory_values, theory_errs
+
+        print(
+            f"Successful values from {len([v for v in values.values() if v])} / {len(thys)} theories"
+        )
+        return values, errs
+
+    def use_theories(
+        self,
+        thys: list[Theory],
+        batch_size: int = 1,
+        max_in_flight: int | None = None,
+        use_cache: bool = True,
+        sink: ArrowSink | None = None,
+        **kwargs,
+    ) -> tuple[dict[Theory, list[Any]], dict[Theory, list[str]]]:
+        """Blocking wrapper around :meth:`ause_theories`."""
+        return asyncio.run(
+            self.ause_theories(
+                thys, batch_size, max_in_flight, use_cache, sink, **kwargs
+            )
+        )
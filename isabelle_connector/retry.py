@@ -0,0 +1,37 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class RetryPolicy:
+    """
+    How to recover from batches that time out or end in ERROR or FAILED.
+
+    Theories of a failed batch that did not finish are split in halves and
+    resubmitted until the offending theories are isolated. A single theory
+    that keeps failing is retried ``max_retries`` times and then quarantined,
+    so that later runs schedule it in a batch of its own.
+
+    :param theory_timeout: seconds a theory may run without progress; passed
+        to Isabelle as ``watchdog_timeout`` and added to the batch deadline
+        per theory (``None`` disables).
+    :param batch_timeout: fixed seconds each batch may take on top of the
+        per-theory allowance (``None`` disables).
+    :param max_retries: retries of a single failing theory before it is
+        quarantined.
+    """
+
+    theory_timeout: float | None = None
+    batch_timeout: float | None = None
+    max_retries: int = 1
+
+    def deadline(self, n_theories: int) -> float | None:
+        """Seconds to wait for a batch of ``n_theories``, or ``None``."""
+        if self.theory_timeout is None and self.batch_timeout is None:
+            return None
+        return (self.batch_timeout or 0.0) + (self.theory_timeout or 0.0) * n_theories
+
+    def server_arguments(self) -> dict:
+        """Extra arguments of the ``use_theories`` command."""
+        if self.theory_timeout is None:
+            return {}
+        return {"watchdog_timeout": self.theory_timeout}
@@ -0,0 +1,102 @@
+from collections import deque
+import heapq
+import math
+from statistics import median
+
+from isabelle_connector.isabelle_types import Theory
+
+type BatchKey = tuple[str, str, tuple[str, ...]]
+
+
+def batch_key(thy: Theory) -> BatchKey:
+    """Theories can only share a ``use_theories`` call if their keys agree."""
+    return (
+        thy.session,
+        str(thy.working_directory),
+        tuple(sorted(str(imprt) for imprt in thy.imports)),
+    )
+
+
+def balance(
+    thys: list[Theory], batch_size: int, costs: dict[Theory, float]
+) -> list[list[Theory]]:
+    """
+    Split ``thys`` into as few batches of at most ``batch_size`` theories as
+    possible, assigning the most expensive theories first to the currently
+    cheapest batch (longest processing time first).
+    """
+    n_batches = math.ceil(len(thys) / batch_size)
+    batches: list[list[Theory]] = [[] for _ in range(n_batches)]
+    heap = [(0.0, i) for i in range(n_batches)]
+    for thy in sorted(thys, key=lambda thy: costs[thy], reverse=True):
+        cost, i = heapq.heappop(heap)
+        batches[i].append(thy)
+        if len(batches[i]) < batch_size:
+            heapq.heappush(heap, (cost + costs[thy], i))
+    return batches
+
+
+def schedule_batches(
+    thys: list[Theory],
+    batch_size: int,
+    timings: dict[str, float] | None = None,
+    isolated: set[Theory] | None = None,
+) -> list[list[Theory]]:
+    """
+    Group theories into batches that share session, working directory and
+    imports, and order them so that batches with overlapping imports run one
+    after another and their imports stay loaded in the session.
+
+    :param thys: theories to process.
+    :param batch_size: maximum number of theories per batch.
+    :param timings: historical seconds per theory, by theory name; theories
+        without history are assumed to cost the median.
+    :param isolated: theories to run in batches of their own, after the rest.
+    :returns: batches in the order they should be sent to the server.
+    """
+    timings = timings or {}
+    isolated = isolated or set()
+    default_cost = median(timings.values()) if timings else 1.0
+    costs = {thy: timings.get(thy.name, default_cost) for thy in thys}
+
+    groups: dict[BatchKey, list[Theory]] = {}
+    for thy in thys:
+        if thy in isolated:
+            continue
+        groups.setdefault(batch_key(thy), []).append(thy)
+
+    # sorting the keys places groups with common imports next to each other
+    batches = []
+    for key in sorted(groups):
+        batches.extend(balance(groups[key], batch_size, costs))
+    batches.extend([thy] for thy in thys if thy in isolated)
+    return batches
+
+
+def take_batch(
+    queue: deque[Theory],
+    batch_size: int,
+    isolated: set[Theory] | None = None,
+) -> list[Theory]:
+    """
+    Pop the next batch of at most ``batch_size`` theories from ``queue``,
+    stopping at the first theory whose batch key differs from the first one.
+    Isolated theories are returned alone.
+
+    The queue is meant to be filled in the order of
+    ``schedule_batches(thys, 1, ...)``, so that batches of any size can be cut
+    from it as the batch size changes.
+    """
+    isolated = isolated or set()
+    batch = [queue.popleft()]
+    if batch[0] in isolated:
+        return batch
+    key = batch_key(batch[0])
+    while (
+        queue
+        and len(batch) < batch_size
+        and queue[0] not in isolated
+        and batch_key(queue[0]) == key
+    ):
+        batch.append(queue.popleft())
+    return batch
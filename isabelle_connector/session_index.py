@@ -0,0 +1,254 @@
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+from functools import cache
+import os
+import re
+import subprocess
+import warnings
+
+from isabelle_connector.isabelle_types import Theory
+from isabelle_connector.source_index import parse_imports
+
+ROOT_TOKEN_RE = re.compile(
+    r"""
+      \(\*.*?\*\)                    # comment
+    | \\<open>.*?\\<close>           # cartouche
+    | "((?:[^"\\]|\\.)*)"            # quoted name
+    | ([\[\](),=+])                  # delimiter
+    | ([^\s\[\](),=+"]+)             # bare name
+    """,
+    re.DOTALL | re.VERBOSE,
+)
+
+# keywords of ROOT files that end the current entry of a session
+ROOT_KEYWORDS = frozenset(
+    {
+        "chapter",
+        "chapter_definition",
+        "session",
+        "description",
+        "options",
+        "sessions",
+        "directories",
+        "theories",
+        "document_theories",
+        "document_files",
+        "export_files",
+        "export_classpath",
+    }
+)
+
+
+def root_tokens(text: str) -> Iterator[tuple[str, bool]]:
+    """Tokens of a ROOT file, with whether each one is a delimiter."""
+    for match in ROOT_TOKEN_RE.finditer(text):
+        quoted, delimiter, bare = match.groups()
+        if delimiter is not None:
+            yield delimiter, True
+        elif quoted is not None:
+            yield quoted, False
+        elif bare is not None and not bare.startswith("\\<"):
+            yield bare, False
+
+
+@dataclass
+class SessionInfo:
+    """
+    A session defined in a ROOT file.
+
+    :param name: session name.
+    :param parent: parent session, whose image this session extends.
+    :param directory: directory of the session's theory files.
+    :param theories: paths of the session's theory files, without ``.thy``.
+    """
+
+    name: str
+    parent: str | None
+    directory: str
+    theories: list[str] = field(default_factory=list)
+
+
+def parse_root(text: str, root_dir: str) -> list[SessionInfo]:
+    """The sessions of the ROOT file ``text`` in directory ``root_dir``."""
+    sessions = []
+    tokens = list(root_tokens(text))
+    i, entry = 0, None
+    while i < len(tokens):
+        token, is_delimiter = tokens[i]
+        if not is_delimiter and token in ROOT_KEYWORDS:
+            entry = token
+            i += 1
+            if entry == "session":
+                name = tokens[i][0]
+                i += 1
+                directory = "."
+                while i < len(tokens) and tokens[i][0] != "=":
+                    if tokens[i] == ("in", False):
+                        directory = tokens[i + 1][0]
+                        i += 1
+                    i += 1
+                parent = None
+                if i + 1 < len(tokens) and not tokens[i + 1][1]:
+                    parent = tokens[i + 1][0]
+                    i += 1
+                sessions.append(
+                    SessionInfo(
+                        name,
+                        parent,
+                        os.path.normpath(os.path.join(root_dir, directory)),
+                    )
+                )
+                i += 1
+            continue
+        if is_delimiter and token in "[(":
+            # options and qualifiers like (global)
+            closing = "]" if token == "[" else ")"
+            while i < len(tokens) and tokens[i] != (closing, True):
+                i += 1
+        elif entry == "theories" and not is_delimiter and sessions:
+            session = sessions[-1]
+            session.theories.append(
+                os.path.normpath(os.path.join(session.directory, token))
+            )
+        i += 1
+    return sessions
+
+
+@cache
+def isabelle_getenv(name: str) -> str:
+    """An Isabelle setting such as ``ISABELLE_HOME``, empty if unavailable."""
+    try:
+        return subprocess.run(
+            ["isabelle", "getenv", "-b", name],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def expand_dir(path: str) -> str:
+    """Expand variables like the server does, falling back to Isabelle settings."""
+
+    def value(match: re.Match) -> str:
+        name = match.group(1)
+        return os.environ.get(name) or isabelle_getenv(name)
+
+    return re.sub(r"\$\{?(\w+)\}?", value, path)
+
+
+@dataclass
+class SessionIndex:
+    r"""
+    An index of the sessions defined by the ``ROOT`` and ``ROOTS`` files of
+    some session directories, as passed to ``isabelle build -d``: from every
+    theory file to its session, and from every session to its parent chain.
+
+    :param session_dirs: session directories; variables like ``$AFP_BASE``
+        are expanded.
+    """
+
+    session_dirs: list[str]
+
+    def __post_init__(self):
+        self.sessions: dict[str, SessionInfo] = {}
+        self.theory_sessions: dict[str, str] = {}
+        # global names (like Main) and base names of theories
+        self.theory_names: dict[str, str] = {}
+        for session_dir in self.session_dirs:
+            self.scan(os.path.abspath(expand_dir(session_dir)), set())
+
+    def scan(self, directory: str, seen: set[str]) -> None:
+        if directory in seen:
+            return
+        seen.add(directory)
+        root_path = os.path.join(directory, "ROOT")
+        if os.path.isfile(root_path):
+            with open(root_path, encoding="utf8") as root_file:
+                for session in parse_root(root_file.read(), directory):
+                    self.add(session)
+        roots_path = os.path.join(directory, "ROOTS")
+        if os.path.isfile(roots_path):
+            with open(roots_path, encoding="utf8") as roots_file:
+                for line in roots_file:
+                    entry = line.split("#", 1)[0].strip()
+                    if entry:
+                        entry_dir = os.path.normpath(os.path.join(directory, entry))
+                        self.scan(entry_dir, seen)
+
+    def add(self, session: SessionInfo) -> None:
+        if session.name in self.sessions:
+            warnings.warn(f"Session {session.name} is defined more than once")
+            return
+        self.sessions[session.name] = session
+        for path in session.theories:
+            self.theory_sessions.setdefault(path, session.name)
+            self.theory_names.setdefault(os.path.basename(path), session.name)
+
+    def session_of_file(self, path: str) -> str | None:
+        path = os.path.normpath(os.path.abspath(path))
+        return self.theory_sessions.get(path.removesuffix(".thy"))
+
+    def ancestors(self, session: str) -> list[str]:
+        """``session`` and its known ancestors, innermost first."""
+        chain = []
+        while session in self.sessions and session not in chain:
+            chain.append(session)
+            session = self.sessions[session].parent
+        return chain
+
+    def image_size(self, session: str) -> int:
+        """Number of theories in the image of ``session``."""
+        return sum(
+            len(self.sessions[name].theories) for name in self.ancestors(session)
+        )
+
+    def covering_session(self, required: Iterable[str]) -> str | None:
+        """
+        The smallest session whose image contains the theories of all
+        ``required`` sessions, if there is one.
+        """
+        required = {session for session in required if session in self.sessions}
+        if not required:
+            return None
+        candidates = [
+            name for name in self.sessions if required.issubset(self.ancestors(name))
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda name: (self.image_size(name), name))
+
+    def import_session(self, imprt: str, directory: str) -> str | None:
+        """The session of an import of a theory in ``directory``."""
+        qualifier, _, base_name = imprt.rpartition(".")
+        if qualifier in self.sessions:
+            return qualifier
+        session = self.session_of_file(os.path.join(directory, imprt))
+        if session is not None:
+            return session
+        return self.theory_names.get(os.path.basename(base_name))
+
+    def resolve(self, thy: Theory, default: str = "HOL") -> str:
+        """
+        The session of a source theory: the one listing its file or else the
+        smallest session whose image covers its imports.
+        """
+        path = os.path.join(thy.working_directory, f"{thy.name}.thy")
+        session = self.session_of_file(path)
+        if session is not None:
+            return session
+        try:
+            with open(path, encoding="utf8") as theory_file:
+                imports = parse_imports(theory_file.read())
+        except FileNotFoundError:
+            return default
+        directory = os.path.dirname(path)
+        required = [self.import_session(imprt, directory) for imprt in imports]
+        return self.covering_session(filter(None, required)) or default
+
+
+@cache
+def load_session_index(session_dirs: tuple[str, ...]) -> SessionIndex:
+    """The index of ``session_dirs``, parsed once per process."""
+    return SessionIndex(list(session_dirs))
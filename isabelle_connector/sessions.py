@@ -0,0 +1,309 @@
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+import json
+import os
+import warnings
+
+from isabelle_client.isabelle__client import IsabelleClient
+from isabelle_connector.metrics import Metrics
+
+
+def process_tree_rss(pid: int) -> int | None:
+    """
+    Resident set size in bytes of a process and all of its descendants.
+
+    The Isabelle server is started through a wrapper script, and the ML
+    processes of the sessions are children of the JVM, so the whole tree has
+    to be summed. Returns ``None`` where ``/proc`` is not available.
+    """
+    if not os.path.isdir("/proc"):
+        return None
+    children: dict[int, list[int]] = {}
+    rss_pages: dict[int, int] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", encoding="utf8") as stat_file:
+                # the command name may contain spaces, so split after it
+                stat = stat_file.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(stat[1]), []).append(int(entry))
+        rss_pages[int(entry)] = int(stat[21])
+    if pid not in rss_pages:
+        return None
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += rss_pages.get(current, 0)
+        stack.extend(children.get(current, []))
+    return total * os.sysconf("SC_PAGE_SIZE")
+
+
+@dataclass
+class RecyclePolicy:
+    """
+    When to retire a session and replace it with a fresh one.
+
+    :param max_theories: retire after this many theories (``None`` disables).
+    :param time_drift: retire when the recent wall time per theory exceeds the
+        session's baseline by this factor (``None`` disables).
+    :param max_error_rate: retire when the fraction of failed theories exceeds
+        this value (``None`` disables).
+    :param max_rss_mb: retire the oldest session when the server process tree
+        uses more memory than this (``None`` disables).
+    :param min_theories: number of theories to observe before the time drift
+        and error rate rules apply.
+    :param smoothing: weight of the latest batch in the recent time average.
+    """
+
+    max_theories: int | None = 1000
+    time_drift: float | None = 2.0
+    max_error_rate: float | None = 0.5
+    max_rss_mb: float | None = None
+    min_theories: int = 50
+    smoothing: float = 0.2
+
+
+@dataclass
+class SessionStats:
+    """Measured cost of a running session."""
+
+    session: str
+    session_id: str
+    assigned: int = 0
+    finished: int = 0
+    errors: int = 0
+    baseline: float | None = None
+    recent: float | None = None
+    baseline_time: float = 0.0
+
+    @property
+    def in_flight(self) -> int:
+        return self.assigned - self.finished
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.finished if self.finished else 0.0
+
+    def record(
+        self, n_theories: int, elapsed: float, n_errors: int, policy: RecyclePolicy
+    ) -> None:
+        self.finished += n_theories
+        self.errors += n_errors
+        per_theory = elapsed / max(n_theories, 1)
+        if self.baseline is None or self.finished <= policy.min_theories:
+            # the baseline is the average over the first theories of the session
+            self.baseline_time += elapsed
+            self.baseline = self.baseline_time / self.finished
+        if self.recent is None:
+            self.recent = per_theory
+        else:
+            self.recent += policy.smoothing * (per_theory - self.recent)
+
+    def exhausted(self, policy: RecyclePolicy) -> str | None:
+        """Reason to retire this session, or ``None`` if it should be kept."""
+        if policy.max_theories is not None and self.assigned >= policy.max_theories:
+            return f"{self.assigned} theories"
+        if self.finished < policy.min_theories:
+            return None
+        if (
+            policy.time_drift is not None
+            and self.baseline
+            and self.recent
+            and self.recent > policy.time_drift * self.baseline
+        ):
+            return f"{self.recent:.2f}s per theory (baseline {self.baseline:.2f}s)"
+        if (
+            policy.max_error_rate is not None
+            and self.error_rate > policy.max_error_rate
+        ):
+            return f"error rate {self.error_rate:.0%}"
+        return None
+
+
+@dataclass
+class SessionManager:
+    r"""
+    Keeps track of the sessions of one Isabelle server.
+
+    Sessions are recycled according to a :class:`RecyclePolicy`, retired
+    sessions are stopped with ``session_stop`` once their last theory
+    finished, and ``n_warm`` pre-started sessions per logic are kept ready so
+    that a recycle does not wait for a cold ``session_start``. Warm sessions
+    are started and stopped in a background thread.
+
+    :param client: client of the Isabelle server.
+    :param session_dirs: list of directories for the Isabelle sessions.
+    :param policy: when to recycle a session.
+    :param n_warm: number of pre-started sessions to keep per logic.
+    :param server_pid: process ID of the server, used for the memory rule.
+    :param metrics: where to count session starts, stops and recycles.
+    """
+
+    client: IsabelleClient
+    session_dirs: list[str] = field(default_factory=list)
+    policy: RecyclePolicy = field(default_factory=RecyclePolicy)
+    n_warm: int = 1
+    server_pid: int | None = None
+    metrics: Metrics = field(default_factory=Metrics)
+    active: dict[str, SessionStats] = field(default_factory=dict)
+    warm: dict[str, list[Future]] = field(default_factory=dict)
+    retired: dict[str, SessionStats] = field(default_factory=dict)
+    started: int = 0
+
+    def __post_init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._by_id: dict[str, SessionStats] = {}
+
+    async def astart(self, session: str) -> str:
+        arguments = {"session": session, "dirs": self.session_dirs}
+        responses = await self.client.execute_command(
+            f"session_start {json.dumps(arguments)}"
+        )
+        if responses[-1].response_type != "FINISHED":
+            raise ValueError(
+                f"Failed to start session {session}: {responses[-1].response_body}"
+            )
+        return json.loads(responses[-1].response_body)["session_id"]
+
+    async def astop(self, session_id: str) -> None:
+        await self.client.execute_command(
+            f"session_stop {json.dumps({'session_id': session_id})}"
+        )
+
+    def _run(self, coroutine):
+        # runs in the background thread, which has no event loop of its own
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def _start(self, session: str) -> Future:
+        self.started += 1
+        self.metrics.count("session_starts")
+        return self._executor.submit(lambda: self._run(self.astart(session)))
+
+    def _stop(self, stats: SessionStats) -> None:
+        print(f"Stopping session {stats.session} after {stats.finished} theories")
+        self.metrics.count("session_stops")
+        self.retired.pop(stats.session_id, None)
+        self._by_id.pop(stats.session_id, None)
+        self._stop_id(stats.session_id)
+
+    def _stop_id(self, session_id: str) -> None:
+        future = self._executor.submit(lambda: self._run(self.astop(session_id)))
+        future.add_done_callback(_warn_on_error)
+
+    def replenish(self, session: str) -> None:
+        warm = self.warm.setdefault(session, [])
+        while len(warm) < self.n_warm:
+            warm.append(self._start(session))
+
+    def acquire(self, session: str, n_theories: int = 1) -> str:
+        """
+        Session ID to use for the next ``n_theories`` theories of ``session``.
+        """
+        stats = self.active.get(session)
+        if stats is not None and (reason := stats.exhausted(self.policy)):
+            print(f"Recycling session for {session} after {reason}")
+            self.metrics.count("session_recycles")
+            self.retire(session)
+            stats = None
+        if stats is None:
+            warm = self.warm.get(session)
+            future = warm.pop(0) if warm else self._start(session)
+            if not future.done():
+                print(f"Starting session {session}")
+            stats = SessionStats(session, future.result())
+            self.active[session] = stats
+            self._by_id[stats.session_id] = stats
+            self.replenish(session)
+        stats.assigned += n_theories
+        return stats.session_id
+
+    def retire_id(self, session_id: str) -> None:
+        """Retire ``session_id`` if it is still the active session of its logic."""
+        stats = self._by_id.get(session_id)
+        if stats is not None and self.active.get(stats.session) is stats:
+            self.retire(stats.session)
+
+    def retire(self, session: str) -> None:
+        stats = self.active.pop(session)
+        if stats.in_flight:
+            self.retired[stats.session_id] = stats
+        else:
+            self._stop(stats)
+
+    def record(
+        self, session_id: str, n_theories: int, elapsed: float, n_errors: int = 0
+    ) -> None:
+        """Record that ``n_theories`` finished on ``session_id``."""
+        stats = self._by_id.get(session_id)
+        if stats is None:
+            return
+        stats.record(n_theories, elapsed, n_errors, self.policy)
+        if session_id in self.retired and not stats.in_flight:
+            self._stop(stats)
+        self.check_memory()
+
+    def check_memory(self) -> None:
+        if self.policy.max_rss_mb is None or self.server_pid is None:
+            return
+        rss = process_tree_rss(self.server_pid)
+        if rss is None or rss <= self.policy.max_rss_mb * 2**20 or not self.active:
+            return
+        oldest = max(self.active.values(), key=lambda stats: stats.assigned)
+        print(
+            f"Recycling session for {oldest.session} at {rss / 2**20:.0f} MB server memory"
+        )
+        self.metrics.count("session_recycles")
+        self.retire(oldest.session)
+
+    def adopt(self, sessions: dict[str, list[str]]) -> None:
+        """Use already running sessions, by logic, as warm sessions."""
+        for session, session_ids in sessions.items():
+            for session_id in session_ids:
+                future: Future = Future()
+                future.set_result(session_id)
+                self.warm.setdefault(session, []).append(future)
+
+    def detach(self) -> dict[str, list[str]]:
+        """
+        Give up the active and warm sessions without stopping them and return
+        their IDs by logic. Retired sessions are stopped as usual.
+        """
+        sessions: dict[str, list[str]] = {}
+        for session, stats in self.active.items():
+            sessions.setdefault(session, []).append(stats.session_id)
+        self.active.clear()
+        for stats in list(self.retired.values()):
+            self._stop(stats)
+        for session, warm in self.warm.items():
+            for future in warm:
+                if future.exception() is None:
+                    sessions.setdefault(session, []).append(future.result())
+        self.warm.clear()
+        self._executor.shutdown(wait=True)
+        return sessions
+
+    def shutdown(self) -> None:
+        """Stop all active, retired and warm sessions."""
+        for session in list(self.active):
+            self._stop(self.active.pop(session))
+        for stats in list(self.retired.values()):
+            self._stop(stats)
+        for warm in self.warm.values():
+            for future in warm:
+                if future.exception() is None:
+                    self._stop_id(future.result())
+        self.warm.clear()
+        self._executor.shutdown(wait=True)
+
+
+def _warn_on_error(future: Future) -> None:
+    if future.exception() is not None:
+        warnings.warn(f"Failed to stop session: {future.exception()}")
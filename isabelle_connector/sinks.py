@@ -0,0 +1,286 @@
+"""
+Sinks that append the values of extraction theories to sharded Parquet or
+Arrow IPC files as each theory's values are parsed, instead of returning them.
+
+Every value kind (the name given to ``Json_Output.output``) has a row schema
+that flattens its values into table rows. Rows are buffered up to
+``row_group_size`` and written as one row group (Parquet) or record batch
+(Arrow); a new shard is started every ``rows_per_shard`` rows. String columns
+are dictionary-encoded. The shards can be read back memory-mapped with
+:func:`read_shards`.
+
+pyarrow is only needed once a sink is created.
+"""
+
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass
+import glob
+import os
+from typing import Any, Literal, Self
+from uuid import uuid4
+
+from isabelle_connector.isabelle_types import IsabelleMessage, Theory
+from isabelle_connector.parse import (
+    extract_ml_values_from_thy_messages,
+    extract_named_values_from_thy_messages,
+)
+
+
+@dataclass(frozen=True)
+class RowSchema:
+    """
+    The table layout of one value kind.
+
+    :param columns: column names and types, ``string``, ``int64`` or
+        ``list<string>``.
+    :param rows: flattens one value into rows.
+    :param dictionary: string columns to dictionary-encode in the schema
+        itself; Parquet dictionary-encodes all string columns on disk anyway.
+    """
+
+    columns: tuple[tuple[str, str], ...]
+    rows: Callable[[Any], Iterable[tuple]]
+    dictionary: frozenset[str] = frozenset()
+
+
+def extraction_rows(value: list) -> Iterator[tuple]:
+    yield from value
+
+
+def transitions_rows(value: list) -> Iterator[tuple]:
+    theory, transitions = value
+    for name, text in transitions:
+        yield theory, name, text
+
+
+def transition_spans_rows(value: list) -> Iterator[tuple]:
+    for path, spans in value:
+        for name, start, stop in spans:
+            yield path, name, start, stop
+
+
+def conjecture_checks_rows(value: list) -> Iterator[tuple]:
+    for template, checks in value:
+        for candidate, verdict, milliseconds in checks:
+            yield template, candidate, verdict, milliseconds
+
+
+SCHEMAS = {
+    "extraction": RowSchema(
+        columns=(
+            ("theory", "string"),
+            ("name", "string"),
+            ("thm", "string"),
+            ("symbols", "list<string>"),
+            ("typs", "list<string>"),
+            ("template", "string"),
+        ),
+        rows=extraction_rows,
+        dictionary=frozenset({"theory"}),
+    ),
+    "transitions": RowSchema(
+        columns=(("theory", "string"), ("name", "string"), ("text", "string")),
+        rows=transitions_rows,
+        dictionary=frozenset({"theory", "name"}),
+    ),
+    "transition_spans": RowSchema(
+        columns=(
+            ("path", "string"),
+            ("name", "string"),
+            ("start", "int64"),
+            ("end", "int64"),
+        ),
+        rows=transition_spans_rows,
+        dictionary=frozenset({"path", "name"}),
+    ),
+    "conjecture_checks": RowSchema(
+        columns=(
+            ("template", "string"),
+            ("candidate", "string"),
+            ("verdict", "string"),
+            ("milliseconds", "int64"),
+        ),
+        rows=conjecture_checks_rows,
+        dictionary=frozenset({"template", "verdict"}),
+    ),
+}
+
+EXTENSIONS = {"parquet": "parquet", "arrow": "arrows"}
+
+
+def arrow_schema(schema: RowSchema):
+    import pyarrow as pa
+
+    types = {
+        "string": pa.string(),
+        "int64": pa.int64(),
+        "list<string>": pa.list_(pa.string()),
+    }
+    return pa.schema(
+        [
+            (
+                name,
+                pa.dictionary(pa.int32(), pa.string())
+                if name in schema.dictionary
+                else types[column_type],
+            )
+            for name, column_type in schema.columns
+        ]
+    )
+
+
+@dataclass
+class ArrowSink:
+    r"""
+    Appends the rows of one value kind to sharded files in ``output_dir``,
+    named ``<kind>-<run>-<shard>.parquet`` (or ``.arrows``, the Arrow IPC
+    stream format, which allows a dictionary per record batch).
+
+    :param output_dir: directory of the shards.
+    :param kind: value kind, a key of ``SCHEMAS``.
+    :param format: ``parquet`` or ``arrow``.
+    :param row_group_size: rows per Parquet row group or Arrow record batch,
+        and so the number of rows held in memory.
+    :param rows_per_shard: rows after which a new shard is started.
+    :param compression: Parquet compression codec.
+    """
+
+    output_dir: str
+    kind: str = "extraction"
+    format: Literal["parquet", "arrow"] = "parquet"
+    row_group_size: int = 65536
+    rows_per_shard: int = 1 << 22
+    compression: str = "zstd"
+
+    def __post_init__(self):
+        import pyarrow
+
+        self._pa = pyarrow
+        self.row_schema = SCHEMAS[self.kind]
+        self.schema = arrow_schema(self.row_schema)
+        self.paths: list[str] = []
+        self.n_rows = 0
+        self._run = uuid4().hex[:8]
+        self._rows: list[tuple] = []
+        self._writer = None
+        self._shard_rows = 0
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def write(self, thy: Theory, values: list[Any]) -> int:
+        """Append the rows of the values of ``thy``; returns their number."""
+        n_rows = 0
+        for value in values:
+            for row in self.row_schema.rows(value):
+                self._rows.append(row)
+                n_rows += 1
+                if len(self._rows) >= self.row_group_size:
+                    self.flush()
+        return n_rows
+
+    def flush(self) -> None:
+        """Write the buffered rows as one row group or record batch."""
+        if not self._rows:
+            return
+        columns = list(zip(*self._rows))
+        batch = self._pa.RecordBatch.from_arrays(
+            [
+                self._pa.array(column, type=field.type)
+                for column, field in zip(columns, self.schema)
+            ],
+            schema=self.schema,
+        )
+        self._rows = []
+        if self._writer is None:
+            self._writer = self.open_shard()
+        if self.format == "parquet":
+            self._writer.write_table(
+                self._pa.Table.from_batches([batch]), row_group_size=len(batch)
+            )
+        else:
+            self._writer.write_batch(batch)
+        self.n_rows += len(batch)
+        self._shard_rows += len(batch)
+        if self._shard_rows >= self.rows_per_shard:
+            self._writer.close()
+            self._writer = None
+            self._shard_rows = 0
+
+    def open_shard(self):
+        path = os.path.join(
+            self.output_dir,
+            f"{self.kind}-{self._run}-{len(self.paths):05d}.{EXTENSIONS[self.format]}",
+        )
+        self.paths.append(path)
+        if self.format == "parquet":
+            import pyarrow.parquet as pq
+
+            return pq.ParquetWriter(path, self.schema, compression=self.compression)
+        return self._pa.ipc.new_stream(path, self.schema)
+
+    def close(self) -> None:
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def sink_thy_values(
+    thy: Theory, messages: list[IsabelleMessage], sink: ArrowSink
+) -> tuple[list[Any], list[str], int]:
+    """
+    Parse the values of one theory and write those of kind ``sink.kind`` to
+    ``sink``. Returns the other values, the errors and the number of rows.
+    """
+    named_values, errs = extract_named_values_from_thy_messages(messages)
+    n_rows = sink.write(
+        thy, [value for name, value in named_values if name == sink.kind]
+    )
+    return [value for name, value in named_values if name != sink.kind], errs, n_rows
+
+
+def thy_values(
+    thy: Theory, messages: list[IsabelleMessage], sink: ArrowSink | None = None
+) -> tuple[list[Any], list[str]]:
+    """Values and errors of one theory, less those written to ``sink``."""
+    if sink is None:
+        return extract_ml_values_from_thy_messages(messages)
+    values, errs, _ = sink_thy_values(thy, messages, sink)
+    return values, errs
+
+
+def sink_values(
+    messages: dict[Theory, list[IsabelleMessage]], sink: ArrowSink
+) -> tuple[dict[Theory, list[Any]], dict[Theory, list[str]], dict[Theory, int]]:
+    """
+    :func:`sink_thy_values` of every theory, dropping each theory's messages
+    once written. Returns the other values, the errors and the number of
+    rows written per theory.
+    """
+    values, errs, n_rows = {}, {}, {}
+    for thy in list(messages):
+        values[thy], errs[thy], n_rows[thy] = sink_thy_values(
+            thy, messages.pop(thy), sink
+        )
+    return values, errs, n_rows
+
+
+def read_shards(output_dir: str, kind: str = "extraction"):
+    """All shards of ``kind`` in ``output_dir`` as one memory-mapped table."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tables = []
+    for path in sorted(glob.glob(os.path.join(output_dir, f"{kind}-*"))):
+        if path.endswith(".parquet"):
+            tables.append(pq.read_table(path, memory_map=True))
+        else:
+            tables.append(pa.ipc.open_stream(pa.memory_map(path)).read_all())
+    if not tables:
+        return arrow_schema(SCHEMAS[kind]).empty_table()
+    return pa.concat_tables(tables)
@@ -0,0 +1,189 @@
+from dataclasses import dataclass, field
+import hashlib
+import json
+import os
+import re
+
+# Comments and cartouches can mention "imports" and "begin" themselves
+COMMENT_RE = re.compile(r"\(\*.*?\*\)", re.DOTALL)
+HEADER_RE = re.compile(
+    r"\btheory\s+\S+\s+imports\s+(.*?)\s*\b(?:keywords|abbrevs|begin)\b",
+    re.DOTALL,
+)
+IMPORT_TOKEN_RE = re.compile(r'"([^"]+)"|(\S+)')
+
+
+def parse_imports(text: str) -> list[str]:
+    """The ``imports`` of a theory header, as written in the source."""
+    match = HEADER_RE.search(COMMENT_RE.sub(" ", text))
+    if match is None:
+        return []
+    return [quoted or bare for quoted, bare in IMPORT_TOKEN_RE.findall(match.group(1))]
+
+
+def base_name_of(path: str) -> str:
+    return os.path.basename(path).removesuffix(".thy")
+
+
+@dataclass
+class SourceEntry:
+    mtime: float
+    size: int
+    content_hash: str
+    imports: list[str]
+    fingerprint: str = ""
+
+
+@dataclass
+class SourceIndex:
+    r"""
+    A persistent index of source theory files.
+
+    For every ``.thy`` file it records the modification time, size, content
+    hash and parsed ``imports``. From these it derives a fingerprint that
+    covers the file and everything it transitively imports, and the dirty
+    set of an update: the changed files and every file that (transitively)
+    imports one of them.
+
+    :param path: JSON file the index is persisted to.
+    """
+
+    path: str
+    entries: dict[str, SourceEntry] = field(default_factory=dict)
+
+    def __post_init__(self):
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf8") as index_file:
+                self.entries = {
+                    path: SourceEntry(**entry)
+                    for path, entry in json.load(index_file).items()
+                }
+        self._index_names()
+
+    def _index_names(self) -> None:
+        self._by_base_name: dict[str, list[str]] = {}
+        for path in self.entries:
+            self._by_base_name.setdefault(base_name_of(path), []).append(path)
+
+    def _add(self, path: str) -> None:
+        """Scan ``path`` into the index, keeping the base names up to date."""
+        if path not in self.entries:
+            self._by_base_name.setdefault(base_name_of(path), []).append(path)
+        self.entries[path] = self._scan(path)
+
+    def _remove(self, path: str) -> None:
+        del self.entries[path]
+        base_name = base_name_of(path)
+        self._by_base_name[base_name].remove(path)
+        if not self._by_base_name[base_name]:
+            del self._by_base_name[base_name]
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf8") as index_file:
+            json.dump(
+                {path: entry.__dict__ for path, entry in self.entries.items()},
+                index_file,
+            )
+        os.replace(tmp_path, self.path)
+
+    def _scan(self, path: str) -> SourceEntry:
+        stat = os.stat(path)
+        entry = self.entries.get(path)
+        if entry is not None and (entry.mtime, entry.size) == (
+            stat.st_mtime,
+            stat.st_size,
+        ):
+            return entry
+        with open(path, "rb") as source_file:
+            content = source_file.read()
+        return SourceEntry(
+            mtime=stat.st_mtime,
+            size=stat.st_size,
+            content_hash=hashlib.sha256(content).hexdigest(),
+            imports=parse_imports(content.decode("utf8", errors="replace")),
+            fingerprint=entry.fingerprint if entry is not None else "",
+        )
+
+    def resolve(self, path: str, imprt: str) -> list[str]:
+        """
+        Indexed files an import of ``path`` may refer to.
+
+        Imports by path are resolved relative to the importing file. Qualified
+        (``Session.Theory``) and bare names are matched by base name,
+        preferring the importing file's directory; ambiguous names resolve to
+        all candidates so that the dirty set errs on the safe side. Imports
+        outside the index (e.g. ``Main``) resolve to nothing.
+        """
+        directory = os.path.dirname(path)
+        if "/" in imprt:
+            candidate = os.path.normpath(os.path.join(directory, f"{imprt}.thy"))
+            return [candidate] if candidate in self.entries else []
+        base_name = imprt.rsplit(".", 1)[-1]
+        local = os.path.join(directory, f"{base_name}.thy")
+        if local in self.entries:
+            return [local]
+        return self._by_base_name.get(base_name, [])
+
+    def update(self, paths: list[str]) -> set[str]:
+        """
+        Rescan ``paths`` and every file their imports reach, and return the
+        dirty set of ``paths``: files whose own content or whose transitive
+        imports changed since the last update. Reached files that no longer
+        exist are dropped from the index.
+        """
+        paths = [os.path.normpath(os.path.abspath(path)) for path in paths]
+        for path in paths:
+            self._add(path)
+
+        scanned, queue = set(paths), list(paths)
+        while queue:
+            path = queue.pop()
+            directory = os.path.dirname(path)
+            for imprt in self.entries[path].imports:
+                dependencies = self.resolve(path, imprt)
+                if not dependencies:
+                    # a file imported by path or next to the importing one
+                    # that is not indexed yet
+                    name = imprt if "/" in imprt else imprt.rsplit(".", 1)[-1]
+                    candidate = os.path.normpath(os.path.join(directory, f"{name}.thy"))
+                    dependencies = [candidate] if os.path.isfile(candidate) else []
+                for dependency in dependencies:
+                    if dependency in scanned:
+                        continue
+                    scanned.add(dependency)
+                    if not os.path.isfile(dependency):
+                        self._remove(dependency)
+                        continue
+                    self._add(dependency)
+                    queue.append(dependency)
+
+        fingerprints: dict[str, str] = {}
+
+        def fingerprint(path: str, visiting: frozenset = frozenset()) -> str:
+            if path not in fingerprints:
+                entry = self.entries[path]
+                digest = hashlib.sha256(entry.content_hash.encode("utf8"))
+                for imprt in entry.imports:
+                    for dependency in self.resolve(path, imprt):
+                        if dependency not in visiting:
+                            digest.update(
+                                fingerprint(dependency, visiting | {path}).encode(
+                                    "utf8"
+                                )
+                            )
+                fingerprints[path] = digest.hexdigest()
+            return fingerprints[path]
+
+        dirty = set()
+        for path in paths:
+            new_fingerprint = fingerprint(path)
+            if self.entries[path].fingerprint != new_fingerprint:
+                dirty.add(path)
+                self.entries[path].fingerprint = new_fingerprint
+        return dirty
+
+    def fingerprint(self, path: str) -> str:
+        """Fingerprint of ``path`` and its transitive imports (after update)."""
+        return self.entries[os.path.normpath(os.path.abspath(path))].fingerprint
@@ -0,0 +1,346 @@
+from collections import OrderedDict
+from collections.abc import Iterable
+from dataclasses import dataclass
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from isabelle_connector.isabelle_types import IsabelleMessage, Theory
+
+# SQLite limits the number of host parameters per statement
+QUERY_CHUNK_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    content_hash TEXT NOT NULL,
+    isabelle_version TEXT NOT NULL,
+    session TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL,
+    messages BLOB NOT NULL,
+    PRIMARY KEY (content_hash, isabelle_version, session)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access);
+CREATE TABLE IF NOT EXISTS timings (
+    name TEXT PRIMARY KEY,
+    seconds REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS quarantine (
+    content_hash TEXT NOT NULL,
+    isabelle_version TEXT NOT NULL,
+    session TEXT NOT NULL,
+    name TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    time REAL NOT NULL,
+    PRIMARY KEY (content_hash, isabelle_version, session)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS tuning (
+    workload TEXT PRIMARY KEY,
+    batch_size INTEGER NOT NULL,
+    max_in_flight INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def encode_messages(messages: list[IsabelleMessage]) -> bytes:
+    return zlib.compress(json.dumps(messages, separators=(",", ":")).encode("utf8"))
+
+
+def decode_messages(data: bytes) -> list[IsabelleMessage]:
+    return json.loads(zlib.decompress(data))
+
+
+def source_stamp(thy: Theory) -> str:
+    """Modification time and size of the source file of ``thy``, if any."""
+    try:
+        stat = os.stat(os.path.join(thy.working_directory, f"{thy.name}.thy"))
+    except FileNotFoundError:
+        return ""
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def chunks(items: list, size: int = QUERY_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+@dataclass
+class ResultStore:
+    r"""
+    A single SQLite file holding the messages of processed theories.
+
+    Results are keyed by the SHA-256 of the rendered theory, its working
+    directory and, for theories that are not temp theories, the modification
+    time and size of their source file, together with the Isabelle version
+    and the session. So the same store can be shared by several working
+    directories, sessions and connector processes, and edited source files
+    are processed again. Messages are stored as compressed JSON. When
+    ``max_bytes`` is set, the least recently used results are evicted once
+    the store grows beyond it.
+
+    In front of the file, the ``max_recent`` most recently read or written
+    results are kept in memory under the same keys.
+
+    :param path: path of the SQLite database.
+    :param isabelle_version: Isabelle version the results were computed with.
+    :param max_bytes: maximum total size of the stored messages.
+    :param max_recent: number of results kept in memory (0 disables).
+    :param timeout: seconds to wait for a lock held by another process.
+    """
+
+    path: str
+    isabelle_version: str = ""
+    max_bytes: int | None = None
+    max_recent: int = 1024
+    timeout: float = 60.0
+
+    def __post_init__(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._local = threading.local()
+        self._recent: OrderedDict[tuple[str, str, str], list[IsabelleMessage]] = (
+            OrderedDict()
+        )
+        self._recent_lock = threading.Lock()
+        # last accesses of results recalled from memory, applied before eviction
+        self._touched: dict[tuple[str, str, str], float] = {}
+        with self.connection() as connection:
+            connection.executescript(SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_local"], state["_recent_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._recent_lock = threading.Lock()
+
+    def key(self, thy: Theory) -> tuple[str, str, str]:
+        digest = hashlib.sha256(thy.content_hash().encode("utf8"))
+        digest.update(os.path.abspath(thy.working_directory).encode("utf8"))
+        if not thy.is_temp:
+            digest.update(source_stamp(thy).encode("utf8"))
+        return (digest.hexdigest(), self.isabelle_version, thy.session)
+
+    def _lookup(self, thys: Iterable[Theory], columns: str):
+        keyed = {self.key(thy): thy for thy in thys}
+        connection = self.connection()
+        for key_chunk in chunks(list(keyed)):
+            conditions = " OR ".join(
+                ["(content_hash = ? AND isabelle_version = ? AND session = ?)"]
+                * len(key_chunk)
+            )
+            rows = connection.execute(
+                f"SELECT content_hash, isabelle_version, session{columns} "
+                f"FROM results WHERE {conditions}",
+                [part for key in key_chunk for part in key],
+            ).fetchall()
+            for row in rows:
+                yield keyed[row[:3]], row
+            if rows:
+                with connection:
+                    connection.executemany(
+                        "UPDATE results SET last_access = ? WHERE content_hash = ? "
+                        "AND isabelle_version = ? AND session = ?",
+                        [(time.time(), *row[:3]) for row in rows],
+                    )
+
+    def recall(self, thys: Iterable[Theory]) -> dict[Theory, list[IsabelleMessage]]:
+        """The results of ``thys`` among the recent ones kept in memory."""
+        recalled = {}
+        with self._recent_lock:
+            for thy in thys:
+                key = self.key(thy)
+                if key in self._recent:
+                    self._recent.move_to_end(key)
+                    recalled[thy] = self._recent[key]
+                    self._touched[key] = time.time()
+        if len(self._touched) > self.max_recent:
+            self.flush_touched()
+        return recalled
+
+    def flush_touched(self) -> None:
+        """Record the accesses of results recalled from memory in the file."""
+        with self._recent_lock:
+            touched, self._touched = self._touched, {}
+        connection = self.connection()
+        with connection:
+            connection.executemany(
+                "UPDATE results SET last_access = ? WHERE content_hash = ? "
+                "AND isabelle_version = ? AND session = ?",
+                [(access, *key) for key, access in touched.items()],
+            )
+
+    def remember(self, results: dict[Theory, list[IsabelleMessage]]) -> None:
+        if not self.max_recent:
+            return
+        with self._recent_lock:
+            for thy, messages in results.items():
+                key = self.key(thy)
+                self._recent[key] = messages
+                self._recent.move_to_end(key)
+            while len(self._recent) > self.max_recent:
+                self._recent.popitem(last=False)
+
+    def contains_many(self, thys: Iterable[Theory]) -> set[Theory]:
+        """The subset of ``thys`` with stored results, in one bulk query."""
+        thys = list(thys)
+        recalled = self.recall(thys)
+        rest = [thy for thy in thys if thy not in recalled]
+        return set(recalled) | {thy for thy, _ in self._lookup(rest, "")}
+
+    def get_many(self, thys: Iterable[Theory]) -> dict[Theory, list[IsabelleMessage]]:
+        thys = list(thys)
+        results = self.recall(thys)
+        rest = [thy for thy in thys if thy not in results]
+        read = {
+            thy: decode_messages(row[3])
+            for thy, row in self._lookup(rest, ", messages")
+        }
+        self.remember(read)
+        return results | read
+
+    def get(self, thy: Theory) -> list[IsabelleMessage] | None:
+        return self.get_many([thy]).get(thy)
+
+    def put_many(
+        self, results: dict[Theory, list[IsabelleMessage]], evict: bool = True
+    ) -> None:
+        now = time.time()
+        rows = []
+        for thy, messages in results.items():
+            data = encode_messages(messages)
+            rows.append((*self.key(thy), thy.name, len(data), now, data))
+        connection = self.connection()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+        self.remember(results)
+        if evict and self.max_bytes is not None:
+            self.evict(self.max_bytes)
+
+    def put(self, thy: Theory, messages: list[IsabelleMessage]) -> None:
+        self.put_many({thy: messages})
+
+    def get_timings(self, names: Iterable[str]) -> dict[str, float]:
+        """Historical seconds per theory, by theory name."""
+        timings = {}
+        connection = self.connection()
+        for name_chunk in chunks(list(set(names))):
+            timings.update(
+                connection.execute(
+                    "SELECT name, seconds FROM timings WHERE name IN "
+                    f"({', '.join('?' * len(name_chunk))})",
+                    name_chunk,
+                ).fetchall()
+            )
+        return timings
+
+    def put_timings(self, timings: dict[str, float]) -> None:
+        connection = self.connection()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO timings VALUES (?, ?)", timings.items()
+            )
+
+    def get_tuning(self, workload: str) -> tuple[int, int] | None:
+        """Tuned ``(batch_size, max_in_flight)`` of a workload type."""
+        return (
+            self.connection()
+            .execute(
+                "SELECT batch_size, max_in_flight FROM tuning WHERE workload = ?",
+                (workload,),
+            )
+            .fetchone()
+        )
+
+    def put_tuning(self, workload: str, batch_size: int, max_in_flight: int) -> None:
+        connection = self.connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO tuning VALUES (?, ?, ?)",
+                (workload, batch_size, max_in_flight),
+            )
+
+    def quarantine(self, thy: Theory, reason: str) -> None:
+        """Remember that ``thy`` keeps failing, so it is scheduled alone."""
+        connection = self.connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO quarantine VALUES (?, ?, ?, ?, ?, ?)",
+                (*self.key(thy), thy.name, reason, time.time()),
+            )
+
+    def quarantined(self, thys: Iterable[Theory]) -> set[Theory]:
+        """The subset of ``thys`` in quarantine, in one bulk query."""
+        keyed = {self.key(thy): thy for thy in thys}
+        connection = self.connection()
+        found = set()
+        for key_chunk in chunks(list(keyed)):
+            conditions = " OR ".join(
+                ["(content_hash = ? AND isabelle_version = ? AND session = ?)"]
+                * len(key_chunk)
+            )
+            rows = connection.execute(
+                "SELECT content_hash, isabelle_version, session "
+                f"FROM quarantine WHERE {conditions}",
+                [part for key in key_chunk for part in key],
+            ).fetchall()
+            found.update(keyed[tuple(row)] for row in rows)
+        return found
+
+    def size(self) -> int:
+        (size,) = (
+            self.connection()
+            .execute("SELECT COALESCE(SUM(size), 0) FROM results")
+            .fetchone()
+        )
+        return size
+
+    def evict(self, max_bytes: int) -> int:
+        """
+        Remove least recently used results until the store is at most
+        ``max_bytes`` large. Returns the number of removed results.
+        """
+        excess = self.size() - max_bytes
+        if excess <= 0:
+            return 0
+        self.flush_touched()
+        with self._recent_lock:
+            # evicted results must not be recalled from memory either
+            self._recent.clear()
+        connection = self.connection()
+        with connection:
+            rows = connection.execute(
+                "SELECT content_hash, isabelle_version, session, size "
+                "FROM results ORDER BY last_access"
+            )
+            victims = []
+            for *key, size in rows:
+                if excess <= 0:
+                    break
+                victims.append(key)
+                excess -= size
+            connection.executemany(
+                "DELETE FROM results WHERE content_hash = ? "
+                "AND isabelle_version = ? AND session = ?",
+                victims,
+            )
+        return len(victims)
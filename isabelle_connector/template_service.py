@@ -0,0 +1,246 @@
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+from typing import Self
+from urllib.parse import urlsplit
+
+from isabelle_connector.isabelle_types import Theory
+from isabelle_connector.utils import ml_string
+
+type NameSet = tuple[str, ...]
+
+
+def name_set(function_names: list[str]) -> NameSet:
+    """Cache key of a function-name set, as ``Get_Templates.cache_key``."""
+    return tuple(sorted(set(function_names)))
+
+
+def placeholder_templates(function_names: list[str]) -> dict:
+    return {"function_names": function_names, "templates": []}
+
+
+@dataclass
+class TemplateServer:
+    r"""
+    A local stand-in for the template service used by ``Get_Templates``.
+
+    It answers ``POST /generate_templates`` with ``{"function_names": [...]}``
+    and ``POST /generate_templates_batch`` with
+    ``{"function_names_batch": [[...], ...]}``, the latter with one JSON
+    document per line. Connections are kept alive (HTTP/1.1).
+
+    :param generate: the response for a list of function names.
+    :param latency: seconds of simulated work per function-name set.
+    :param batch_endpoint: whether to serve the batch endpoint, as older
+        services do not.
+    :param requests: paths of the requests received so far.
+    :param connections: number of connections accepted so far.
+    """
+
+    generate: Callable[[list[str]], object] = placeholder_templates
+    latency: float = 0.0
+    batch_endpoint: bool = True
+    requests: list[str] = field(default_factory=list)
+    connections: int = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> Self:
+        """Start listening on a free port in a background thread."""
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                service.connections += 1
+
+            def respond(self, status: int, body: str) -> None:
+                data = body.encode("utf8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                service.requests.append(self.path)
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                if self.path == "/generate_templates":
+                    names = payload["function_names"]
+                    self.respond(200, json.dumps(service.answer(names)))
+                elif (
+                    self.path == "/generate_templates_batch" and service.batch_endpoint
+                ):
+                    lines = [
+                        json.dumps(service.answer(names))
+                        for names in payload["function_names_batch"]
+                    ]
+                    self.respond(200, "".join(f"{line}\n" for line in lines))
+                else:
+                    self.respond(404, json.dumps(f"No endpoint {self.path}"))
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def answer(self, function_names: list[str]) -> object:
+        time.sleep(self.latency)
+        return self.generate(function_names)
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self) -> Self:
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+@dataclass
+class TemplateClient:
+    """
+    Client of the template service with batched requests, a memo cache by
+    function-name set and one kept-alive connection per thread.
+
+    :param url: base URL of the service.
+    :param batch_size: maximum number of function-name sets per request.
+    :param timeout: seconds per request.
+    """
+
+    url: str = "http://127.0.0.1:5000"
+    batch_size: int = 64
+    timeout: float = 60.0
+    cache: dict[NameSet, str] = field(default_factory=dict)
+
+    def __post_init__(self):
+        parts = urlsplit(self.url if "//" in self.url else f"http://{self.url}")
+        self._host, self._port = parts.hostname, parts.port or 80
+        self._prefix = parts.path.rstrip("/")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _post(self, path: str, payload: dict) -> tuple[int, str]:
+        body = json.dumps(payload)
+        for attempt in range(2):
+            conn = getattr(self._local, "conn", None)
+            if conn is None:
+                conn = http.client.HTTPConnection(
+                    self._host, self._port, timeout=self.timeout
+                )
+                self._local.conn = conn
+            try:
+                conn.request(
+                    "POST",
+                    self._prefix + path,
+                    body,
+                    {"Content-Type": "application/json"},
+                )
+                response = conn.getresponse()
+                return response.status, response.read().decode("utf8")
+            except (http.client.HTTPException, ConnectionError):
+                # the server may have closed a kept-alive connection
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+        raise AssertionError("unreachable")
+
+    def _fetch_batch(self, sets: list[NameSet]) -> list[str]:
+        status, body = self._post(
+            "/generate_templates_batch",
+            {"function_names_batch": [list(names) for names in sets]},
+        )
+        if status == 404:
+            return [self._fetch_one(names) for names in sets]
+        lines = [line for line in body.splitlines() if line]
+        if status != 200 or len(lines) != len(sets):
+            raise RuntimeError(f"Template service answered {status}: {body[:200]}")
+        return lines
+
+    def _fetch_one(self, names: NameSet) -> str:
+        status, body = self._post(
+            "/generate_templates", {"function_names": list(names)}
+        )
+        if status != 200:
+            raise RuntimeError(f"Template service answered {status}: {body[:200]}")
+        return body
+
+    def get(self, function_name_sets: list[list[str]]) -> list[str]:
+        """Responses for the function-name sets, in order."""
+        keys = [name_set(names) for names in function_name_sets]
+        with self._lock:
+            missing = list(dict.fromkeys(key for key in keys if key not in self.cache))
+        for i in range(0, len(missing), self.batch_size):
+            chunk = missing[i : i + self.batch_size]
+            responses = self._fetch_batch(chunk)
+            with self._lock:
+                self.cache.update(zip(chunk, responses))
+        return [self.cache[key] for key in keys]
+
+    def prefetch(
+        self, function_name_sets: list[list[str]], max_workers: int = 8
+    ) -> dict[NameSet, str]:
+        """Fetch the sets in concurrent batches and return them by name set."""
+        keys = list(dict.fromkeys(name_set(names) for names in function_name_sets))
+        chunks = [
+            [list(key) for key in keys[i : i + self.batch_size]]
+            for i in range(0, len(keys), self.batch_size)
+        ]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(self.get, chunks))
+        return {key: self.cache[key] for key in keys}
+
+
+def prime_block(responses: dict[NameSet, str]) -> str:
+    """ML code seeding the cache of ``Get_Templates`` with ``responses``."""
+    entries = ",\n".join(
+        f"([{', '.join(ml_string(name) for name in names)}], {ml_string(response)})"
+        for names, response in responses.items()
+    )
+    return f"Get_Templates.prime [\n{entries}]"
+
+
+def prefetch_templates(
+    thys: list[Theory],
+    function_name_sets: Callable[[Theory], list[list[str]]],
+    client: TemplateClient,
+    max_workers: int = 8,
+) -> dict[NameSet, str]:
+    """
+    Fetch the templates that a batch of theories will ask for, concurrently
+    and in batches, and add an ML block to the front of every theory that
+    seeds the ``Get_Templates`` cache with its responses. The theories then
+    make no requests of their own for these sets.
+
+    The theories must load ``GetTemplates.ML`` through their imports.
+
+    :param function_name_sets: the sets each theory will look up.
+    """
+    sets_by_thy = {thy: function_name_sets(thy) for thy in thys}
+    responses = client.prefetch(
+        [names for sets in sets_by_thy.values() for names in sets], max_workers
+    )
+    for thy, sets in sets_by_thy.items():
+        if sets:
+            own = {name_set(names): responses[name_set(names)] for names in sets}
+            thy.add_ml_block(prime_block(own), index=0)
+    return responses
@@ -0,0 +1,136 @@
+from dataclasses import dataclass, field
+import os
+import time
+
+
+@dataclass
+class AdaptiveController:
+    r"""
+    Tunes the batch size and the number of in-flight batches of
+    ``use_theories`` at runtime.
+
+    Finished batches are grouped into windows of ``window`` batches. After
+    each window the controller compares the throughput (theories per second
+    of wall time) with the best window so far and climbs one dimension at a
+    time: the batch size is doubled and the concurrency raised by one while
+    throughput improves; when it gets worse, the best setting is restored and
+    the other dimension is tried. When both dimensions stop improving the
+    controller holds its setting.
+
+    Independently of the hill climbing, a window with too many failed
+    theories, too much server memory or batches slower than
+    ``max_batch_seconds`` halves both parameters (multiplicative decrease).
+
+    :param batch_size: current number of theories per batch.
+    :param max_in_flight: current number of concurrent batches.
+    :param max_batch_size: upper bound of the batch size.
+    :param max_concurrency: upper bound of the concurrency.
+    :param window: number of finished batches between adjustments.
+    :param max_error_rate: back off above this fraction of failed theories.
+    :param max_batch_seconds: back off when the average batch takes longer
+        (``None`` disables).
+    :param max_rss_mb: back off when the server uses more memory
+        (``None`` disables).
+    :param tolerance: relative throughput change regarded as noise.
+    """
+
+    batch_size: int = 4
+    max_in_flight: int = 2
+    max_batch_size: int = 1000
+    max_concurrency: int = field(default_factory=lambda: os.cpu_count() or 1)
+    window: int = 4
+    max_error_rate: float = 0.2
+    max_batch_seconds: float | None = 600.0
+    max_rss_mb: float | None = None
+    tolerance: float = 0.05
+
+    def __post_init__(self):
+        self._dimension = "batch_size"
+        self._stalled = 0
+        self._best: tuple[float, int, int] | None = None
+        self._reset_window()
+
+    def _reset_window(self) -> None:
+        self._start = time.perf_counter()
+        self._batches = self._theories = self._failed = 0
+        self._seconds = 0.0
+        self._rss: int | None = None
+
+    @property
+    def settings(self) -> tuple[int, int]:
+        return self.batch_size, self.max_in_flight
+
+    def record(
+        self,
+        n_theories: int,
+        elapsed: float,
+        n_failed: int = 0,
+        rss: int | None = None,
+    ) -> None:
+        """Record a finished batch, adjusting after every ``window`` batches."""
+        self._batches += 1
+        self._theories += n_theories
+        self._failed += n_failed
+        self._seconds += elapsed
+        if rss is not None:
+            self._rss = max(rss, self._rss or 0)
+        if self._batches >= self.window:
+            self.adjust(time.perf_counter() - self._start)
+
+    def overloaded(self) -> str | None:
+        """Reason to back off in the current window, or ``None``."""
+        if self._failed > self.max_error_rate * self._theories:
+            return f"{self._failed} / {self._theories} failed theories"
+        if (
+            self.max_batch_seconds is not None
+            and self._batches
+            and self._seconds / self._batches > self.max_batch_seconds
+        ):
+            return f"{self._seconds / self._batches:.0f}s per batch"
+        if self.max_rss_mb is not None and (self._rss or 0) > self.max_rss_mb * 2**20:
+            return f"{self._rss / 2**20:.0f} MB server memory"
+        return None
+
+    def adjust(self, wall_time: float) -> None:
+        """Update the setting from the window so far and start a new one."""
+        self._adjust(wall_time)
+        self._reset_window()
+
+    def _adjust(self, wall_time: float) -> None:
+        if reason := self.overloaded():
+            print(f"Backing off after {reason}")
+            self.batch_size = max(1, self.batch_size // 2)
+            self.max_in_flight = max(1, self.max_in_flight // 2)
+            self._best, self._stalled = None, 0
+            return
+
+        throughput = self._theories / max(wall_time, 1e-9)
+        if self._best is None or throughput > self._best[0] * (1 + self.tolerance):
+            self._best = (throughput, *self.settings)
+            self._stalled = 0
+        elif throughput < self._best[0] * (1 - self.tolerance):
+            # the last step made things worse: go back and try the other one
+            _, self.batch_size, self.max_in_flight = self._best
+            self._switch()
+        else:
+            self._switch()
+        if self._stalled < 2:
+            self._step()
+
+    def _switch(self) -> None:
+        self._stalled += 1
+        self._dimension = (
+            "max_in_flight" if self._dimension == "batch_size" else "batch_size"
+        )
+
+    def _step(self) -> None:
+        if self._dimension == "batch_size":
+            if self.batch_size >= self.max_batch_size:
+                self._switch()
+                return
+            self.batch_size = min(self.max_batch_size, 2 * self.batch_size)
+        else:
+            if self.max_in_flight >= self.max_concurrency:
+                self._switch()
+                return
+            self.max_in_flight += 1
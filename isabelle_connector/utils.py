@@ -32,6 +32,7 @@ def list_theory_files(root_dir):
 def temp_theory(**kwargs):
     if "name" not in kwargs:
         kwargs["name"] = _get_or_create_theory_name(None)
+        kwargs["generated_name"] = True
     if "is_temp" not in kwargs:
         kwargs["is_temp"] = True
     return Theory(**kwargs)
@@ -61,11 +62,17 @@ def merge_thys(theories):
     for thy in theories:
         for imprt in thy.imports:
             imports.add(imprt)
-        theory.queries.extend(thy.queries)
+    theory.queries = [query for thy in theories for query in thy.queries]
     theory.imports = list(imports)
     return theory
 
 
+def ml_string(s: str) -> str:
+    """Quote ``s`` as an ML string literal."""
+    escaped = s.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'"{escaped}"'
+
+
 def flatten(l: list) -> list:
     return [item for sublist in l for item in sublist]
 
@@ -4,14 +4,14 @@ from isabelle_connector.isabelle_connector import (
 )
 
 def test_echo():
-    isabelle = IsabelleConnector(name="test", working_directory=".")
+    isabelle = IsabelleConnector(name="test", working_directory=".", daemon=True)
     responses = isabelle._client.echo("Hello World")
     response = responses[-1].response_body
     assert response == '"Hello World"'
 
 
 def test_use_thy():
-    isabelle = IsabelleConnector(name="test", working_directory=".")
+    isabelle = IsabelleConnector(name="test", working_directory=".", daemon=True)
     query = 'ML\\<open> let val res = "Hello, World!" in res end \\<close>'
     test_thy = temp_theory(
         working_directory=".",
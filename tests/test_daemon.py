@@ -0,0 +1,65 @@
+import os
+
+from isabelle_connector.daemon import ServerRegistry, watch
+from isabelle_connector.fake_server import FakeIsabelleServer
+from isabelle_connector.isabelle_connector import IsabelleConnector
+from isabelle_connector.utils import temp_theory
+
+
+def make_connector(tmp_path):
+    return IsabelleConnector(
+        name="shared",
+        daemon=True,
+        registry_path=str(tmp_path / "servers.json"),
+        working_directory=str(tmp_path),
+        cache_path=str(tmp_path / "results.sqlite"),
+    )
+
+
+def use_theory(connector, tmp_path, name):
+    thy = temp_theory(working_directory=str(tmp_path), queries=[], name=name)
+    values, _ = connector.use_theories([thy], rm_if_temp=False, use_cache=False)
+    return values[thy]
+
+
+def test_connectors_share_server_and_sessions(tmp_path):
+    registry = ServerRegistry(str(tmp_path / "servers.json"))
+    with FakeIsabelleServer() as server:
+        registry.register("shared", server.server_info, None, idle_timeout=600.0)
+
+        first = make_connector(tmp_path)
+        assert use_theory(first, tmp_path, "First") == ["First"]
+        assert registry.get("shared")["attached"] == {first.token: os.getpid()}
+        first.shutdown()
+        assert registry.get("shared")["attached"] == {}
+        n_starts = server.commands.count("session_start")
+
+        second = make_connector(tmp_path)
+        assert use_theory(second, tmp_path, "Second") == ["Second"]
+        # the warm sessions of the first connector were taken over
+        assert server.commands.count("session_start") == n_starts
+        assert "shutdown" not in server.commands
+        second.shutdown()
+
+
+def test_idle_server_is_shut_down(tmp_path):
+    registry = ServerRegistry(str(tmp_path / "servers.json"))
+    with FakeIsabelleServer() as server:
+        registry.register("shared", server.server_info, None, idle_timeout=0.0)
+        watch("shared", registry, poll=0.01)
+        assert "shutdown" in server.commands
+        assert registry.get("shared") is None
+
+
+def test_connectors_in_one_process_attach_separately(tmp_path):
+    registry = ServerRegistry(str(tmp_path / "servers.json"))
+    with FakeIsabelleServer() as server:
+        registry.register("shared", server.server_info, None, idle_timeout=0.0)
+        first = make_connector(tmp_path)
+        second = make_connector(tmp_path)
+        first.shutdown()
+        # the second connector is still attached, so the server is not idle
+        assert registry.get("shared")["attached"] == {second.token: os.getpid()}
+        assert registry.idle_since("shared") is None
+        second.shutdown()
+        assert registry.idle_since("shared") is not None
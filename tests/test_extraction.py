@@ -4,7 +4,7 @@ from isabelle_connector.isabelle_connector import (
 )
 
 def test_use_thy():
-    isabelle = IsabelleConnector(name="test", working_directory=".")
+    isabelle = IsabelleConnector(name="test", working_directory=".", daemon=True)
     query = 'ML\\<open> let val res = "Hello, World!" in res end \\<close>'
     test_thy = temp_theory(
         working_directory=".",
@@ -0,0 +1,226 @@
+from concurrent.futures import ThreadPoolExecutor
+import warnings
+
+import pytest
+
+from isabelle_connector.fake_server import FakeIsabelleServer
+from isabelle_connector.isabelle_connector import IsabelleConnector
+from isabelle_connector.sessions import RecyclePolicy
+from isabelle_connector.tuning import AdaptiveController
+from isabelle_connector.utils import temp_theory
+
+
+@pytest.fixture
+def server():
+    with FakeIsabelleServer(imported_nodes=2) as fake_server:
+        yield fake_server
+
+
+def make_connector(server, tmp_path):
+    return IsabelleConnector(
+        name="test",
+        server_info=server.server_info,
+        working_directory=str(tmp_path),
+        cache_path=str(tmp_path / "results.sqlite"),
+    )
+
+
+def test_echo(server, tmp_path):
+    isabelle = make_connector(server, tmp_path)
+    response = isabelle._client.echo("Hello World")[-1].response_body
+    assert response == '"Hello World"'
+
+
+def test_use_theories(server, tmp_path):
+    isabelle = make_connector(server, tmp_path)
+    thys = [
+        temp_theory(working_directory=str(tmp_path), queries=[], name=f"Test{i}")
+        for i in range(3)
+    ]
+    values, _ = isabelle.use_theories(thys, batch_size=3, rm_if_temp=False)
+    assert {thy.name: value for thy, value in values.items()} == {
+        f"Test{i}": [f"Test{i}"] for i in range(3)
+    }
+    assert server.commands.count("use_theories") == 1
+
+    # the second call is served from the result store
+    isabelle.use_theories(thys, batch_size=3, rm_if_temp=False)
+    assert server.commands.count("use_theories") == 1
+
+
+def test_on_node_sees_every_theory(server, tmp_path):
+    isabelle = make_connector(server, tmp_path)
+    thys = [
+        temp_theory(working_directory=str(tmp_path), queries=[], name=f"Test{i}")
+        for i in range(4)
+    ]
+    for _ in range(2):
+        # computed on the first call, cached on the second
+        seen = {}
+        messages = isabelle.collect_messages(
+            thys, batch_size=2, on_node=seen.setdefault
+        )
+        assert seen == messages
+        assert set(seen) == set(thys)
+
+
+def test_streamed_messages_are_not_kept(server, tmp_path):
+    isabelle = make_connector(server, tmp_path)
+    # two pieces of work, each shared by two theories with generated names
+    thys = [
+        temp_theory(working_directory=str(tmp_path), queries=queries)
+        for queries in [[], [], ["(* x *)"], ["(* x *)"]]
+    ]
+    seen = {}
+    finished = isabelle.collect_messages(
+        thys,
+        batch_size=2,
+        on_node=lambda thy, msgs: seen.setdefault(thy, msgs),
+        keep_messages=False,
+    )
+    assert finished == {thy: [] for thy in thys}
+    assert set(seen) == set(thys) and all(seen.values())
+    assert isabelle.store.contains_many(thys) == set(thys)
+
+
+def test_use_theories_with_sink(server, tmp_path):
+    pytest.importorskip("pyarrow")
+    from isabelle_connector.sinks import ArrowSink
+
+    isabelle = make_connector(server, tmp_path)
+    thys = [
+        temp_theory(working_directory=str(tmp_path), queries=[], name=f"Test{i}")
+        for i in range(3)
+    ]
+    with ArrowSink(str(tmp_path / "out")) as sink:
+        values, _ = isabelle.use_theories(
+            thys, batch_size=2, rm_if_temp=False, sink=sink
+        )
+    # ML values are not of the sink's kind and come back as usual
+    assert values == {thy: [thy.name] for thy in thys}
+    assert sink.n_rows == 0
+
+
+def test_injected_failure(tmp_path):
+    with FakeIsabelleServer(failure_rate=1.0) as server:
+        isabelle = make_connector(server, tmp_path)
+        thy = temp_theory(working_directory=str(tmp_path), queries=[], name="Test")
+        with pytest.warns(UserWarning, match="Injected failure"):
+            values, _ = isabelle.use_theories([thy], rm_if_temp=False)
+        assert values == {thy: []}
+
+
+def test_failed_batch_is_bisected(tmp_path):
+    with FakeIsabelleServer(failing_theories={"Test2"}) as server:
+        isabelle = make_connector(server, tmp_path)
+        thys = [
+            temp_theory(working_directory=str(tmp_path), queries=[], name=f"Test{i}")
+            for i in range(4)
+        ]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            values, _ = isabelle.use_theories(thys, batch_size=4, rm_if_temp=False)
+        assert {thy.name: value for thy, value in values.items()} == {
+            "Test0": ["Test0"],
+            "Test1": ["Test1"],
+            "Test2": [],
+            "Test3": ["Test3"],
+        }
+        assert isabelle.store.quarantined(thys) == {thys[2]}
+
+
+def test_auto_batch_size_is_persisted(server, tmp_path):
+    isabelle = make_connector(server, tmp_path)
+    thys = [
+        temp_theory(working_directory=str(tmp_path), queries=[], name=f"Test{i}")
+        for i in range(20)
+    ]
+    values, _ = isabelle.use_theories(
+        thys, batch_size="auto", rm_if_temp=False, workload="echo"
+    )
+    assert all(values[thy] == [thy.name] for thy in thys)
+    assert isabelle.store.get_tuning("echo") is not None
+
+
+def test_silent_theories_do_not_back_off(tmp_path):
+    with FakeIsabelleServer(messages_per_theory=0) as server:
+        isabelle = IsabelleConnector(
+            name="test",
+            server_info=server.server_info,
+            working_directory=str(tmp_path),
+            cache_path=str(tmp_path / "results.sqlite"),
+            adaptive=AdaptiveController(
+                batch_size=2, max_in_flight=2, window=2, max_batch_seconds=None
+            ),
+        )
+        thys = [
+            temp_theory(working_directory=str(tmp_path), queries=[], name=f"Test{i}")
+            for i in range(12)
+        ]
+        isabelle.use_theories(
+            thys, batch_size="auto", rm_if_temp=False, workload="silent"
+        )
+        # theories that finish without output are no failures to back off from
+        batch_size, max_in_flight = isabelle.store.get_tuning("silent")
+        assert batch_size >= 2 and max_in_flight >= 2
+
+
+def test_identical_temp_theories_are_coalesced(tmp_path):
+    with FakeIsabelleServer(latency=0.2) as server:
+        isabelle = make_connector(server, tmp_path)
+        # theories with generated names and the same content do the same work
+        thys = [
+            temp_theory(working_directory=str(tmp_path), queries=[]) for _ in range(6)
+        ]
+        with ThreadPoolExecutor(2) as executor:
+            results = list(
+                executor.map(
+                    lambda part: isabelle.collect_messages(part, batch_size=3),
+                    [thys[:3], thys[3:]],
+                )
+            )
+        assert server.commands.count("use_theories") == 1
+        assert all(len(messages) == 3 for messages in results)
+        # the theories that shared a result are stored as well
+        assert isabelle.store.contains_many(thys) == set(thys)
+
+
+def test_error_rate_recycles_session_between_batches(tmp_path):
+    with FakeIsabelleServer(error_rate=1.0) as server:
+        isabelle = IsabelleConnector(
+            name="test",
+            server_info=server.server_info,
+            working_directory=str(tmp_path),
+            cache_path=str(tmp_path / "results.sqlite"),
+            recycle_policy=RecyclePolicy(
+                max_theories=None, time_drift=None, max_error_rate=0.5, min_theories=2
+            ),
+        )
+        thys = [
+            temp_theory(working_directory=str(tmp_path), queries=[], name=f"Test{i}")
+            for i in range(6)
+        ]
+        isabelle.use_theories(thys, batch_size=2, rm_if_temp=False)
+        # sessions are assigned per batch, after the errors of the previous one
+        assert len({thy.session_id for thy in thys}) == 3
+
+
+def test_silent_theories_do_not_count_as_errors(tmp_path):
+    with FakeIsabelleServer(messages_per_theory=0) as server:
+        isabelle = IsabelleConnector(
+            name="test",
+            server_info=server.server_info,
+            working_directory=str(tmp_path),
+            cache_path=str(tmp_path / "results.sqlite"),
+            recycle_policy=RecyclePolicy(
+                max_theories=None, time_drift=None, max_error_rate=0.5, min_theories=2
+            ),
+        )
+        thys = [
+            temp_theory(working_directory=str(tmp_path), queries=[], name=f"Test{i}")
+            for i in range(6)
+        ]
+        values, _ = isabelle.use_theories(thys, batch_size=2, rm_if_temp=False)
+        assert values == {thy: [] for thy in thys}
+        # finished theories without output keep their session
+        assert len({thy.session_id for thy in thys}) == 1
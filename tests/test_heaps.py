@@ -0,0 +1,47 @@
+from isabelle_connector.heaps import ToolSessions
+from isabelle_connector.utils import temp_theory
+
+
+def make_tools(tmp_path):
+    tools_dir = tmp_path / "tools"
+    tools_dir.mkdir()
+    (tools_dir / "Tool.thy").write_text(
+        'theory Tool imports Main begin ML_file "Tool.ML" end'
+    )
+    (tools_dir / "Tool.ML").write_text("val x = 1")
+    return ToolSessions(
+        tools_dir=str(tools_dir), theories=["Tool"], build_dir=str(tmp_path / "heaps")
+    )
+
+
+def test_sessions_are_versioned_by_source(tmp_path):
+    tools = make_tools(tmp_path)
+    session_dir = tools.generate("HOL-Auth")
+    with open(f"{session_dir}/ROOT", encoding="utf8") as root_file:
+        assert 'session "HOL-Auth_Tools" = "HOL-Auth" +' in root_file.read()
+    (tmp_path / "tools" / "Tool.ML").write_text("val x = 2")
+    changed = ToolSessions(
+        tools_dir=tools.tools_dir, theories=["Tool"], build_dir=tools.build_dir
+    )
+    assert changed.session_dir("HOL-Auth") != session_dir
+
+
+def test_tool_imports_use_derived_session(tmp_path):
+    tools = make_tools(tmp_path)
+    built = []
+    tools.build = lambda session, dirs: built.append(session) or "/heaps/derived"
+    thy = temp_theory(
+        name="Wrapper",
+        working_directory=str(tmp_path / "work"),
+        session="HOL-Auth",
+        imports=["../tools/Tool", "HOL-Auth.Message"],
+        is_temp=False,
+    )
+    assert tools.prepare(thy, []) == "/heaps/derived"
+    assert thy.session == "HOL-Auth_Tools"
+    assert thy.imports == ("HOL-Auth_Tools.Tool", "HOL-Auth.Message")
+    assert built == ["HOL-Auth"]
+
+    other = temp_theory(name="Plain", working_directory=".", imports=[], is_temp=False)
+    assert tools.prepare(other, []) is None
+    assert other.session == "HOL"
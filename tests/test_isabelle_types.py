@@ -0,0 +1,12 @@
+from pathlib import Path
+
+from isabelle_connector.isabelle_types import Theory
+
+
+def test_theory_with_path_working_directory(tmp_path):
+    thy = Theory(
+        name="Scratch", working_directory=tmp_path, imports=[Path("Foo"), "Bar"]
+    )
+    assert thy.working_directory == str(tmp_path)
+    assert thy.imports == ("Foo", "Bar")
+    assert thy.working_directory is Theory("Other", str(tmp_path)).working_directory
@@ -0,0 +1,69 @@
+import subprocess
+import sys
+import time
+
+from isabelle_connector.fake_server import FakeIsabelleServer
+from isabelle_connector.jobs import JobQueue
+from isabelle_connector.utils import temp_theory
+
+
+def make_theories(tmp_path, n):
+    return [
+        temp_theory(
+            working_directory=str(tmp_path / "thys"),
+            queries=[],
+            name=f"Job{i}",
+            is_temp=False,
+        )
+        for i in range(n)
+    ]
+
+
+def test_leases_and_resume(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    assert queue.submit(make_theories(tmp_path, 3)) == 3
+    assert queue.submit(make_theories(tmp_path, 3)) == 0
+
+    claimed = queue.claim("a", 2, lease_seconds=0.0)
+    assert [thy.name for thy in claimed] == ["Job0", "Job1"]
+    assert [thy.name for thy in queue.claim("b", 5, lease_seconds=60.0)] == ["Job2"]
+    queue.finish("b", [], {"Job2": "boom"})
+    # a late finish of another owner does not count
+    queue.finish("b", ["Job0"])
+    assert queue.counts() == {"pending": 0, "running": 2, "done": 0, "failed": 1}
+
+    time.sleep(0.01)
+    assert queue.resume() == 2
+    assert queue.resume(failed=True) == 1
+    assert queue.counts()["pending"] == 3
+
+
+def test_workers_share_the_queue(tmp_path):
+    queue_path = str(tmp_path / "jobs.sqlite")
+    cache_path = str(tmp_path / "results.sqlite")
+    thys = make_theories(tmp_path, 40)
+    JobQueue(queue_path).submit(thys)
+
+    with FakeIsabelleServer(latency=0.005) as server:
+        command = [
+            sys.executable,
+            "-m",
+            "isabelle_connector.jobs",
+            "worker",
+            queue_path,
+            "--batch-size",
+            "4",
+            "--server-info",
+            server.server_info,
+            "--working-directory",
+            str(tmp_path / "worker"),
+            "--cache-path",
+            cache_path,
+        ]
+        workers = [subprocess.Popen(command) for _ in range(3)]
+        assert [worker.wait(timeout=60) for worker in workers] == [0, 0, 0]
+
+    queue = JobQueue(queue_path)
+    assert queue.counts()["done"] == 40
+    attempts = queue.connection().execute("SELECT MAX(attempts) FROM jobs").fetchone()
+    assert attempts == (1,)
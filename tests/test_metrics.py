@@ -0,0 +1,38 @@
+import json
+
+from isabelle_connector.metrics import Metrics
+
+
+def test_disabled_metrics_record_nothing(tmp_path):
+    metrics = Metrics(jsonl_path=str(tmp_path / "metrics.jsonl"))
+    with metrics.span("phase"):
+        metrics.count("cache_hits")
+    metrics.flush()
+    assert metrics.counters == {} and metrics.histograms == {}
+    assert not (tmp_path / "metrics.jsonl").exists()
+
+
+def test_metrics_export(tmp_path):
+    metrics = Metrics(
+        enabled=True,
+        jsonl_path=str(tmp_path / "metrics.jsonl"),
+        prometheus_path=str(tmp_path / "metrics.prom"),
+    )
+    with metrics.span("decode_responses", theories=2):
+        pass
+    metrics.count("cache_hits", 3)
+    metrics.count("cache_misses", 1)
+    metrics.observe("batch_seconds", 0.2)
+    metrics.observe("batch_seconds", 20.0)
+    metrics.flush()
+
+    lines = (tmp_path / "metrics.jsonl").read_text().splitlines()
+    records = [json.loads(line) for line in lines]
+    assert records[0]["span"] == "decode_responses" and records[0]["theories"] == 2
+    assert records[-1]["snapshot"]["cache_hit_ratio"] == 0.75
+
+    prometheus = (tmp_path / "metrics.prom").read_text()
+    assert "isabelle_connector_cache_hits_total 3" in prometheus
+    assert 'isabelle_connector_batch_seconds_bucket{le="0.5"} 1' in prometheus
+    assert 'isabelle_connector_batch_seconds_bucket{le="+Inf"} 2' in prometheus
+    assert "isabelle_connector_decode_responses_seconds_count 1" in prometheus
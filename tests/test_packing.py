@@ -0,0 +1,46 @@
+from isabelle_connector.packing import pack_key, pack_theories
+from isabelle_connector.utils import temp_theory
+
+
+def make_theory(i, imports=()):
+    return temp_theory(
+        working_directory=".",
+        queries=[f'ML\\<open> let val res = "{i}" in res end \\<close>'],
+        imports=list(imports),
+        name=f"Probe{i}",
+        is_temp=False,
+    )
+
+
+def test_pack_groups_compatible_theories():
+    thys = [make_theory(i) for i in range(5)] + [make_theory(5, ["Lib"])]
+    packs = pack_theories(thys, max_queries=3)
+    assert [len(packed.sources) for packed in packs] == [3, 2, 1]
+    # the same queries give the same packed theory, so results can be cached
+    assert pack_theories(thys, max_queries=3)[0].theory.name == packs[0].theory.name
+    # but not the same queries under other imports
+    with_lib = [make_theory(i, ["Lib"]) for i in range(2)]
+    assert pack_key(with_lib) != pack_key(thys[:2])
+
+
+def test_unpack_by_position_and_marker():
+    thys = [make_theory(i) for i in range(3)]
+    (packed,) = pack_theories(thys)
+    lines = repr(packed.theory).splitlines()
+    query_lines = [
+        lineno for lineno, line in enumerate(lines, 1) if "let val res" in line
+    ]
+    messages = [
+        {"kind": "writeln", "message": "packed_query 0"},
+        {"kind": "writeln", "message": 'val it = "0": string'},
+        {"kind": "writeln", "message": "packed_query 1"},
+        {"kind": "writeln", "message": "packed_query 2"},
+        {"kind": "writeln", "message": 'val it = "2": string'},
+        # reported out of order, but its position places it in the second query
+        {"kind": "error", "message": "Bad", "pos": {"line": query_lines[1]}},
+    ]
+    assert packed.unpack(messages) == {
+        thys[0]: [messages[1]],
+        thys[1]: [messages[5]],
+        thys[2]: [messages[4]],
+    }
@@ -0,0 +1,105 @@
+import json
+import tracemalloc
+
+from isabelle_client.socket_communication import IsabelleResponse
+from isabelle_connector.parse import (
+    extract_finished_messages,
+    extract_ml_values_from_thy_messages,
+    iter_finished_nodes,
+)
+from isabelle_connector.store import ResultStore
+from isabelle_connector.utils import temp_theory
+
+
+def make_theory(name):
+    return temp_theory(name=name, working_directory=".", imports=[], is_temp=False)
+
+
+def test_ml_and_json_values():
+    messages = [
+        {
+            "kind": "writeln",
+            "message": 'val it = ("A", [1, 2], true): string * int list * bool',
+        },
+        {"kind": "writeln", "message": 'json_value rows [["A",[1,2],true],"x\\"y"]'},
+        {"kind": "writeln", "message": "some other output"},
+        {"kind": "error", "message": "Undefined constant"},
+    ]
+    values, errs = extract_ml_values_from_thy_messages(messages)
+    assert values == [("A", [1, 2], True), [["A", [1, 2], True], 'x"y']]
+    assert errs == ["Undefined constant"]
+
+
+def finished_body(theories, imported_nodes, message_size):
+    def node(theory_name):
+        return {
+            "node_name": f"/{theory_name}.thy",
+            "theory_name": theory_name,
+            "status": {"ok": True},
+            "messages": [
+                {"kind": "writeln", "message": f'val it = "{theory_name}": string'},
+                {"kind": "writeln", "message": "x" * message_size, "pos": {"line": 1}},
+            ],
+            "exports": [],
+        }
+
+    nodes = [node(f"HOL.Imported{i}") for i in range(imported_nodes)]
+    nodes += [node(f"Draft.{theory}") for theory in theories]
+    return json.dumps({"ok": True, "errors": [], "nodes": nodes, "task": "t"}, indent=1)
+
+
+def test_streamed_nodes_match_full_decoding():
+    body = finished_body(["A", "Bé"], imported_nodes=3, message_size=10)
+    expected = {
+        node["theory_name"].removeprefix("Draft."): node["messages"]
+        for node in json.loads(body)["nodes"]
+        if node["theory_name"].startswith("Draft.")
+    }
+    assert dict(iter_finished_nodes(body, {"A", "Bé"})) == expected
+    assert dict(iter_finished_nodes(body, {"A"})) == {"A": expected["A"]}
+
+
+def test_imported_nodes_are_not_kept(tmp_path):
+    thys = [make_theory("A"), make_theory("B")]
+    body = finished_body(["A", "B"], imported_nodes=200, message_size=20_000)
+    responses = [IsabelleResponse("FINISHED", body, len(body))]
+    seen = []
+
+    def peak(decode):
+        tracemalloc.start()
+        try:
+            result = decode()
+            return result, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    store = ResultStore(str(tmp_path / "results.db"))
+    streamed, streamed_peak = peak(
+        lambda: extract_finished_messages(
+            thys, responses, store, on_node=lambda thy, _: seen.append(thy.name)
+        )
+    )
+    _, full_peak = peak(lambda: json.loads(body))
+    assert seen == ["A", "B"]
+    assert store.get(thys[1]) == streamed[thys[1]]
+    assert streamed_peak < full_peak / 4
+
+
+def test_finished_nodes_are_stored_in_batches(tmp_path):
+    names = [f"T{i}" for i in range(5)]
+    thys = [make_theory(name) for name in names]
+    body = finished_body(names, imported_nodes=0, message_size=10)
+    responses = [IsabelleResponse("FINISHED", body, len(body))]
+    store = ResultStore(str(tmp_path / "results.db"))
+    writes = []
+    put_many = store.put_many
+
+    def counting_put_many(results, **kwargs):
+        writes.append(len(results))
+        put_many(results, **kwargs)
+
+    store.put_many = counting_put_many
+
+    extract_finished_messages(thys, responses, store, store_batch=2)
+    assert writes == [2, 2, 1]
+    assert store.contains_many(thys) == set(thys)
@@ -0,0 +1,43 @@
+from isabelle_connector.scheduler import schedule_batches
+from isabelle_connector.utils import temp_theory
+
+
+def make_theory(name, session="HOL", imports=()):
+    return temp_theory(
+        name=name,
+        working_directory=".",
+        session=session,
+        imports=list(imports),
+        is_temp=False,
+    )
+
+
+def test_batches_do_not_mix_sessions_or_imports():
+    thys = [
+        make_theory("A1", imports=["Lib"]),
+        make_theory("B1", session="HOL-Auth"),
+        make_theory("A2", imports=["Lib"]),
+        make_theory("C1"),
+        make_theory("A3", imports=["Lib"]),
+    ]
+    batches = schedule_batches(thys, batch_size=2)
+    assert sorted(len(batch) for batch in batches) == [1, 1, 1, 2]
+    for batch in batches:
+        assert len({(thy.session, tuple(thy.imports)) for thy in batch}) == 1
+
+
+def test_batches_are_balanced_by_cost():
+    thys = [make_theory(f"T{i}") for i in range(4)]
+    timings = {"T0": 10.0, "T1": 9.0, "T2": 1.0, "T3": 1.0}
+    batches = schedule_batches(thys, batch_size=2, timings=timings)
+    assert sorted(sorted(thy.name for thy in batch) for batch in batches) == [
+        ["T0", "T3"],
+        ["T1", "T2"],
+    ]
+
+
+def test_isolated_theories_run_alone():
+    thys = [make_theory(f"T{i}") for i in range(4)]
+    batches = schedule_batches(thys, batch_size=4, isolated={thys[1]})
+    assert batches[-1] == [thys[1]]
+    assert sorted(len(batch) for batch in batches) == [1, 3]
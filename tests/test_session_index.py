@@ -0,0 +1,113 @@
+from argparse import Namespace
+
+from isabelle_connector.data_extraction import (
+    session_extraction_theories,
+    template_and_type_extraction_theory,
+)
+from isabelle_connector.session_index import SessionIndex, parse_root
+from isabelle_connector.utils import temp_theory
+
+HOL_ROOT = """
+chapter HOL
+
+session HOL (main) = Pure +
+  description \\<open>Classical Higher-order Logic (* not a comment *)\\<close>
+  options [strict_facts]
+  theories
+    Main (global)
+    Complex_Main (global)
+  document_files (in "document") "root.tex"
+
+(* session Commented = HOL + theories Gone *)
+session "HOL-Library" (main timing) in Library = HOL +
+  options [document_variants = "document:outline=/proof,/ML"]
+  theories
+    Multiset
+    "FSet"
+
+session "HOL-Auth" (timing) in "Auth" = "HOL-Library" +
+  directories "Smartcard"
+  theories [document = false]
+    Message
+    "Smartcard/Smartcard"
+"""
+
+AFP_ROOT = """
+session Entry = "HOL-Library" +
+  sessions "HOL-Auth"
+  theories Entry_Thy
+"""
+
+
+def make_tree(tmp_path):
+    (tmp_path / "HOL").mkdir()
+    (tmp_path / "HOL" / "ROOT").write_text(HOL_ROOT)
+    (tmp_path / "afp" / "Entry").mkdir(parents=True)
+    (tmp_path / "afp" / "ROOTS").write_text("# entries\nEntry\n")
+    (tmp_path / "afp" / "Entry" / "ROOT").write_text(AFP_ROOT)
+    return SessionIndex([str(tmp_path / "HOL"), str(tmp_path / "afp")])
+
+
+def test_parse_root(tmp_path):
+    sessions = {
+        session.name: session for session in parse_root(HOL_ROOT, str(tmp_path))
+    }
+    assert list(sessions) == ["HOL", "HOL-Library", "HOL-Auth"]
+    assert sessions["HOL"].parent == "Pure"
+    assert sessions["HOL-Auth"].parent == "HOL-Library"
+    assert sessions["HOL-Auth"].directory == str(tmp_path / "Auth")
+    assert sessions["HOL-Auth"].theories == [
+        str(tmp_path / "Auth" / "Message"),
+        str(tmp_path / "Auth" / "Smartcard" / "Smartcard"),
+    ]
+    assert [len(session.theories) for session in sessions.values()] == [2, 2, 2]
+
+
+def test_resolve_sessions(tmp_path):
+    index = make_tree(tmp_path)
+    assert index.ancestors("Entry") == ["Entry", "HOL-Library", "HOL"]
+    names = [("HOL", "Auth/Smartcard/Smartcard"), ("afp", "Entry/Entry_Thy")]
+    src_thys = [
+        temp_theory(working_directory=str(tmp_path / root), name=name, is_temp=False)
+        for root, name in names
+    ]
+    assert [index.resolve(thy) for thy in src_thys] == ["HOL-Auth", "Entry"]
+
+    # a theory outside all sessions runs in the smallest image covering its imports
+    (tmp_path / "Scratch.thy").write_text(
+        'theory Scratch imports "HOL-Library.Multiset" Main begin end'
+    )
+    scratch = temp_theory(
+        working_directory=str(tmp_path), name="Scratch", is_temp=False
+    )
+    assert index.resolve(scratch) == "HOL-Library"
+    assert index.covering_session(["HOL-Auth", "HOL-Library"]) == "HOL-Auth"
+    assert index.covering_session(["HOL-Auth", "Entry"]) is None
+
+
+def test_extraction_imports_unlisted_theories_by_path(tmp_path):
+    make_tree(tmp_path)
+    configs = Namespace(
+        session_dirs=[str(tmp_path / "HOL"), str(tmp_path / "afp")],
+        root_dir=tmp_path,
+        imports=[],
+    )
+    listed = temp_theory(
+        working_directory=str(tmp_path / "HOL"),
+        name="Auth/Smartcard/Smartcard",
+        is_temp=False,
+    )
+    (tmp_path / "Scratch.thy").write_text(
+        'theory Scratch imports "HOL-Library.Multiset" Main begin end'
+    )
+    scratch = temp_theory(
+        working_directory=str(tmp_path), name="Scratch", is_temp=False
+    )
+    [auth_wrapper] = session_extraction_theories([listed], configs)
+    assert auth_wrapper.imports == ("HOL-Auth.Smartcard",)
+    # HOL-Library covers the imports of Scratch but does not contain it
+    [scratch_wrapper] = session_extraction_theories([scratch], configs)
+    assert scratch_wrapper.session == "HOL-Library"
+    assert scratch_wrapper.imports == (str(tmp_path / "Scratch"),)
+    wrapper = template_and_type_extraction_theory(scratch, configs)
+    assert wrapper.imports == (str(tmp_path / "Scratch"),)
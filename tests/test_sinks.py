@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from isabelle_connector.sinks import SCHEMAS, sink_values
+from isabelle_connector.utils import temp_theory
+
+
+def extraction_value(theory, n_rows):
+    return [
+        [theory, f"{theory}.thm_{i}", f"x + {i} = {i} + x", ["plus"], ["nat"], "?H1"]
+        for i in range(n_rows)
+    ]
+
+
+def json_message(name, value):
+    return {"kind": "writeln", "message": f"json_value {name} {json.dumps(value)}"}
+
+
+def test_rows_match_schemas():
+    value = ["Foo", [["lemma", "lemma x: True by simp"], ["end", "end"]]]
+    rows = list(SCHEMAS["transitions"].rows(value))
+    assert rows == [("Foo", "lemma", "lemma x: True by simp"), ("Foo", "end", "end")]
+    for schema in SCHEMAS.values():
+        assert len({name for name, _ in schema.columns}) == len(schema.columns)
+
+
+@pytest.mark.parametrize("format", ["parquet", "arrow"])
+def test_sink_shards_round_trip(tmp_path, format):
+    pytest.importorskip("pyarrow")
+    from isabelle_connector.sinks import ArrowSink, read_shards
+
+    thys = [
+        temp_theory(
+            working_directory=str(tmp_path), name=f"Extract_T{i}", is_temp=False
+        )
+        for i in range(5)
+    ]
+    messages = {
+        thy: [
+            json_message("extraction", extraction_value(f"T{i}", 7)),
+            json_message("transitions", [f"T{i}", []]),
+        ]
+        for i, thy in enumerate(thys)
+    }
+    with ArrowSink(
+        str(tmp_path / "out"), format=format, row_group_size=10, rows_per_shard=20
+    ) as sink:
+        values, _, n_rows = sink_values(messages, sink)
+
+    assert not messages
+    # values of other kinds are returned as they are
+    assert values == {thy: [[f"T{i}", []]] for i, thy in enumerate(thys)}
+    assert sum(n_rows.values()) == 35
+    assert len(sink.paths) == 2
+    table = read_shards(str(tmp_path / "out"))
+    assert table.num_rows == 35
+    assert table.column("theory").type.value_type == table.column("name").type
+    row = table.slice(8, 1).to_pylist()[0]
+    assert row["name"] == "T1.thm_1"
+    assert row["symbols"] == ["plus"]
@@ -0,0 +1,68 @@
+import os
+
+from isabelle_connector.source_index import SourceIndex, parse_imports
+
+
+def write_theory(path, name, imports):
+    with open(path / f"{name}.thy", "w", encoding="utf8") as theory_file:
+        theory_file.write(f"theory {name}\n  imports {' '.join(imports)}\nbegin\nend\n")
+    return str(path / f"{name}.thy")
+
+
+def test_parse_imports():
+    text = 'theory A (* imports X begin *)\nimports Main "HOL-Library.Multiset" "../B"\nkeywords "foo" :: thy_decl\nbegin'
+    assert parse_imports(text) == ["Main", "HOL-Library.Multiset", "../B"]
+
+
+def test_dirty_set_follows_imports(tmp_path):
+    a = write_theory(tmp_path, "A", ["Main"])
+    b = write_theory(tmp_path, "B", ["A"])
+    c = write_theory(tmp_path, "C", ['"Other.B"'])
+    d = write_theory(tmp_path, "D", ["Main"])
+    paths = [a, b, c, d]
+
+    index = SourceIndex(str(tmp_path / "index.json"))
+    assert index.update(paths) == set(paths)
+    index.save()
+
+    index = SourceIndex(str(tmp_path / "index.json"))
+    assert index.update(paths) == set()
+
+    write_theory(tmp_path, "A", ["Main", "Complex_Main"])
+    os.utime(a, (0, 0))
+    assert index.update(paths) == {a, b, c}
+
+
+def test_update_rescans_imported_files(tmp_path):
+    a = write_theory(tmp_path, "A", ["Main"])
+    b = write_theory(tmp_path, "B", ["A"])
+
+    index = SourceIndex(str(tmp_path / "index.json"))
+    assert index.update([b]) == {b}
+    index.save()
+
+    # a loaded index resolves imports before any update
+    index = SourceIndex(str(tmp_path / "index.json"))
+    assert index.resolve(b, "A") == [a]
+
+    # A is not passed, but B is dirty because its import changed
+    write_theory(tmp_path, "A", ["Main", "Complex_Main"])
+    os.utime(a, (0, 0))
+    assert index.update([b]) == {b}
+
+
+def test_update_keeps_base_names_in_step(tmp_path):
+    (tmp_path / "lib").mkdir()
+    lib = write_theory(tmp_path / "lib", "Lib", ["Main"])
+    a = write_theory(tmp_path, "A", ['"lib/Lib"'])
+    b = write_theory(tmp_path, "B", ["Other.Lib"])
+
+    index = SourceIndex(str(tmp_path / "index.json"))
+    index.update([a])
+    # Lib was reached from A, so B's qualified import resolves to it
+    assert index.resolve(b, "Other.Lib") == [lib]
+
+    os.remove(lib)
+    index.update([a])
+    assert lib not in index.entries
+    assert index.resolve(b, "Other.Lib") == []
@@ -0,0 +1,72 @@
+from isabelle_connector.store import ResultStore
+from isabelle_connector.utils import temp_theory
+
+
+def make_theory(i):
+    return temp_theory(
+        working_directory=".",
+        queries=[f'ML\\<open> let val res = "{i}" in res end \\<close>'],
+        imports=[],
+        name=f"Test{i}",
+        is_temp=False,
+    )
+
+
+def test_store_roundtrip(tmp_path):
+    store = ResultStore(path=str(tmp_path / "results.sqlite"), isabelle_version="v")
+    thys = [make_theory(i) for i in range(3)]
+    messages = [{"kind": "writeln", "message": 'val it = "0": string'}]
+    store.put(thys[0], messages)
+
+    assert store.contains_many(thys) == {thys[0]}
+    assert store.get_many(thys) == {thys[0]: messages}
+    assert store.get(thys[1]) is None
+
+    # a different Isabelle version must not see the result
+    other = ResultStore(path=str(tmp_path / "results.sqlite"), isabelle_version="w")
+    assert other.get(thys[0]) is None
+
+    # the key is the content, so changing the theory invalidates the result
+    thys[0].add_ml_block('val other = "other"')
+    assert store.get(thys[0]) is None
+
+
+def test_store_evicts_least_recently_used(tmp_path):
+    store = ResultStore(path=str(tmp_path / "results.sqlite"))
+    thys = [make_theory(i) for i in range(3)]
+    for thy in thys:
+        store.put(thy, [{"kind": "writeln", "message": thy.name * 100}])
+    store.get(thys[0])
+
+    store.evict(store.size() - 1)
+    assert store.contains_many(thys) == {thys[0], thys[2]}
+
+
+def test_store_quarantine(tmp_path):
+    store = ResultStore(path=str(tmp_path / "results.sqlite"))
+    thys = [make_theory(i) for i in range(3)]
+    store.quarantine(thys[1], "failed 2 attempts")
+    assert store.quarantined(thys) == {thys[1]}
+
+    thys[1].add_ml_block('val other = "other"')
+    assert store.quarantined(thys) == set()
+
+
+def test_store_key_covers_directory_and_source(tmp_path):
+    store = ResultStore(path=str(tmp_path / "results.sqlite"))
+    messages = [{"kind": "writeln", "message": 'val it = "0": string'}]
+    trees = [tmp_path / "a", tmp_path / "b"]
+    for tree in trees:
+        tree.mkdir()
+        (tree / "Source.thy").write_text("theory Source imports Main begin end")
+    thys = [
+        temp_theory(working_directory=str(tree), name="Source", is_temp=False)
+        for tree in trees
+    ]
+    store.put(thys[0], messages)
+    # a same-named theory of another tree does not share the result
+    assert store.contains_many(thys) == {thys[0]}
+
+    # editing the source file invalidates the result
+    (trees[0] / "Source.thy").write_text("theory Source imports Main begin\nend")
+    assert store.get(thys[0]) is None
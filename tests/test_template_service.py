@@ -0,0 +1,47 @@
+from isabelle_connector.template_service import (
+    TemplateClient,
+    TemplateServer,
+    prefetch_templates,
+)
+from isabelle_connector.utils import temp_theory
+
+
+def test_batches_share_one_connection_and_cache():
+    with TemplateServer() as server:
+        client = TemplateClient(server.url, batch_size=2)
+        responses = client.get([["plus", "times"], ["rev"], ["times", "plus"], ["map"]])
+        assert responses[0] == responses[2]
+        assert '"rev"' in responses[1]
+        assert server.requests == ["/generate_templates_batch"] * 2
+        assert server.connections == 1
+
+        client.get([["rev"], ["map"]])
+        assert len(server.requests) == 2
+
+
+def test_falls_back_to_single_requests():
+    with TemplateServer(batch_endpoint=False) as server:
+        client = TemplateClient(server.url)
+        assert len(client.get([["a"], ["b"]])) == 2
+        assert (
+            server.requests
+            == ["/generate_templates_batch"] + ["/generate_templates"] * 2
+        )
+        assert server.connections == 1
+
+
+def test_prefetch_primes_theories():
+    thys = [
+        temp_theory(name=f"T{i}", working_directory=".", imports=[], is_temp=False)
+        for i in range(3)
+    ]
+    with TemplateServer() as server:
+        client = TemplateClient(server.url, batch_size=1)
+        responses = prefetch_templates(
+            thys, lambda thy: [[thy.name], ["shared"]], client, max_workers=2
+        )
+    assert len(responses) == 4
+    assert len(server.requests) == 4
+    for thy in thys:
+        assert thy.queries[0].startswith("ML\\<open>\nGet_Templates.prime [")
+        assert f'["{thy.name}"]' in thy.queries[0]
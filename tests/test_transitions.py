@@ -0,0 +1,18 @@
+import pytest
+
+from isabelle_connector.data_extraction import iter_transitions
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_spans_are_byte_offsets(tmp_path, use_mmap):
+    text = 'theory T imports Main begin\nlemma "∀x. x = x" by simp\nend\n'
+    path = tmp_path / "T.thy"
+    path.write_text(text, encoding="utf8")
+    data = text.encode("utf8")
+    lemma, end = data.index(b"lemma"), data.index(b"end\n")
+    spans = [("theory", 0, lemma), ("lemma", lemma, end), ("end", end, len(data))]
+
+    transitions = list(iter_transitions(str(path), spans, use_mmap=use_mmap))
+    assert [name for name, _ in transitions] == ["theory", "lemma", "end"]
+    assert "".join(text for _, text in transitions) == text
+    assert transitions[1][1] == 'lemma "∀x. x = x" by simp\n'
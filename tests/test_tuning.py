@@ -0,0 +1,25 @@
+from isabelle_connector.tuning import AdaptiveController
+
+
+def run_window(controller, n_theories, n_failed=0):
+    controller.record(n_theories, 1.0, n_failed)
+    controller.adjust(wall_time=1.0)
+
+
+def test_controller_climbs_while_throughput_improves():
+    controller = AdaptiveController(
+        batch_size=4, max_in_flight=2, max_concurrency=8, window=100
+    )
+    run_window(controller, 10)
+    assert controller.settings == (8, 2)
+    run_window(controller, 20)
+    assert controller.settings == (16, 2)
+    # worse throughput restores the best setting and tries more concurrency
+    run_window(controller, 5)
+    assert controller.settings == (8, 3)
+
+
+def test_controller_backs_off_on_failures():
+    controller = AdaptiveController(batch_size=16, max_in_flight=4, window=100)
+    run_window(controller, 10, n_failed=5)
+    assert controller.settings == (8, 2)